@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import delphi
+import dumpgen
+import export
+import oracle
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def latency(function, arguments, repeat=1):
+    """
+    Times a function over a list of argument tuples.
+
+    :return: Dictionary of latency percentiles in microseconds
+    """
+    samples = []
+    for args in arguments:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(*args)
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {'calls': len(samples),
+            'mean_us': 1e6 * sum(samples) / len(samples),
+            'p50_us': 1e6 * samples[len(samples) // 2],
+            'p99_us': 1e6 * samples[min(len(samples) - 1, int(len(samples) * 0.99))]}
+
+
+def bench_size(directory, count, distribution, factbook, queries, seed):
+    """
+    Runs every benchmark against one synthetic dump.
+
+    :return: Dictionary of results
+    """
+    rng = random.Random(seed)
+    path = os.path.join(directory, "regions-{}.xml.gz".format(count))
+    start = time.perf_counter()
+    dumpgen.generate(path, count, distribution, factbook, seed=seed)
+    results = {'regions': count,
+               'dump_bytes': os.path.getsize(path),
+               'generate_seconds': time.perf_counter() - start}
+
+    # startup: a cold parse (timed without and with memory tracing, which slows parsing), then a snapshot load
+    start = time.perf_counter()
+    parsed = oracle.Oracle(path, "oracle2 benchmark")
+    results['parse_seconds'] = time.perf_counter() - start
+    profiled = oracle.Oracle(path, "oracle2 benchmark", profile=True, snapshot=False)
+    results['parse_peak_bytes'] = profiled.load_stats['peak_memory']
+    del profiled
+    start = time.perf_counter()
+    o = oracle.Oracle(path, "oracle2 benchmark")
+    results['snapshot_load_seconds'] = time.perf_counter() - start
+    del parsed
+
+    names = [(rng.choice(o.table.names), 'major') for _ in range(queries)]
+    results['get_time'] = latency(o.get_time, names)
+    results['get_info'] = latency(lambda region, mode: o.get_info(region), names)
+    results['get_times_all_seconds'] = latency(o.get_times, [('major',)])['mean_us'] / 1e6
+    results['region_at'] = latency(o.region_at, [(rng.uniform(0, 3600), 'major') for _ in range(queries)])
+
+    results['export'] = {}
+    for fmt in export.WRITERS:
+        target = os.path.join(directory, "export-{}.{}".format(count, fmt))
+        start = time.perf_counter()
+        o.export(target, fmt)
+        elapsed = time.perf_counter() - start
+        results['export'][fmt] = {'seconds': elapsed,
+                                  'rows_per_second': count / elapsed,
+                                  'bytes': os.path.getsize(target)}
+        os.remove(target)
+
+    # Delphi commands, against an API address that is never contacted
+    shell = delphi.Delphi(path, "oracle2 benchmark", api="http://127.0.0.1:9/")
+    shell.mode = 'major'
+    results['delphi'] = {
+        't': latency(shell.parse, [("t " + name,) for name, mode in names]),
+        'at': latency(shell.parse, [("at {} {}".format(rng.randrange(60), rng.randrange(60)),)
+                                    for _ in range(queries)]),
+        'w': latency(shell.parse, [("w 10 0 10 30",)] * min(queries, 100)),
+    }
+    shell.close()
+
+    for leftover in (path, path + oracle.Oracle.snapshot_suffix):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    return results
+
+
+def run(sizes=(20000,), distribution='pareto', factbook=500, queries=1000, seed=0, directory=None):
+    """
+    Benchmarks Oracle and Delphi against synthetic dumps of each size.
+
+    :return: Dictionary of results, suitable for JSON
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as work:
+        return {'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'timestamp': time.time(),
+                'distribution': distribution,
+                'factbook': factbook,
+                'results': [bench_size(work, size, distribution, factbook, queries, seed) for size in sizes]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark Oracle and Delphi against synthetic dumps.")
+    parser.add_argument('--regions', type=int, nargs='+', default=[20000],
+                        help="region counts to benchmark, e.g. 20000 200000 2000000")
+    parser.add_argument('--distribution', choices=('pareto', 'lognormal', 'uniform'), default='pareto')
+    parser.add_argument('--factbook', type=int, default=500, help="approximate factbook length in characters")
+    parser.add_argument('--queries', type=int, default=1000, help="queries per latency measurement")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dir', help="directory for temporary dumps")
+    parser.add_argument('--output', help="write JSON results to this file instead of standard output")
+    arguments = parser.parse_args()
+
+    output = json.dumps(run(arguments.regions, arguments.distribution, arguments.factbook, arguments.queries,
+                            arguments.seed, arguments.dir), indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as out:
+            out.write(output + "\n")
+    else:
+        print(output)
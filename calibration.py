@@ -0,0 +1,207 @@
+import collections
+import math
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Calibration:
+    def __init__(self, speed, decay=1.0, prior=0.01, min_points=5, threshold=4.0, floor=5.0, history=1000, offset=0.0,
+                 run=5):
+        """
+        Incremental least squares fit of observed update time against update progress, where progress is a region's
+        cumulative population as a fraction of the total. The slope of the fit is the length of the update (Oracle's
+        speed) and the intercept is minus Oracle's offset.
+
+        Only weighted running sums are kept, so each observation costs O(1) however many have been seen. The slope is
+        pulled towards a prior update length with a ridge penalty. Early in an update the observations are bunched
+        together and say little about the slope, so the fit only shifts the timeline; as they spread out, the data
+        takes over.
+
+        :param speed: Prior update length in seconds
+        :param decay: Weight multiplier applied to all earlier observations each time one is added. 1 weights every
+                      observation equally; smaller values favour recent observations.
+        :param prior: Strength of the pull towards the prior update length
+        :param min_points: Observations needed before outliers are rejected
+        :param threshold: Reject observations further than this many standard errors from the fit. The standard error
+                          of a prediction is the RMS error widened by the fit's own uncertainty at that point, so an
+                          observation far from the ones seen so far has more room.
+        :param floor: Minimum RMS error in seconds used for outlier rejection, so a near perfect fit does not reject
+                      every small deviation
+        :param history: Number of recent observations kept for residuals()
+        :param offset: Offset in seconds to use until there are observations
+        :param run: Number of consecutive rejections on the same side of the fit after which they are accepted after
+                    all. So many misses in one direction mean the fit is wrong, not the observations.
+        """
+        self.prior_speed = speed
+        self.prior_offset = offset
+        self.decay = decay
+        self.prior = prior
+        self.min_points = min_points
+        self.threshold = threshold
+        self.floor = floor
+        self.run = run
+        self.recent = collections.deque(maxlen=history)
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets every observation.
+        """
+        self.weight = self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+        self.count = 0
+        self.rejected = 0
+        self.recent.clear()
+        # current run of rejected (x, y, weight, above the fit) observations, all on the same side of the fit
+        self.misses = []
+        self.intercept = -self.prior_offset
+        self.slope = self.prior_speed
+
+    def set_prior(self, speed, offset=None):
+        """
+        Sets the prior update length and refits.
+
+        :param speed: Update length in seconds
+        :param offset: Offset in seconds to use until there are observations. Unchanged if None.
+        """
+        self.prior_speed = speed
+        if offset is not None:
+            self.prior_offset = offset
+        self._fit()
+
+    def restore(self, count, weight, sx, sy, sxx, sxy, syy):
+        """
+        Replaces the running sums, e.g. with ones saved by updatehistory.History, and refits. Recent observations are
+        not restored.
+
+        :param count: Number of observations the sums are made of
+        """
+        self.count = count
+        self.weight, self.sx, self.sy, self.sxx, self.sxy, self.syy = weight, sx, sy, sxx, sxy, syy
+        self._fit()
+
+    def _fit(self):
+        # minimise sum(w * (y - a - b * x) ** 2) + prior * (b - prior_speed) ** 2
+        if self.weight == 0:
+            self.intercept, self.slope = -self.prior_offset, self.prior_speed
+            return
+        sxx = self.sxx + self.prior
+        sxy = self.sxy + self.prior * self.prior_speed
+        determinant = self.weight * sxx - self.sx * self.sx
+        if determinant <= 0:
+            self.slope = self.prior_speed
+        else:
+            self.slope = (self.weight * sxy - self.sx * self.sy) / determinant
+        self.intercept = (self.sy - self.slope * self.sx) / self.weight
+
+    def predict(self, x):
+        """
+        :param x: Update progress (cumulative population / total population)
+        :return: Predicted update time in seconds
+        """
+        return self.intercept + self.slope * x
+
+    @property
+    def offset(self):
+        return 0.0 - self.intercept
+
+    @property
+    def speed(self):
+        return self.slope
+
+    @property
+    def rms(self):
+        """
+        Weighted root mean square error of the current fit over all accepted observations.
+        """
+        if self.weight == 0:
+            return 0.0
+        a, b = self.intercept, self.slope
+        sse = (self.syy - 2 * a * self.sy - 2 * b * self.sxy + a * a * self.weight + 2 * a * b * self.sx +
+               b * b * self.sxx)
+        return math.sqrt(max(sse, 0.0) / self.weight)
+
+    def leverage(self, x, weight=1.0):
+        """
+        Variance of the error of a prediction at x, relative to the variance of one observation of weight 1: the
+        observation's own noise plus the uncertainty of the fit at x, which grows away from the observations seen.
+
+        :param x: Update progress
+        :param weight: Weight the observation would have
+        :return: Variance ratio, at least 1 / weight
+        """
+        sxx = self.sxx + self.prior
+        determinant = self.weight * sxx - self.sx * self.sx
+        if determinant <= 0:
+            return 1 / weight
+        return 1 / weight + (sxx - 2 * x * self.sx + x * x * self.weight) / determinant
+
+    def add(self, x, y, weight=1.0):
+        """
+        Adds an observation and refits.
+
+        :param x: Update progress of observed region (cumulative population / total population)
+        :param y: Observed update time in seconds
+        :param weight: Weight of observation
+        :return: True if the observation was used, False if it was rejected as an outlier
+        """
+        residual = y - self.predict(x)
+        if (self.count >= self.min_points and
+                abs(residual) > self.threshold * max(self.rms, self.floor) * math.sqrt(self.leverage(x, weight))):
+            if self.misses and self.misses[-1][3] != (residual > 0):
+                self.misses = []
+            self.misses.append((x, y, weight, residual > 0))
+            if len(self.misses) < self.run:
+                self.rejected += 1
+                self.recent.append((x, y, False))
+                return False
+            # the fit has missed on the same side too often: take the whole run after all
+            run, self.misses = self.misses, []
+            for _ in run[:-1]:
+                self.recent.pop()
+            self.rejected -= len(run) - 1
+            for earlier_x, earlier_y, earlier_weight, above in run[:-1]:
+                self._accumulate(earlier_x, earlier_y, earlier_weight)
+        else:
+            self.misses = []
+        self._accumulate(x, y, weight)
+        return True
+
+    def _accumulate(self, x, y, weight):
+        if self.decay != 1.0:
+            self.weight *= self.decay
+            self.sx *= self.decay
+            self.sy *= self.decay
+            self.sxx *= self.decay
+            self.sxy *= self.decay
+            self.syy *= self.decay
+        self.weight += weight
+        self.sx += weight * x
+        self.sy += weight * y
+        self.sxx += weight * x * x
+        self.sxy += weight * x * y
+        self.syy += weight * y * y
+        self.count += 1
+        self.recent.append((x, y, True))
+        self._fit()
+
+    def residuals(self):
+        """
+        Residuals of recent observations against the current fit.
+
+        :return: List of (progress, observed time, residual in seconds, accepted) tuples, oldest first
+        """
+        return [(x, y, y - self.predict(x), accepted) for x, y, accepted in self.recent]
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+import pytest
+
+import dumpgen
+import standin
+from oracle import Oracle
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+# fixtures shared by the test modules: small synthetic dumps and a stand-in API on its own event loop
+
+REGIONS = 1500
+
+
+@pytest.fixture(scope='session')
+def dump(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('dump') / 'regions.xml.gz')
+    dumpgen.generate(path, REGIONS, factbook=20, embassies=1, seed=1)
+    return path
+
+
+@pytest.fixture
+def oracle(dump):
+    return Oracle(dump, 'test', snapshot=False, passworded=["Synthetic Region {}".format(i) for i in range(0, 90, 7)])
+
+
+@pytest.fixture
+def api(dump):
+    """
+    Stand-in API simulating an update of the dump's regions, served from a thread of its own so that Delphi's tracker
+    loop can be shut down independently.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = standin.StandIn(regions=list(Oracle(dump, 'test').table.names), rate=200,
+                             passworded=["Synthetic Region 3", "Synthetic Region 5"])
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+    yield server
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def brute_flags(table, flags=0, exclude=0):
+    """Indices of the regions with every bit in flags and none in exclude, found without the bitmap indexes."""
+    return [i for i in range(len(table)) if table.flags[i] & flags == flags and not table.flags[i] & exclude]
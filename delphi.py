@@ -1,11 +1,23 @@
 import oracle
-import time
+import download
+import export
+import triggers
+import tracker
+import nationindex
+import updatetrace
+import updatehistory
+import metrics
+from regiontable import RegionTable
+import asyncio
+import collections
+import math
 import threading
+import time
 import datetime
-import urllib.request
-import urllib
-import shutil
+import http.client
+import os
 import xml.etree.ElementTree as ElementTree
+import zlib
 
 # Oracle 2 NationStates Update Prediction Framework
 # Copyright (c) 2017 Khronion <khronion@gmail.com>
@@ -38,6 +50,46 @@ class UTC(datetime.tzinfo):
         return datetime.timedelta(0)
 
 
+class LogBuffer:
+    def __init__(self, size=200):
+        """
+        Bounded ring buffer of messages that any thread can append to while another drains it. When full, the oldest
+        messages are dropped and counted.
+
+        :param size: Maximum number of messages kept
+        """
+        self.messages = collections.deque(maxlen=size)
+        self.dropped = 0
+        self.ready = threading.Condition()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, message):
+        with self.ready:
+            if len(self.messages) == self.messages.maxlen:
+                self.dropped += 1
+            self.messages.append(message)
+            self.ready.notify_all()
+
+    def drain(self, timeout=None):
+        """
+        Takes every queued message.
+
+        :param timeout: Seconds to wait for a message if there are none, or None not to wait
+        :return: List of messages, oldest first
+        """
+        with self.ready:
+            if not self.messages and timeout:
+                self.ready.wait(timeout)
+            messages = list(self.messages)
+            self.messages.clear()
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            messages.insert(0, "({} older messages dropped)".format(dropped))
+        return messages
+
+
 class Delphi:
     # define command keyword for each respective command
     cmd_time = 't'  # get time (region)
@@ -46,53 +98,185 @@ class Delphi:
     cmd_offset = 'o'  # set offset (region h:m:s)
     cmd_calibrate = 'c'  # calibrate (region h:m:s)
     cmd_nudge = 'n'  # nudge
+    cmd_calibration = 'cal'  # show or reset calibration
 
     cmd_export = 'export'
     cmd_targets = 'targets'
+    cmd_triggers = 'triggers'
     cmd_html = 'html'
+    cmd_passwords = 'passwords'  # load passworded regions (path) or fetch them from the API
     cmd_reload = 'reload'
 
     cmd_pull = 'pull'
+    cmd_stats = 'stats'  # show, start or stop instrumentation
 
     cmd_start = 'start'
     cmd_stop = 'stop'
 
-    def __init__(self, regions, ua, debug=False):
+    cmd_now = 'now'  # region updating now
+    cmd_at = 'at'  # region updating at (MM SS)
+    cmd_window = 'w'  # regions updating between (MM SS MM SS)
+    cmd_next = 'next'  # next regions to update (count)
+
+    # maximum number of regions listed by window and next commands
+    list_limit = 25
+
+    # maximum number of log messages kept until they are shown
+    log_size = 200
+
+    # happenings requested when tracking: influence changes reveal update progress; relocations, foundings and
+    # nations ceasing to exist change the populations predictions are based on
+    event_filters = ("change", "move", "founding", "cte")
+
+    # maximum number of suggestions offered for an ambiguous region name
+    suggestion_limit = 8
+
+    # seconds between automatic tracking queries. Polling speeds up to min_poll_interval as the target's predicted
+    # update time approaches (within approach seconds, until target_grace seconds after it), and backs off towards
+    # max_poll_interval while queries keep coming back empty.
+    poll_interval = 5
+    min_poll_interval = 1
+    max_poll_interval = 60
+    approach = 60
+    target_grace = 15
+    # regions watched on behalf of server clients are treated like the target, see watch()
+    watch_limit = 16
+
+    # API request budget shared by tracking, manual pulls and nation lookups: (requests, per seconds). NationStates
+    # allows 50 requests per 30 seconds.
+    rate_limit = (40, 30.0)
+
+    # seconds between rewrites of the Prometheus text file, when one is written
+    metrics_interval = 15
+
+    # whether the tracking loop switches mode to the closest update by itself, as a long-running server needs to
+    follow_clock = False
+
+    # seconds to wait for a one-off API query started from the prompt, e.g. fetching passworded regions
+    api_timeout = 30
+
+    # errors that reading a dump cut short or damaged in transit can raise
+    download_errors = (OSError, EOFError, zlib.error, http.client.HTTPException, ElementTree.ParseError)
+
+    # errors that a failed API query can raise
+    api_errors = (OSError, asyncio.TimeoutError, tracker.HTTPError, ElementTree.ParseError)
+
+    def __init__(self, regions, ua, debug=False, api=tracker.API_URL, nations=None, trace=None, history=None,
+                 passworded=None):
         """
         Provides interactive Oracle functionality. This can be used to create bots and user interfaces.
 
-        :param regions: Path to NationStates regional data dump. Can be a string or file object.
+        :param regions: Path to NationStates regional data dump. Can be a string, a file object or a
+                        download.DumpStream, which is parsed as it downloads.
         :param ua: User agent string that identifies the operator, as required by NS TOS
+        :param api: URL of the NationStates API. Point this at a stand-in server (see standin.py) to work offline.
+        :param nations: Optional path to a NationStates nations.xml.gz dump, used to find a nation's region without
+                        an API call
+        :param trace: Optional path of a trace file to append observations, predictions, calibration changes and
+                      population changes to. See replay.py.
+        :param history: Optional path of a file of past updates. Calibration starts from a fit across earlier days, and
+                        every calibration change is stored for later runs. See updatehistory.History.
+        :param passworded: Optional path of a file of passworded region names, one per line, to leave out of targets
+                           and triggers. The dump does not record passwords; see also the passwords command.
         :return:
         """
 
         self.debug = debug
-        self.regions = regions
+        # a download is saved to disk as it is read, so later reloads can use the file
+        self.regions = regions.path if isinstance(regions, download.DumpStream) else regions
 
         self.ua = ua
-        self.oracle = oracle.Oracle(regions, ua)
-
-        self.time_now = datetime.datetime.utcnow().replace(tzinfo=UTC())
-        self.time_base = datetime.datetime.utcnow().replace(tzinfo=UTC(), hour=0, minute=0, second=0,
-                                                            microsecond=0)
+        self.oracle = oracle.Oracle(regions, ua, passworded=self.read_names(passworded) if passworded else None)
+        # have typo correction ready before the first target is typed in
+        self.oracle.names.build_in_background()
+        # where the passworded regions came from, or None if they are not known and so are not excluded
+        self.passworded = passworded
 
-        # determine start time of closest update
-        # 16h = minor
-        # 4h = major
-        # easy: anything less than 16h is major (we don't really care about weird exception cases anyhow)
+        self.mode = self.clock_mode()
 
-        if self.time_now < self.time_base + datetime.timedelta(hours=16):
-            self.mode = "major"
-        else:
-            self.mode = "minor"
+        # start from the calibration of earlier updates
+        self.history = updatehistory.History(history) if history else None
+        if self.history is not None:
+            self.oracle.apply_history(self.history, self.time_base.date())
 
         self.tracking = False
         self.target = ""
+        # regions other clients wait for, see watch(); replaced as a whole so the tracker thread can read it freely
+        self.watched = ()
+        self.watch_lock = threading.Lock()
+
+        # written by the tracker thread, read by the prompt thread
+        self.log = LogBuffer(self.log_size)
+
+        # callables taking the mode whose calibration changed, e.g. to push the change to server clients
+        self.calibration_listeners = []
 
-        self.runner = threading.Thread(target=self._runner, daemon=True)
-        self.runner.start()
+        dump = self.regions if isinstance(self.regions, str) else None
+        self.trace = updatetrace.TraceWriter(trace, dump) if trace else None
 
-        self.log = []
+        # all API calls share one event loop thread and one keep-alive connection pool
+        self.tracker = tracker.Tracker(ua, api, rate_limit=self.rate_limit)
+        self.poll = None
+        # set when stopping tracking cancels the poll in flight, as opposed to the runner being cancelled
+        self.poll_cancelled = False
+        # consecutive tracking queries that found nothing, for backing off
+        self.idle_polls = 0
+        self.wake = asyncio.Event()
+        # manual query in flight, if any
+        self.pull = None
+        # instrumentation, off until enable_metrics() is called
+        self.metrics = None
+        self.metrics_stop = None
+        # id of the newest happening seen, so each query only asks for newer ones
+        self.last_event_id = None
+        self.runner = self.tracker.submit(self._runner())
+
+        # nation -> region lookups are answered from the nations dump where possible. Nations it does not cover are
+        # looked up with the API once and then cached.
+        self.nations = nationindex.NationIndex.open(nations) if nations else None
+        self.nation_cache = nationindex.LRUCache()
+
+    @classmethod
+    def from_download(cls, url, path, ua, report=print, **options):
+        """
+        Starts Delphi on a dump as it downloads, if it changed since the copy at path was downloaded (see
+        download.open_dump). A download that is cut short is resumed once; if that fails as well, the last complete copy
+        at path is used instead.
+
+        :param url: URL of the dump, e.g. download.REGIONS_URL
+        :param path: Path the dump is saved to
+        :param ua: User agent string that identifies the operator, as required by NS TOS
+        :param report: Callable taking progress messages for the user
+        :param options: Other arguments for Delphi
+        :return: Delphi
+        :raises OSError: if there is no complete copy of the dump to use
+        """
+        stream = None
+        for attempt in range(2):
+            try:
+                stream = download.open_dump(url, path, "oracle2/{}".format(ua))
+            except OSError as e:
+                report("Download failed ({}).".format(e))
+                break
+            if stream is None:
+                report("{} is up to date.".format(os.path.basename(path)))
+                break
+            report("Resuming the download..." if attempt else "Downloading and loading {}...".format(
+                os.path.basename(path)))
+            try:
+                with stream:
+                    shell = cls(stream, ua, **options)
+            except cls.download_errors as e:
+                report("Download interrupted ({}).".format(str(e) or type(e).__name__))
+            else:
+                report("Download complete.")
+                return shell
+
+        if not os.path.exists(path):
+            raise FileNotFoundError("No complete copy of {} to fall back on.".format(path))
+        if stream is not None:
+            report("Using the last complete copy of {}.".format(os.path.basename(path)))
+        return cls(path, ua, **options)
 
     def parse(self, command):
         """
@@ -103,11 +287,11 @@ class Delphi:
         :return: user-readable response string
         """
 
-        if self.log:
+        messages = self.log.drain()
+        if messages:
             print("Queued debug messages:")
-            for _ in self.log:
+            for _ in messages:
                 print(_)
-            self.log = []
             print("\n")
 
         action = command.split(" ")[0]
@@ -123,16 +307,22 @@ class Delphi:
 
             # time (region name)
             elif action == self.cmd_time:
-                target = ' '.join(args)
-                try:
-                    predicted_time = self.oracle.get_time_hms(target, self.mode)
-                    self.target = target
-                    return "Time predicted for {}: {:02d}:{:02d}:{:02d}.\n" \
-                           "URL: http://nationstates.net/region={}".format(self.target, predicted_time[0],
-                                                                           predicted_time[1], predicted_time[2],
-                                                                           self.target.replace(" ", "_"))
-                except KeyError:
-                    return "ERROR: No such region {}".format(self.target)
+                name = ' '.join(args)
+                matches = self.oracle.find_regions(name, self.suggestion_limit)
+                if not matches:
+                    return "ERROR: No such region {}".format(name)
+                if len(matches) > 1:
+                    return "ERROR: {} is ambiguous. Did you mean: {}?".format(name, ", ".join(matches))
+                target = matches[0]
+                predicted_time = self.oracle.get_time_hms(target, self.mode)
+                self.target = target
+                self.wake_runner()
+                if self.trace is not None:
+                    self.trace.prediction(self.mode, target, self.oracle.get_time(target, self.mode))
+                return "Time predicted for {}: {:02d}:{:02d}:{:02d}.\n" \
+                       "URL: http://nationstates.net/region={}".format(self.target, predicted_time[0],
+                                                                       predicted_time[1], predicted_time[2],
+                                                                       self.target.replace(" ", "_"))
 
             # recall last prediction
             elif action == self.cmd_review:
@@ -162,8 +352,12 @@ class Delphi:
                 region = ' '.join(args[:-1])
 
                 try:
-                    self.oracle.set_offset(self.target, observed_time, self.mode)
-                    return "Offset adjusted to {} seconds.".format(-self.oracle.offset)
+                    accepted = self.record_observation(self.target, observed_time)
+                    self.calibration_changed()
+                    if not accepted:
+                        return "Observation rejected as an outlier. Offset is {} seconds.".format(
+                            -self.oracle.offset[self.mode])
+                    return "Offset adjusted to {} seconds.".format(-self.oracle.offset[self.mode])
                 except KeyError:
                     return "ERROR: No such region {}.".format(region)
 
@@ -171,24 +365,138 @@ class Delphi:
             elif action == self.cmd_nudge:
                 if len(args) > 0:
                     self.oracle.nudge += int(args[0])
+                    self.calibration_changed()
                 return "Nudge is {}".format(self.oracle.nudge)
+            elif action == self.cmd_calibration:
+                if args and args[0] == 'reset':
+                    self.oracle.reset_calibration(self.mode)
+                    self.calibration_changed()
+                    return "Calibration for {} reset.".format(self.mode)
+                if args and args[0] == 'history':
+                    if self.history is None:
+                        return "No update history is kept."
+                    updates = self.history.updates(self.mode)[-self.list_limit:]
+                    return "{} stored {} updates:\n{}".format(len(updates), self.mode, "\n".join(
+                        "{}  {:.1f} s ({} observations)".format(day.isoformat(), length, count)
+                        for day, length, count in updates))
+                model = self.oracle.calibration[self.mode]
+                with self.oracle.lock:
+                    worst = sorted(model.residuals(), key=lambda r: -abs(r[2]))[:5]
+                return "{} calibration: {} observations ({} rejected), update length {:.1f} s, offset {:.1f} s, " \
+                       "RMS error {:.1f} s.\nLargest recent residuals: {}".format(
+                           self.mode, model.count, model.rejected, model.speed, -model.offset, model.rms,
+                           ", ".join("{:+.1f} s".format(r[2]) for r in worst) or "none")
             elif action == self.cmd_export:
-                self.oracle.csv_export(self.mode, args[0])
-                return "Exported CSV to {}".format(args[0])
+                # export <path> [format] [major|minor|both]
+                fmt = None
+                modes = (self.mode,)
+                for arg in args[1:]:
+                    if arg == 'both':
+                        modes = ('major', 'minor')
+                    elif arg in ('major', 'minor'):
+                        modes = (arg,)
+                    elif arg in export.WRITERS:
+                        fmt = arg
+                    else:
+                        return "ERROR: Unknown export option '{}'.".format(arg)
+                paths = self.oracle.export(args[0], fmt, modes)
+                return "Exported to {}".format(", ".join(paths))
             elif action == self.cmd_targets:
-                self.oracle.founderless_export(self.mode, args[0])
-                return "Exported founderless regions to {}".format(args[0])
+                # targets <path> [max endos]
+                if len(args) > 1:
+                    try:
+                        max_endos = int(args[1])
+                    except ValueError:
+                        return "ERROR: Invalid endorsement count."
+                    targets = self.oracle.select(flags=RegionTable.FOUNDERLESS, max_endos=max_endos,
+                                                 exclude=RegionTable.PASSWORDED)
+                    self.oracle.export(args[0], 'csv', (self.mode,), regions=targets)
+                    return "Exported {} founderless regions with fewer than {} endorsements to {}.{}".format(
+                        len(targets), args[1], args[0], self.passworded_note())
+                targets = self.oracle.select(flags=RegionTable.FOUNDERLESS, exclude=RegionTable.PASSWORDED)
+                self.oracle.export(args[0], 'csv', (self.mode,), regions=targets)
+                return "Exported founderless regions to {}.{}".format(args[0], self.passworded_note())
+            elif action == self.cmd_triggers:
+                # triggers <path> [min lead] [max lead]
+                try:
+                    min_lead = float(args[1]) if len(args) > 1 else triggers.MIN_LEAD
+                    max_lead = float(args[2]) if len(args) > 2 else triggers.MAX_LEAD
+                except ValueError:
+                    return "ERROR: Invalid lead provided."
+                if min_lead > max_lead:
+                    return "ERROR: Minimum lead is greater than maximum lead."
+                count = triggers.export_plan(self.oracle, args[0], mode=self.mode,
+                                             targets=self.oracle.select(flags=RegionTable.FOUNDERLESS,
+                                                                        exclude=RegionTable.PASSWORDED),
+                                             min_lead=min_lead, max_lead=max_lead)
+                return "Exported triggers for {} founderless regions to {}.{}".format(count, args[0],
+                                                                                      self.passworded_note())
+            elif action == self.cmd_passwords:
+                # passwords [path]
+                return self.load_passworded(args[0] if args and args[0] else None)
             elif action == self.cmd_html:
                 self.oracle.html_export(self.mode, args[0])
                 return "Exported HTML to {}".format(args[0])
-            elif action == self.cmd_start:
-                self.tracking = True
-                return "Tracking set to True"
-            elif action == self.cmd_stop:
-                self.tracking = False
-                return "Tracking set to False."
+            elif action == self.cmd_reload:
+                path = args[0] if args and args[0] else self.regions
+                try:
+                    changed, rebuilt = self.oracle.ingest(path)
+                except (OSError, EOFError, ElementTree.ParseError) as e:
+                    return "ERROR: Could not read {} ({}).".format(path, e)
+                if rebuilt:
+                    self.oracle.names.build_in_background()
+                    return "Regions changed; reloaded {} regions from {}.".format(changed, path)
+                return "Applied {} changed regions from {}.".format(changed, path)
+            elif action == self.cmd_start or action == self.cmd_stop:
+                return self.set_tracking(action == self.cmd_start)
             elif action == self.cmd_pull:
                 return self.pull_time()
+            elif action == self.cmd_stats:
+                if args and args[0] == 'on':
+                    self.enable_metrics(args[1] if len(args) > 1 else None)
+                    return "Instrumentation on{}.".format(
+                        ", writing {} every {} seconds".format(args[1], self.metrics_interval) if len(args) > 1 else "")
+                if args and args[0] == 'off':
+                    self.disable_metrics()
+                    return "Instrumentation off."
+                if self.metrics is None:
+                    return "Instrumentation is off. Turn it on with 'stats on [path]'."
+                return "\n".join(metrics.summary(self.metrics)) or "Nothing measured yet."
+            elif action == self.cmd_now or action == self.cmd_at:
+                if action == self.cmd_now:
+                    at = self.elapsed()
+                else:
+                    try:
+                        at = int(args[0]) * 60 + int(args[1])
+                    except ValueError:
+                        return "ERROR: Invalid time provided."
+                region = self.oracle.region_at(at, self.mode)
+                if region is None:
+                    return "No region predicted to have updated by {}.".format(self.format_seconds(at))
+                return "Updating at {}: {} (predicted {}).".format(
+                    self.format_seconds(at), region, self.format_seconds(self.oracle.get_time(region, self.mode)))
+            elif action == self.cmd_window:
+                try:
+                    start = int(args[0]) * 60 + int(args[1])
+                    end = int(args[2]) * 60 + int(args[3])
+                except ValueError:
+                    return "ERROR: Invalid time provided."
+                first, stop = self.oracle.window(start, end, self.mode)
+                shown = range(first, min(stop, first + self.list_limit))
+                regions = list(zip((self.oracle.table.names[i] for i in shown),
+                                   self.oracle.get_times(self.mode, shown)))
+                return "{} regions predicted between {} and {}:\n{}".format(
+                    stop - first, self.format_seconds(start), self.format_seconds(end),
+                    self.list_regions(regions, stop - first))
+            elif action == self.cmd_next:
+                try:
+                    count = int(args[0]) if args else 10
+                except ValueError:
+                    return "ERROR: Invalid count provided."
+                regions = self.oracle.next_regions(self.elapsed(), count, self.mode)
+                if not regions:
+                    return "No regions left to update."
+                return self.list_regions(regions)
             elif action == "dbg":  # this is for troubleshooting use only
                 self.debug = not self.debug
                 return "!!!! Debug flag toggled."
@@ -198,21 +506,92 @@ class Delphi:
                 return """
 Oracle2 Update Prediction Tool Command Reference
 
-t <region>      Get region time
+t <region>      Get region time. Accepts URL-style names, the start of a name, or a name with one typo.
 r               Recall last targeted region
 m <major|minor> Set update mode to major or minor
 o <MM SS>       Indicate true update time in minutes and seconds of last targeted region
 n <seconds>     Add/subtract from nudge value to offset all future predictions.
                 If blank, resets nudge.
-start           Start automatic tracking
+export <path> [csv|html|jsonl|bin] [major|minor|both]
+                Export update times. Format is guessed from the file extension if not given.
+targets <path> [max endos]
+                Export founderless regions as CSV, optionally only those with fewer than max endos
+triggers <path> [min lead] [max lead]
+                Export a trigger, and fallbacks, updating 4-10 (or min-max) seconds before each founderless region
+passwords [path]
+                Leave passworded regions out of targets and triggers, reading them from a file of region names or,
+                without a path, asking the API once
+html <path>     Export update times as HTML
+reload [path]   Apply a newer regions dump, updating only the regions that changed
+now             Get region predicted to be updating now
+at <MM SS>      Get region predicted to be updating at a time
+w <MM SS> <MM SS>
+                List regions predicted to update between two times
+next [count]    List the next regions predicted to update (default 10)
+cal [reset]     Show calibration fit for the current update, or discard its observations
+cal history     List stored update lengths of the current mode
+start           Start automatic tracking. Polls faster as the target's predicted time approaches.
 stop            Stop automatic tracking
 pull            Manually trigger an API query (only works if automatic tracking is not running)
-                WARNING: calling this command repeatedly could trigger an API rate limit violation!
+                Refused while the shared API request budget is used up.
+stats [on [path]|off]
+                Show timings of dump loading, queries, commands and API calls and the calibration observation rate,
+                or turn measuring on (optionally writing a Prometheus text file to path) or off
 dbg             Toggle debug messages
                 """
         except IndexError:
             return "ERROR: malformed command."
 
+    @staticmethod
+    def read_names(path):
+        """
+        Reads a list of region names, one per line. Blank lines and lines starting with # are skipped.
+
+        :param path: Path of the list
+        :return: List of region names
+        """
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    def load_passworded(self, path=None):
+        """
+        Marks passworded regions so that targets and triggers leave them out.
+
+        :param path: Path of a file of passworded region names, or None to fetch them from the API. The API is asked
+                     on the tracker thread, so the prompt is not held up; the result is logged.
+        :return: User-readable response string
+        """
+        if path is None:
+            self.tracker.submit(self._fetch_passworded())
+            return "Fetching passworded regions from the API."
+        try:
+            names = self.read_names(path)
+        except OSError as e:
+            return "ERROR: Could not get passworded regions from {} ({}).".format(path, e)
+        return self._mark_passworded(names, path)
+
+    async def _fetch_passworded(self):
+        try:
+            names = await asyncio.wait_for(self.tracker.tagged_regions(("password",)), self.api_timeout)
+        except self.api_errors as e:
+            self.log.append("ERROR: Could not get passworded regions from the API ({}).".format(
+                str(e) or type(e).__name__))
+            return
+        self.log.append(self._mark_passworded(names, "the API"))
+
+    def _mark_passworded(self, names, source):
+        count = self.oracle.mark_passworded(names)
+        self.passworded = source
+        return "{} passworded regions will be left out of targets and triggers.".format(count)
+
+    def passworded_note(self):
+        """
+        Warns that exports include passworded regions, unless passworded regions have been loaded.
+        """
+        if self.passworded is None:
+            return " Passworded regions are included; use '{}' to leave them out.".format(self.cmd_passwords)
+        return ""
+
     @staticmethod
     def find_between(s, first, last):
         try:
@@ -226,87 +605,480 @@ dbg             Toggle debug messages
     def timestamp(dt):
         return (dt - datetime.datetime(1970, 1, 1).replace(tzinfo=UTC())).total_seconds()
 
-    def find_event(self):
+    @property
+    def time_base(self):
+        """
+        Start of the current UTC day, which today's updates are timed from.
+        """
+        return datetime.datetime.utcnow().replace(tzinfo=UTC(), hour=0, minute=0, second=0, microsecond=0)
+
+    def clock_mode(self):
+        """
+        Determines the closest update from the clock.
+
+        :return: "major" before 16h UTC, else "minor"
+        """
+        # 16h = minor
+        # 4h = major
+        # easy: anything less than 16h is major (we don't really care about weird exception cases anyhow)
+        time_now = datetime.datetime.utcnow().replace(tzinfo=UTC())
+        return "major" if time_now < self.time_base + datetime.timedelta(hours=16) else "minor"
+
+    def sync_mode(self):
+        """
+        Switches to the closest update if follow_clock is set.
+
+        :return: Current mode
+        """
+        if self.follow_clock:
+            self.mode = self.clock_mode()
+        return self.mode
+
+    def watch(self, region):
+        """
+        Marks a region as one somebody is waiting for, so that tracking polls faster as it approaches as well as the
+        target. Only the watch_limit most recently watched regions are kept.
+
+        :param region: Region name
+        """
+        with self.watch_lock:
+            self.watched = tuple(name for name in self.watched if name != region)[-(self.watch_limit - 1):] + (region,)
+        self.wake_runner()
+
+    def update_start(self, mode=None):
+        """
+        Gets the start of the current update.
+
+        :param mode: Update to get the start of, or None for the current mode
+        :return: Unix timestamp of the start of today's update for the mode
+        """
+        # 16h = minor
+        # 4h = major
+        if (mode or self.mode) == "minor":
+            return self.timestamp(self.time_base + datetime.timedelta(hours=16))
+        return self.timestamp(self.time_base + datetime.timedelta(hours=4))
+
+    def elapsed(self, mode=None):
+        """
+        Gets the time since the start of the current update.
+
+        :param mode: Update to measure from, or None for the current mode
+        :return: Seconds since the start of the update
+        """
+        return time.time() - self.update_start(mode)
+
+    @staticmethod
+    def format_seconds(seconds):
+        seconds = int(seconds)
+        return "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    def list_regions(self, regions, total=None):
         """
-        Queries the NationStates API for events which may reveal the current progress of the update.
+        Formats a list of (name, update time in seconds) tuples for display, truncated to list_limit entries.
 
-        :return: Array [region_name, observed_update_time] or None if no event was observed.
+        :param regions: List of (name, update time in seconds) tuples
+        :param total: Total number of regions the list was taken from, if more than len(regions)
         """
-        headers = {u'User-Agent': self.ua}
-        feed_url = u"https://www.nationstates.net/cgi-bin/api.cgi?q=happenings;filter=change;"
-        query = urllib.request.Request(feed_url, headers=headers)
-        xml = ElementTree.fromstring(urllib.request.urlopen(query).read())
+        total = len(regions) if total is None else total
+        lines = ["{}  {}".format(self.format_seconds(t), name) for name, t in regions[:self.list_limit]]
+        if total > self.list_limit:
+            lines.append("... and {} more".format(total - self.list_limit))
+        return "\n".join(lines)
 
-        for event in xml.iter(u'EVENT'):
-            event_time = int(event.find(u"TIMESTAMP").text)
-            event_text = event.find(u"TEXT").text
-            if u"influence" in event_text:
+    async def resolve_region(self, nation, event_text=""):
+        """
+        Finds the region a nation is in. The region named in the event text is used if there is one, then the nations
+        dump index, then the cache of earlier API lookups; the API is only queried when all of these miss.
+
+        :param nation: Nation name
+        :param event_text: Text of the happening that mentioned the nation
+        :return: Region name
+        """
+        if event_text.count("%%") >= 2:
+            return event_text.split("%%")[1].replace("_", " ")
+        key = nationindex.normalize(nation)
+        region = self.nations.get(key) if self.nations is not None else None
+        if region is None:
+            region = self.nation_cache.get(key)
+        if region is None:
+            if self.debug is True:
+                self.log.append("API Query: {}".format(self.tracker.url(nation=key, q="region")))
+            region = await self.tracker.nation_region(key)
+            self.nation_cache.put(key, region)
+        return region
+
+    async def find_events_async(self, limit=None):
+        """
+        Queries the NationStates API for every event since the last query which may reveal the current progress of
+        the update. Only events newer than the last one seen are requested. Runs on the tracker's event loop.
+
+        If a nation's region cannot be looked up for a reason that may pass, e.g. a timeout, the batch stops there and
+        the next query starts again from that event. Influence changes from before the start of the current update are
+        skipped, as they say nothing about its progress.
+
+        :param limit: Maximum number of observations to return, or None for all of them. Events after the last one
+        returned are left for the next query.
+        :return: List of [region_name, observed_update_time] arrays, oldest first
+        """
+        happenings = await self.tracker.happenings(self.last_event_id, self.event_filters)
+
+        observations = []
+        for event_id, event_time, event_text in reversed(happenings):
+            if limit is not None and len(observations) >= limit:
+                break
+            if not self.track_population(event_text) and u"influence" in event_text:
                 nation = event_text.split("@@")[1]
-                region_url = u"https://www.nationstates.net/cgi-bin/api.cgi?nation={}&q=region".format(nation)
-                region_query = urllib.request.Request(region_url, headers=headers)
-                region_xml = ElementTree.fromstring(urllib.request.urlopen(region_query).read())
-                region = region_xml.find(u"REGION").text
-
-                # calculate how long after the update start the event was observed
-                if self.mode is "minor":
-                    event_time -= self.timestamp(self.time_base + datetime.timedelta(hours=16))
-                else:
-                    event_time -= self.timestamp(self.time_base + datetime.timedelta(hours=4))
+                try:
+                    region = await self.resolve_region(nation, event_text)
+                except tracker.HTTPError as e:
+                    # e.g. the nation has ceased to exist since the event. the rest of the batch is still good.
+                    self.log.append("ERROR: Could not find region of {} ({}).".format(nation, e))
+                    region = None
+                except self.api_errors as e:
+                    self.log.append("ERROR: Could not find region of {} ({}); will retry.".format(
+                        nation, str(e) or type(e).__name__))
+                    break
+
+                if region is not None:
+                    # calculate how long after the update start the event was observed
+                    event_time -= self.update_start()
 
-                if self.debug is True:
-                    self.log.append("HIT: {} updated {} sec in".format(region, event_time))
-                    self.log.append("API Query: {}".format(region_url.replace(" ", "_")))
+                    if event_time < 0:
+                        if self.debug is True:
+                            self.log.append("SKIP: {} changed {} sec before the update".format(region, -event_time))
+                    else:
+                        if self.debug is True:
+                            self.log.append("HIT: {} updated {} sec in".format(region, event_time))
 
-                return [region, event_time]
-        return None
+                        observations.append([region, event_time])
+            # the cursor only moves past events that have been dealt with
+            self.last_event_id = event_id
+        return observations
+
+    def track_population(self, event_text):
+        """
+        Applies a nation moving, being founded or ceasing to exist to the populations Oracle predicts with.
+
+        :param event_text: Text of a happening
+        :return: True if the happening was a population change
+        """
+        regions = event_text.split("%%")[1::2]
+        if " relocated from " in event_text and len(regions) >= 2:
+            changes = ((regions[0], -1), (regions[1], 1))
+        elif (" was founded in " in event_text or " was refounded in " in event_text) and regions:
+            changes = ((regions[0], 1),)
+        elif " ceased to exist in " in event_text and regions:
+            changes = ((regions[0], -1),)
+        else:
+            return False
+        for region, delta in changes:
+            region = region.replace("_", " ")
+            if self.trace is not None:
+                self.trace.population(self.mode, region, delta)
+            try:
+                self.oracle.adjust_population(region, delta)
+            except KeyError:
+                # region founded since the dump was taken
+                pass
+        if self.debug is True:
+            self.log.append("POPULATION: {}".format(", ".join("{} {:+d}".format(r, d) for r, d in changes)))
+        return True
+
+    async def find_event_async(self):
+        """
+        Queries the NationStates API for the next event which may reveal the current progress of the update. Runs on
+        the tracker's event loop.
+
+        Events are returned one at a time, oldest first; the ones after it are left for the next call rather than lost.
+
+        :return: Array [region_name, observed_update_time] for the oldest event not yet returned, or None if no event
+        was observed.
+        """
+        observations = await self.find_events_async(limit=1)
+        return observations[0] if observations else None
+
+    def find_event(self):
+        """
+        Queries the NationStates API for the next event which may reveal the current progress of the update.
+
+        :return: Array [region_name, observed_update_time] for the oldest event not yet returned, or None if no event
+        was observed.
+        """
+        return self.tracker.call(self.find_event_async())
+
+    def observe(self, observations):
+        """
+        Recalibrates Oracle from a batch of observed update times.
+
+        :param observations: List of [region_name, observed_update_time] arrays, oldest first
+        :return: Number of observations used
+        """
+        used = 0
+        for region, observed_time in observations:
+            try:
+                if self.record_observation(region, observed_time):
+                    used += 1
+            except KeyError:
+                # region founded since the dump was taken
+                if self.debug:
+                    self.log.append("WARNING: {} is not in the dump.".format(region))
+        if observations:
+            self.calibration_changed()
+        return used
+
+    def record_observation(self, region, observed_time, mode=None):
+        """
+        Feeds one observed update time to Oracle, recording it in the trace if one is being kept.
+
+        :param region: Name of region
+        :param observed_time: Observed update time in seconds after the start of the update
+        :param mode: Update the observation belongs to, or None for the current mode
+        :return: True if Oracle used the observation, False if it was rejected as an outlier
+        :raises KeyError: if the region is not in the dump
+        """
+        mode = mode or self.mode
+        predicted = self.oracle.get_time(region, mode)
+        accepted = self.oracle.set_offset(region, observed_time, mode)
+        if self.trace is not None:
+            self.trace.observation(mode, region.lower(), observed_time, predicted)
+        return accepted
+
+    def calibration_changed(self, mode=None):
+        """
+        Records a change to Oracle's calibration in the trace and the update history, and tells every calibration
+        listener about it.
+
+        :param mode: Update whose calibration changed, or None for the current mode
+        """
+        mode = mode or self.mode
+        if self.trace is not None:
+            params = self.oracle.params
+            self.trace.calibration(mode, params.speed[mode], params.offset[mode], params.nudge)
+        if self.history is not None:
+            with self.oracle.lock:
+                self.history.record(self.time_base.date(), mode, self.oracle.calibration[mode])
+        for listener in self.calibration_listeners:
+            listener(mode)
 
     def pull_time(self):
+        """
+        Starts a manual API query on the tracker thread. The prompt is not held up; the result is logged.
+        """
         if self.tracking is False:
-            event_time = self.find_event()
-            if event_time is not None:
-                self.oracle.set_offset(event_time[0], event_time[1], self.mode)
-                return "Recalibrated."
-            else:
-                return "No event found."
+            wait = self.tracker.limiter.delay() if self.tracker.limiter is not None else 0
+            if wait > 0:
+                # never hold the prompt up waiting for the budget
+                return "ERROR: API request budget used up; try again in {:.0f} seconds.".format(math.ceil(wait))
+            if self.pull is not None and not self.pull.done():
+                return "A manual query is already running."
+            self.pull = self.tracker.submit(self._pull())
+            return "Query sent."
         else:
             return "Manual queries disabled while automatic tracking enabled."
 
-    def _runner(self):
+    async def _pull(self):
+        try:
+            observations = await self.find_events_async()
+        except self.api_errors as e:
+            self.log.append("ERROR: API query failed ({}).".format(e or type(e).__name__))
+            return
+        if self.observe(observations):
+            self.log.append("Recalibrated from {} events.".format(len(observations)))
+        else:
+            self.log.append("No event found.")
+
+    def poll_delay(self):
+        """
+        Chooses how long to wait before the next tracking query: quickly while the target is about to update, slowly
+        while nothing is happening, and never sooner than the request budget allows.
+
+        :return: Seconds
+        """
+        delay = min(self.max_poll_interval, self.poll_interval * 2 ** min(self.idle_polls, 8))
+        elapsed = self.elapsed()
+        for target in (self.target,) + self.watched if self.target else self.watched:
+            try:
+                remaining = self.oracle.get_time(target, self.mode) - elapsed
+            except KeyError:
+                continue
+            if -self.target_grace < remaining < self.approach:
+                delay = min(delay, max(self.min_poll_interval, self.poll_interval * max(remaining, 0) / self.approach))
+        if self.tracker.limiter is not None:
+            delay = max(delay, self.tracker.limiter.delay())
+        return delay
+
+    def set_tracking(self, enabled):
+        """
+        Starts or stops automatic tracking. Starting polls at the fastest rate again straight away; stopping abandons
+        any poll in flight.
+
+        :param enabled: True to start tracking, False to stop
+        :return: Human readable confirmation
+        """
+        self.tracking = enabled
+        if enabled:
+            self.idle_polls = 0
+            self.wake_runner()
+        else:
+            self.tracker.loop.call_soon_threadsafe(self._cancel_poll)
+        return "Tracking set to {}.".format(enabled)
+
+    def wake_runner(self):
+        """
+        Tells the tracking loop to reconsider when to poll next, e.g. because the target or tracking state changed.
+        """
+        self.tracker.loop.call_soon_threadsafe(self.wake.set)
+
+    async def _runner(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.poll_interval
         while True:
-            time.sleep(5)
-            if self.tracking is True:
+            try:
+                deadline = await self._step(loop, deadline)
+            except Exception as e:
+                # e.g. the history file could not be written or a happening was malformed. tracking carries on; the
+                # runner itself being cancelled is not an Exception and still ends the loop.
+                self.log.append("ERROR: Tracking step failed ({}: {}).".format(type(e).__name__, e))
+                self.idle_polls += 1
+                deadline = loop.time() + self.poll_interval
+
+    async def _step(self, loop, deadline):
+        """
+        Runs one round of the tracking loop: waits until deadline or until woken, then polls if tracking.
+
+        :return: Event loop time of the next round
+        """
+        timeout = deadline - loop.time()
+        if timeout > 0:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                # woken early: poll sooner if the new circumstances call for it, but never later than planned
+                self.wake.clear()
+                return min(deadline, loop.time() + (self.poll_delay() if self.tracking else timeout))
+
+        deadline = loop.time() + self.poll_interval
+        self.sync_mode()
+        if self.tracking is True:
+            if self.debug:
+                self.log.append("Making query...")
+            # keep a handle on the query so that stopping tracking can cancel it mid-flight
+            self.poll = asyncio.ensure_future(self.find_events_async())
+            self.poll_cancelled = False
+            try:
+                observations = await self.poll
+            except asyncio.CancelledError:
+                # only a poll cancelled by stopping tracking is survivable; anything else is the runner itself
+                # being cancelled, e.g. by Tracker.close()
+                if not self.poll_cancelled:
+                    raise
                 if self.debug:
-                    self.log.append("Making query...")
-                event_time = self.find_event()
+                    self.log.append("Query cancelled.")
+                return deadline
+            except self.api_errors as e:
+                self.log.append("ERROR: API query failed ({}).".format(str(e) or type(e).__name__))
+                self.idle_polls += 1
+                return loop.time() + self.poll_delay()
+            finally:
+                self.poll = None
+
+            self.idle_polls = 0 if observations else self.idle_polls + 1
+            used = self.observe(observations)
+            if used and self.debug:
+                self.log.append("INFO: {} events observed, latest {}".format(used, observations[-1]))
+            deadline = loop.time() + self.poll_delay()
+            if self.debug:
+                self.log.append("Next query in {:.1f} s".format(deadline - loop.time()))
+        elif self.debug is True:
+            self.log.append("Tracking is disabled...")
+        return deadline
+
+    def enable_metrics(self, path=None):
+        """
+        Starts measuring Oracle and Delphi. See metrics.instrument. Measurements start from scratch.
+
+        :param path: Optional path of a Prometheus text file to write the measurements to periodically
+        """
+        self.disable_metrics()
+        self.metrics = metrics.Metrics()
+        metrics.instrument(self, self.metrics)
+        if path:
+            self.metrics_stop = threading.Event()
+            threading.Thread(target=self._write_metrics, args=(self.metrics, path, self.metrics_stop),
+                             daemon=True).start()
 
-                if event_time is not None:
-                    self.oracle.set_offset(event_time[0], event_time[1], self.mode)
-                    if self.debug:
-                        self.log.append("INFO: Event observed {}".format(event_time))
-            elif self.debug is True:
-                self.log.append("Tracking is disabled...")
+    def _write_metrics(self, measured, path, stop):
+        while True:
+            try:
+                measured.write(path)
+            except OSError as e:
+                self.log.append("WARNING: Could not write {} ({}).".format(path, e))
+            if stop.wait(self.metrics_interval):
+                break
+
+    def disable_metrics(self):
+        """
+        Stops measuring, putting the original methods back so that nothing is slowed down.
+        """
+        if self.metrics_stop is not None:
+            self.metrics_stop.set()
+            self.metrics_stop = None
+        if self.metrics is not None:
+            metrics.uninstrument(self)
+            self.metrics = None
+
+    def close(self):
+        """
+        Stops tracking and releases the API connection pool and trace file.
+        """
+        self.tracking = False
+        self.disable_metrics()
+        self.tracker.close()
+        if self.trace is not None:
+            self.trace.close()
+
+    def _cancel_poll(self):
+        if self.poll is not None:
+            self.poll_cancelled = True
+            self.poll.cancel()
 
 if __name__ == '__main__':
     print("Delphi: Interactive Oracle Shell\n")
     user = input("Primary Nation Name: ")
 
+    regions = "./regions.xml.gz"
+    # a nations dump, if one has been downloaded, saves an API call for every observed event
+    # observations, predictions and calibration changes are kept in a trace for later analysis with replay.py, and
+    # each update's calibration is kept in a history to start the next run from
+    options = dict(nations="./nations.xml.gz" if os.path.exists("./nations.xml.gz") else None,
+                   trace="./delphi_trace.jsonl", history="./delphi_history.bin",
+                   passworded="./passworded.txt" if os.path.exists("./passworded.txt") else None)
     refresh = input("Do you want to download the latest daily dump? (Y/N) ")
     if refresh.lower() == 'y':
-        print("Downloading regions.xml.gz...")
-        url = 'https://www.nationstates.net/pages/regions.xml.gz'
-        request = urllib.request.Request(url=url, headers={'User-Agent': "oracle2/{}".format(user)})
-        with urllib.request.urlopen(request) as r, open("regions.xml.gz", 'wb') as out:
-            shutil.copyfileobj(r, out)
-            out.close()
+        # the dump is only downloaded if it changed since the last download, and is parsed as it arrives
+        print("Checking for a new regions.xml.gz...")
+        try:
+            delphi = Delphi.from_download(download.REGIONS_URL, regions, user, **options)
+        except OSError as e:
+            raise SystemExit("ERROR: {}".format(e))
+    else:
+        delphi = Delphi(regions=regions, ua=user, **options)
 
-        print("Download complete.")
+    def show_log():
+        # show messages from the tracker thread as they arrive rather than at the next command
+        while True:
+            for message in delphi.log.drain(timeout=1):
+                print("\n" + message)
 
-    delphi = Delphi(regions="./regions.xml.gz", ua=user)
+    threading.Thread(target=show_log, daemon=True).start()
 
     while True:
         time_now = datetime.datetime.utcnow()
         print("\nLast target: {} (Type 'r' to recall time prediction.)".format(delphi.target))
         cmd = input('[{:02d}:{:02d}:{:02d} UTC] DELPHI> '.format(time_now.hour, time_now.minute, time_now.second))
         if cmd == 'quit':
+            delphi.close()
             break
         print(delphi.parse(cmd))
@@ -0,0 +1,166 @@
+import hashlib
+import io
+import json
+import os
+import urllib.error
+import urllib.request
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+REGIONS_URL = "https://www.nationstates.net/pages/regions.xml.gz"
+NATIONS_URL = "https://www.nationstates.net/pages/nations.xml.gz"
+
+# HTTP validators of a downloaded file are kept next to it with this suffix; a partial download is kept with
+# PART_SUFFIX, with its own validators alongside
+META_SUFFIX = '.meta'
+PART_SUFFIX = '.part'
+
+
+def read_meta(path):
+    try:
+        with open(path + META_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_meta(path, headers):
+    meta = {key: headers[header] for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified'))
+            if headers.get(header)}
+    with open(path + META_SUFFIX, 'w') as f:
+        json.dump(meta, f)
+
+
+def remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class DumpStream(io.RawIOBase):
+    def __init__(self, response, path, resume_from=0):
+        """
+        Readable stream of a dump as it downloads. Every byte read is also written to a partial file and hashed, so
+        the dump can be parsed while it is still arriving and is saved to disk at the same time. When the download
+        ends, the partial file replaces path. If it is interrupted, the partial file is kept so open_dump() can resume.
+
+        :param response: HTTP response for the dump, or for its remainder if resuming
+        :param path: Path the complete dump is saved to
+        :param resume_from: Number of bytes already in the partial file. They are read back before the response.
+        """
+        super().__init__()
+        self.response = response
+        self.path = path
+        self.part = open(path + PART_SUFFIX, 'r+b' if resume_from else 'wb')
+        self.local = resume_from
+        self.received = resume_from
+        length = response.headers.get('Content-Length')
+        self.expected = resume_from + int(length) if length else None
+        self.sha = hashlib.sha256()
+        self.complete = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.complete:
+            return 0
+        view = memoryview(buffer)
+        if self.local:
+            # replay the part downloaded by an earlier run
+            count = self.part.readinto(view[:min(len(view), self.local)])
+            self.local -= count
+        else:
+            data = self.response.read1(len(view))
+            if not data:
+                self._finish()
+                return 0
+            count = len(data)
+            view[:count] = data
+            self.part.write(data)
+            self.received += count
+        self.sha.update(view[:count])
+        return count
+
+    def _finish(self):
+        self.part.close()
+        if self.expected is not None and self.received < self.expected:
+            raise OSError("Download of {} ended after {} of {} bytes".format(self.path, self.received, self.expected))
+        os.replace(self.path + PART_SUFFIX, self.path)
+        os.replace(self.path + PART_SUFFIX + META_SUFFIX, self.path + META_SUFFIX)
+        self.complete = True
+
+    def digest(self):
+        """
+        Finishes the download, if the reader stopped early, and gets its content hash.
+
+        :return: SHA-256 digest of the complete dump as bytes, as Oracle.dump_digest() would calculate it
+        """
+        while self.read(1 << 16):
+            pass
+        return self.sha.digest()
+
+    def close(self):
+        if not self.closed:
+            self.part.close()
+            self.response.close()
+        super().close()
+
+
+def open_dump(url, path, ua, timeout=30):
+    """
+    Starts downloading a dump unless the copy at path is already current. The request is conditional on the
+    validators saved with the last download, and a partial download left by an interrupted run is resumed rather than
+    started again.
+
+    :param url: URL of the dump, e.g. REGIONS_URL
+    :param path: Path to save the dump to
+    :param ua: User agent string that identifies the operator, as required by NS TOS
+    :param timeout: Socket timeout in seconds
+    :return: DumpStream to read the dump from as it downloads, or None if the copy at path is current
+    :raises urllib.error.URLError: if the download cannot be started
+    """
+    headers = {'User-Agent': ua}
+    meta = read_meta(path) if os.path.exists(path) else {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    part = path + PART_SUFFIX
+    part_meta = read_meta(part) if os.path.exists(part) else {}
+    resume_from = os.path.getsize(part) if part_meta.get('etag') or part_meta.get('last_modified') else 0
+    if resume_from:
+        headers['Range'] = "bytes={}-".format(resume_from)
+        # only resume if the dump has not changed since the partial download started
+        headers['If-Range'] = part_meta.get('etag') or part_meta['last_modified']
+
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        if e.code == 416 and resume_from:
+            # the partial download is unusable; start over
+            remove(part)
+            remove(part + META_SUFFIX)
+            return open_dump(url, path, ua, timeout)
+        raise
+
+    if response.status != 206:
+        resume_from = 0
+        write_meta(part, response.headers)
+    return DumpStream(response, path, resume_from)
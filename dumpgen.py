@@ -0,0 +1,126 @@
+import argparse
+import gzip
+import random
+from xml.sax.saxutils import escape
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore "
+         "magna aliqua region nation delegate founder embassy update raid defend liberate").split()
+
+
+def populations(count, distribution, rng):
+    """
+    Generates region populations. The real world is dominated by one-nation regions with a long tail of large ones,
+    which the default pareto distribution imitates.
+
+    :param count: Number of regions
+    :param distribution: pareto, lognormal or uniform
+    :param rng: random.Random instance
+    :return: Generator of populations
+    """
+    for _ in range(count):
+        if distribution == 'pareto':
+            yield min(10000, int(rng.paretovariate(1.1)))
+        elif distribution == 'lognormal':
+            yield max(1, min(10000, int(rng.lognormvariate(0.5, 1.2))))
+        else:
+            yield rng.randint(1, 50)
+
+
+def text(rng, length):
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def generate(path, count=20000, distribution='pareto', factbook=500, embassies=5, founderless=0.3, seed=0,
+             nations=None):
+    """
+    Writes a synthetic regions.xml.gz dump with the same structure as the real one.
+
+    :param path: Path to write regions dump to
+    :param count: Number of regions
+    :param distribution: Population distribution: pareto, lognormal or uniform
+    :param factbook: Approximate factbook length in characters
+    :param embassies: Embassies per region
+    :param founderless: Fraction of regions without a founder
+    :param seed: Random seed, so runs are repeatable
+    :param nations: Optional path to also write a matching nations.xml.gz dump to
+    :return: Total population
+    """
+    rng = random.Random(seed)
+    total = 0
+    nation_out = gzip.open(nations, 'wt', encoding='utf-8') if nations else None
+    try:
+        if nation_out:
+            nation_out.write('<?xml version="1.0" encoding="UTF-8"?>\n<NATIONS>\n')
+        with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as out:
+            out.write('<?xml version="1.0" encoding="UTF-8"?>\n<REGIONS>\n')
+            for i, population in enumerate(populations(count, distribution, rng)):
+                total += population
+                name = "Synthetic Region {}".format(i)
+                residents = ["synthetic_nation_{}_{}".format(i, j) for j in range(population)]
+                has_founder = rng.random() >= founderless
+                endos = rng.randint(0, min(population - 1, 500)) if population > 1 else 0
+                out.write("<REGION><NAME>{name}</NAME><FACTBOOK>{factbook}</FACTBOOK>"
+                          "<NUMNATIONS>{population}</NUMNATIONS><NATIONS>{nations}</NATIONS>"
+                          "<DELEGATE>{delegate}</DELEGATE><DELEGATEVOTES>{endos}</DELEGATEVOTES>"
+                          "<DELEGATEAUTH>X</DELEGATEAUTH><FOUNDER>{founder}</FOUNDER><FOUNDERAUTH>X</FOUNDERAUTH>"
+                          "<GOVERNOR>{founder}</GOVERNOR><POWER>Low</POWER><FLAG></FLAG>"
+                          "<EMBASSIES>{embassies}</EMBASSIES><LASTUPDATE>0</LASTUPDATE></REGION>\n".format(
+                              name=escape(name),
+                              factbook=escape(text(rng, factbook)),
+                              population=population,
+                              nations=":".join(residents[:100]),
+                              delegate=residents[0] if endos else "0",
+                              endos=endos + 1 if endos else 0,
+                              founder=residents[0] if has_founder else "0",
+                              embassies="".join("<EMBASSY>Synthetic Region {}</EMBASSY>".format(rng.randrange(count))
+                                                for _ in range(embassies))))
+                if nation_out:
+                    nation_out.write("".join("<NATION><NAME>{}</NAME><REGION>{}</REGION></NATION>\n".format(
+                        resident, escape(name)) for resident in residents))
+            out.write('</REGIONS>\n')
+        if nation_out:
+            nation_out.write('</NATIONS>\n')
+    finally:
+        if nation_out:
+            nation_out.close()
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic NationStates regions.xml.gz dump.")
+    parser.add_argument('path', help="path to write regions dump to")
+    parser.add_argument('--regions', type=int, default=20000, help="number of regions")
+    parser.add_argument('--distribution', choices=('pareto', 'lognormal', 'uniform'), default='pareto',
+                        help="population distribution")
+    parser.add_argument('--factbook', type=int, default=500, help="approximate factbook length in characters")
+    parser.add_argument('--embassies', type=int, default=5, help="embassies per region")
+    parser.add_argument('--founderless', type=float, default=0.3, help="fraction of regions without a founder")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    parser.add_argument('--nations', help="also write a matching nations dump to this path")
+    arguments = parser.parse_args()
+
+    population = generate(arguments.path, arguments.regions, arguments.distribution, arguments.factbook,
+                          arguments.embassies, arguments.founderless, arguments.seed, arguments.nations)
+    print("Wrote {} regions with {} nations to {}".format(arguments.regions, population, arguments.path))
@@ -0,0 +1,327 @@
+import array
+import datetime
+import html
+import json
+import math
+import os
+import struct
+import sys
+
+from regiontable import RegionTable
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+# number of rows formatted and written at a time
+CHUNK_SIZE = 4096
+
+REGION_URL = "http://www.nationstates.net/region="
+
+# export columns are (key, label, kind). kind is one of region, str, int, float or bool. A value of None is missing:
+# CSV and HTML leave the cell blank and JSON Lines writes null. The binary format has no missing values, so it stores
+# NaN or an empty string.
+REGION_COLUMNS = (('region', 'URL', 'region'),
+                  ('population', 'Population', 'int'),
+                  ('endorsements', 'Endorsements', 'int'),
+                  ('founderless', 'Founderless?', 'bool'),
+                  ('h', 'H', 'int'),
+                  ('m', 'M', 'int'),
+                  ('s', 'S', 'int'))
+
+
+def region_url(name):
+    return REGION_URL + name.replace(" ", "_")
+
+
+def hyperlink(name):
+    return '=HYPERLINK("{}")'.format(region_url(name))
+
+
+class Writer:
+    """
+    Base class for export formats. A writer is handed rows in chunks and is responsible for formatting them; it never
+    sees the whole table at once.
+    """
+    binary = False
+
+    def __init__(self, out, columns, title=()):
+        """
+        :param out: File object to write to. Opened in binary mode if the writer's binary attribute is set.
+        :param columns: Sequence of (key, label, kind) column descriptions
+        :param title: Sequence of strings describing the table, e.g. update mode and date
+        """
+        self.out = out
+        self.columns = columns
+        self.title = title
+
+    def begin(self):
+        pass
+
+    def write(self, rows):
+        raise NotImplementedError
+
+    def end(self):
+        pass
+
+    def _convert(self, rows, region=region_url):
+        """
+        Replaces region names in region columns with the output of region(), and missing values with empty strings.
+        Empty names are left empty.
+        """
+        positions = [i for i, column in enumerate(self.columns) if column[2] == 'region']
+        converted = []
+        for row in rows:
+            if positions or None in row:
+                row = ["" if value is None else value for value in row]
+                for i in positions:
+                    row[i] = region(row[i]) if row[i] else ""
+            converted.append(row)
+        return converted
+
+
+class CsvWriter(Writer):
+    def begin(self):
+        self.out.write(",".join([column[0] for column in self.columns] + [""] + list(self.title)) + "\n")
+        self.template = ",".join(['%s'] * len(self.columns)) + "\n"
+
+    def write(self, rows):
+        template = self.template
+        # region links are spreadsheet formulas; an empty region cell stays empty rather than linking nowhere
+        self.out.write("".join([template % tuple(row) for row in self._convert(rows, hyperlink)]))
+
+
+class HtmlWriter(Writer):
+    def begin(self):
+        self.out.write("<html><head><title>{}</title></head><body>\n<table><tr>{}</tr>\n".format(
+            html.escape(" update, ".join(self.title)),
+            "".join("<td>{}</td>".format(html.escape(column[1])) for column in self.columns)))
+        self.template = "<tr>" + "<td>%s</td>" * len(self.columns) + "</tr>\n"
+
+    def write(self, rows):
+        template = self.template
+        self.out.write("".join([template % tuple(row)
+                                for row in self._convert(rows, lambda name: html.escape(region_url(name)))]))
+
+    def end(self):
+        self.out.write("</table>\n</body>\n</html>\n")
+
+
+class JsonLinesWriter(Writer):
+    def begin(self):
+        self.keys = [column[0] for column in self.columns]
+
+    def write(self, rows):
+        keys = self.keys
+        dumps = json.dumps
+        self.out.write("".join([dumps(dict(zip(keys, row))) + "\n" for row in rows]))
+
+
+class ColumnarWriter(Writer):
+    """
+    Compact binary format. Rows are stored in blocks of up to CHUNK_SIZE rows, and each block stores its values column
+    by column. Numbers are little-endian; strings are stored as an array of UTF-8 lengths followed by the joined bytes.
+    See read_columnar() for a reader.
+    """
+    binary = True
+    magic = b'ORCX'
+    version = 1
+    typecodes = {'int': 'q', 'float': 'd', 'bool': 'B'}
+
+    @staticmethod
+    def _pack_string(value):
+        value = value.encode('utf-8')
+        return struct.pack('<I', len(value)) + value
+
+    def begin(self):
+        out = self.out
+        out.write(self.magic + struct.pack('<HHH', self.version, len(self.columns), len(self.title)))
+        for key, label, kind in self.columns:
+            out.write(self._pack_string(key) + self._pack_string(label) + self._pack_string(kind))
+        for value in self.title:
+            out.write(self._pack_string(value))
+
+    def write(self, rows):
+        if not rows:
+            return
+        out = self.out
+        out.write(struct.pack('<I', len(rows)))
+        for i, (key, label, kind) in enumerate(self.columns):
+            if kind in self.typecodes:
+                values = [row[i] for row in rows]
+                if kind == 'float' and None in values:
+                    values = [math.nan if value is None else value for value in values]
+                column = array.array(self.typecodes[kind], values)
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                out.write(column.tobytes())
+            else:
+                values = [("" if row[i] is None else str(row[i])).encode('utf-8') for row in rows]
+                lengths = array.array('I', [len(value) for value in values])
+                if sys.byteorder == 'big':
+                    lengths.byteswap()
+                out.write(lengths.tobytes())
+                out.write(b"".join(values))
+
+    def end(self):
+        # an empty block marks the end of the table
+        self.out.write(struct.pack('<I', 0))
+
+
+WRITERS = {'csv': CsvWriter,
+           'html': HtmlWriter,
+           'jsonl': JsonLinesWriter,
+           'bin': ColumnarWriter}
+
+
+def read_columnar(path):
+    """
+    Reads a file written by ColumnarWriter.
+
+    :param path: Path to file
+    :return: Tuple of (columns, title, rows) where rows is a generator of row tuples
+    """
+    f = open(path, 'rb')
+
+    def string():
+        length, = struct.unpack('<I', f.read(4))
+        return f.read(length).decode('utf-8')
+
+    if f.read(4) != ColumnarWriter.magic:
+        f.close()
+        raise ValueError("{} is not a columnar export".format(path))
+    version, column_count, title_count = struct.unpack('<HHH', f.read(6))
+    columns = [(string(), string(), string()) for _ in range(column_count)]
+    title = [string() for _ in range(title_count)]
+
+    def rows():
+        with f:
+            while True:
+                count, = struct.unpack('<I', f.read(4))
+                if count == 0:
+                    return
+                values = []
+                for key, label, kind in columns:
+                    if kind in ColumnarWriter.typecodes:
+                        column = array.array(ColumnarWriter.typecodes[kind])
+                        column.frombytes(f.read(count * column.itemsize))
+                        if sys.byteorder == 'big':
+                            column.byteswap()
+                        values.append(column.tolist() if kind != 'bool' else [bool(v) for v in column])
+                    else:
+                        lengths = array.array('I')
+                        lengths.frombytes(f.read(count * 4))
+                        if sys.byteorder == 'big':
+                            lengths.byteswap()
+                        blob = f.read(sum(lengths))
+                        strings = []
+                        position = 0
+                        for length in lengths:
+                            strings.append(blob[position:position + length].decode('utf-8'))
+                            position += length
+                        values.append(strings)
+                yield from zip(*values)
+
+    return columns, title, rows()
+
+
+def write_table(path, fmt, columns, rows, title=(), chunk_size=CHUNK_SIZE):
+    """
+    Streams rows to a file in the given format, formatting and writing chunk_size rows at a time.
+
+    :param path: Path to write to
+    :param fmt: Export format (a key of WRITERS)
+    :param columns: Sequence of (key, label, kind) column descriptions
+    :param rows: Iterable of row tuples matching columns
+    :param title: Sequence of strings describing the table
+    :param chunk_size: Number of rows to buffer before writing
+    """
+    writer_class = WRITERS[fmt]
+    with open(path, 'wb' if writer_class.binary else 'w', buffering=1 << 16) as out:
+        writer = writer_class(out, columns, title)
+        writer.begin()
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                writer.write(chunk)
+                chunk = []
+        writer.write(chunk)
+        writer.end()
+
+
+def region_rows(oracle, mode, indices, chunk_size=CHUNK_SIZE):
+    """
+    Generates export rows for regions, computing update times one chunk at a time.
+
+    :param oracle: Oracle to export from
+    :param mode: Update to export times for (must be major or minor)
+    :param indices: Sequence of table indices to export
+    :param chunk_size: Number of update times to compute at a time
+    :return: Generator of rows matching REGION_COLUMNS
+    """
+    table = oracle.table
+    names, population, endos, flags = table.names, table.population, table.endos, table.flags
+    for start in range(0, len(indices), chunk_size):
+        chunk = indices[start:start + chunk_size]
+        for i, (h, m, s) in zip(chunk, oracle.get_times_hms(mode, chunk)):
+            yield names[i], population[i], endos[i], bool(flags[i] & RegionTable.FOUNDERLESS), h, m, s
+
+
+def format_for(path, default='csv'):
+    """
+    Guesses an export format from a path's extension.
+    """
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    return extension if extension in WRITERS else default
+
+
+def export(oracle, path, fmt=None, modes=('major',), regions=None, flags=0, chunk_size=CHUNK_SIZE):
+    """
+    Exports a sorted table of update information. Regions are selected once and then streamed to one file per mode.
+
+    :param oracle: Oracle to export from
+    :param path: Path to export to. When exporting more than one mode, '{mode}' in the path is replaced by the mode
+                 name; if it is absent, the mode name is inserted before the extension.
+    :param fmt: Export format (csv, html, jsonl or bin). Guessed from the path if not given.
+    :param modes: Updates to export (major and/or minor)
+    :param regions: Iterable of region names or table indices to export. If None, every region is considered.
+    :param flags: Flag bits (see RegionTable) a region must have to be exported
+    :param chunk_size: Number of rows to process at a time
+    :return: List of paths written
+    """
+    fmt = fmt or format_for(path)
+    if fmt not in WRITERS:
+        raise ValueError("Unknown export format '{}'".format(fmt))
+
+    if regions is None and not flags:
+        indices = range(len(oracle.table))
+    else:
+        indices = oracle.select(regions, flags)
+
+    date = datetime.date.today().strftime("%B %d-%Y")
+    paths = []
+    for mode in modes:
+        if len(modes) == 1:
+            mode_path = path
+        elif '{mode}' in path:
+            mode_path = path.replace('{mode}', mode)
+        else:
+            root, extension = os.path.splitext(path)
+            mode_path = "{}-{}{}".format(root, mode, extension)
+        write_table(mode_path, fmt, REGION_COLUMNS, region_rows(oracle, mode, indices, chunk_size), (mode, date),
+                    chunk_size)
+        paths.append(mode_path)
+    return paths
@@ -0,0 +1,136 @@
+import array
+import itertools
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class FenwickTree:
+    def __init__(self, size):
+        """
+        Binary indexed tree of integers, all initially zero, with O(log n) point updates and prefix sums.
+
+        :param size: Number of values
+        """
+        # tree[i] holds the sum of the values in (i - lowbit(i), i], 1-based
+        self.tree = array.array('q', bytes(8 * (size + 1)))
+
+    def __len__(self):
+        return len(self.tree) - 1
+
+    def add(self, i, delta):
+        """
+        Adds delta to value i.
+        """
+        tree = self.tree
+        i += 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """
+        Sums values [0, i).
+        """
+        tree = self.tree
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i &= i - 1
+        return total
+
+
+def cumulate(population):
+    """
+    Calculates cumulative population, or cPop.
+    Why? cPop * per nation update time = region update time
+    The first updating region has a cPop of zero; every other region's cPop is the previous region's cPop plus its own
+    population.
+
+    :param population: Sequence of region populations in update order
+    :return: Array of cumulative populations
+    """
+    if not len(population):
+        return array.array('q')
+    return array.array('q', itertools.accumulate(itertools.islice(population, 1, None), initial=0))
+
+
+class CumulativePopulation:
+    # changes are folded into the flat array once this many have accumulated per region, amortising the O(n) rebuild
+    compact_ratio = 1 / 64
+
+    def __init__(self, population, cumulative=None):
+        """
+        Cumulative population column that stays current as region populations change. Reads come from a flat array of
+        cumulative populations plus a Fenwick tree of the changes made since it was calculated, so a population change
+        is O(log n) rather than a rebuild of the column. Until the first change, reads go straight to the flat array.
+
+        Changes must be serialised by the caller, e.g. under Oracle.lock, but reads need no lock: the flat array and
+        change tree are published together, and only add() ever replaces them.
+
+        :param population: Sequence of region populations in update order. Population changes must be made to this
+                           sequence before they are reported with add().
+        :param cumulative: Precalculated cumulative populations, e.g. from a snapshot
+        """
+        self.population = population
+        # (flat array, change tree or None), replaced as a whole so readers always see a matching pair
+        self.state = (cumulate(population) if cumulative is None else cumulative, None)
+        self.pending = 0
+
+    def __len__(self):
+        return len(self.state[0])
+
+    def __getitem__(self, i):
+        base, changes = self.state
+        if changes is None:
+            return base[i]
+        if i < 0:
+            i += len(base)
+        return base[i] + changes.prefix(i + 1)
+
+    def __iter__(self):
+        base, changes = self.state
+        if changes is None:
+            return iter(base)
+        # a full pass is O(n) anyway, so recalculate from the populations rather than query the tree n times
+        return iter(cumulate(self.population))
+
+    def add(self, i, delta):
+        """
+        Records that the population of region i changed by delta.
+        """
+        if i == 0 or not delta:
+            # the first region's population is not part of any cPop
+            return
+        base, changes = self.state
+        if changes is None:
+            changes = FenwickTree(len(base))
+            changes.add(i, delta)
+            self.state = (base, changes)
+        else:
+            changes.add(i, delta)
+        self.pending += 1
+        if self.pending > len(base) * self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """
+        Recalculates the flat array from the current populations and discards the change tree. Like add(), this must
+        only be called by the writer.
+        """
+        if self.state[1] is not None:
+            self.state = (cumulate(self.population), None)
+        self.pending = 0
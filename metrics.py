@@ -0,0 +1,356 @@
+import bisect
+import collections
+import functools
+import os
+import threading
+import time
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+# upper bounds of latency histogram buckets in seconds, from microsecond lookups to slow API calls
+BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help text) of every metric Delphi exports
+METRICS = {
+    'oracle_dump_regions': ('gauge', "Regions in the loaded dump"),
+    'oracle_dump_parse_seconds': ('gauge', "Time spent parsing the dump, or 0 if it came from a snapshot"),
+    'oracle_index_build_seconds': ('gauge', "Time spent building the region table and its indexes"),
+    'oracle_get_time_seconds': ('histogram', "Latency of Oracle.get_time"),
+    'delphi_command_seconds': ('histogram', "Latency of Delphi commands, by command"),
+    'delphi_api_request_seconds': ('histogram', "Latency of NationStates API requests, including waits for the "
+                                                "request budget"),
+    'delphi_api_errors_total': ('counter', "Failed NationStates API requests, by error"),
+    'delphi_observations_total': ('counter', "Observed update times fed to calibration, by update and result"),
+    'delphi_observation_age_seconds': ('gauge', "Time since the last observed update time, by update"),
+    'delphi_observation_rate_per_minute': ('gauge', "Observed update times per minute over the rate window, by "
+                                                    "update"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        """
+        Fixed bucket histogram of durations, as used by Prometheus.
+
+        :param buckets: Sorted upper bounds of buckets. Values above the last bound fall into an overflow bucket.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by interpolating within the bucket it falls in.
+
+        :param q: Quantile between 0 and 1
+        :return: Estimated value, or 0 if nothing has been observed
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+class Metrics:
+    # observations older than this many seconds do not count towards the observation rate
+    rate_window = 300
+
+    def __init__(self):
+        """
+        Registry of latency histograms, counters and gauges, kept by (name, labels) where labels is a tuple of
+        (label, value) pairs. Safe to update from any thread.
+        """
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = collections.Counter()
+        # values may be callables, which are evaluated when the metrics are read
+        self.gauges = {}
+        # mode -> timestamps of recent observations
+        self.observations = collections.defaultdict(collections.deque)
+
+    def observe(self, name, value, labels=()):
+        """
+        Adds a value to a histogram.
+        """
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram()
+            histogram.observe(value)
+
+    def count(self, name, labels=(), amount=1):
+        """
+        Adds to a counter.
+        """
+        with self.lock:
+            self.counters[(name, labels)] += amount
+
+    def gauge(self, name, value, labels=()):
+        """
+        Sets a gauge to a number, or to a callable that returns a number (or None to leave the gauge out).
+        """
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def observation(self, mode, accepted, now=None):
+        """
+        Records an observed update time being fed to calibration.
+
+        :param mode: Update the observation belongs to
+        :param accepted: True if calibration used it, False if it was rejected as an outlier
+        :param now: Unix timestamp of the observation. Defaults to now.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            self.counters[('delphi_observations_total',
+                           (('mode', mode), ('result', 'accepted' if accepted else 'rejected')))] += 1
+            recent = self.observations[mode]
+            recent.append(now)
+            while recent[0] < now - self.rate_window:
+                recent.popleft()
+
+    def _observation_gauges(self, now):
+        gauges = {}
+        for mode, recent in self.observations.items():
+            while recent and recent[0] < now - self.rate_window:
+                recent.popleft()
+            labels = (('mode', mode),)
+            gauges[('delphi_observation_rate_per_minute', labels)] = len(recent) * 60 / self.rate_window
+            if recent:
+                gauges[('delphi_observation_age_seconds', labels)] = now - recent[-1]
+        return gauges
+
+    def snapshot(self):
+        """
+        Takes a consistent copy of every metric.
+
+        :return: Tuple (histograms, counters, gauges) of dictionaries keyed by (name, labels). Histograms are copies.
+        """
+        with self.lock:
+            histograms = {}
+            for key, histogram in self.histograms.items():
+                copy = histograms[key] = Histogram(histogram.buckets)
+                copy.counts, copy.count, copy.sum, copy.max = (list(histogram.counts), histogram.count,
+                                                               histogram.sum, histogram.max)
+            counters = dict(self.counters)
+            gauges = self._observation_gauges(time.time())
+            for key, value in self.gauges.items():
+                value = value() if callable(value) else value
+                if value is not None:
+                    gauges[key] = value
+        return histograms, counters, gauges
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        labels = labels + extra
+        if not labels:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for key, value in labels) + "}"
+
+    def render(self):
+        """
+        Formats every metric in the Prometheus text exposition format.
+
+        :return: String
+        """
+        histograms, counters, gauges = self.snapshot()
+        series = collections.defaultdict(list)
+        for values in (counters, gauges):
+            for (name, labels), value in sorted(values.items()):
+                series[name].append("{}{} {}".format(name, self._labels(labels), value))
+        for (name, labels), histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                series[name].append("{}_bucket{} {}".format(name, self._labels(labels, (('le', bound),)), cumulative))
+            series[name].append("{}_sum{} {}".format(name, self._labels(labels), histogram.sum))
+            series[name].append("{}_count{} {}".format(name, self._labels(labels), histogram.count))
+
+        lines = []
+        for name in sorted(series):
+            kind, text = METRICS.get(name, ('untyped', name))
+            lines += ["# HELP {} {}".format(name, text), "# TYPE {} {}".format(name, kind)]
+            lines += series[name]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes every metric to a Prometheus text file, e.g. for node_exporter's textfile collector. The file is
+        replaced in one step, so a reader never sees a partial file.
+        """
+        temp = path + '.tmp'
+        with open(temp, 'w') as out:
+            out.write(self.render())
+        os.replace(temp, path)
+
+
+def duration(seconds):
+    """
+    Formats a duration for people, e.g. 2.5 us or 1.20 s.
+    """
+    if seconds < 1e-3:
+        return "{:.1f} us".format(seconds * 1e6)
+    if seconds < 1:
+        return "{:.1f} ms".format(seconds * 1e3)
+    return "{:.2f} s".format(seconds)
+
+
+def timed(metrics, name, function, labels=()):
+    """
+    Wraps a function so each call's duration is added to a histogram.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            metrics.observe(name, time.perf_counter() - start, labels)
+    return wrapper
+
+
+# (attribute holding the object, method) pairs replaced on instrumented objects; see instrument()
+INSTRUMENTED = (('oracle', 'get_time'), (None, 'parse'), (None, 'record_observation'), ('tracker', 'query'))
+
+
+def instrument(delphi, metrics):
+    """
+    Starts measuring a Delphi and its Oracle and tracker. The measured methods are replaced on the instances only, so
+    nothing is measured, and nothing is slowed down, until this is called or after uninstrument() is called.
+
+    :param delphi: Delphi to measure
+    :param metrics: Metrics to record to
+    """
+    oracle = delphi.oracle
+    for name, stat in (('oracle_dump_regions', 'regions'), ('oracle_dump_parse_seconds', 'parse_time'),
+                       ('oracle_index_build_seconds', 'index_time')):
+        metrics.gauge(name, functools.partial(lambda stat: oracle.load_stats.get(stat), stat))
+
+    oracle.get_time = timed(metrics, 'oracle_get_time_seconds', oracle.get_time)
+
+    # one histogram per command; anything else is lumped together so typos cannot create new series
+    commands = {value for key, value in vars(type(delphi)).items() if key.startswith('cmd_')}
+    parse = delphi.parse
+
+    @functools.wraps(parse)
+    def timed_parse(command):
+        start = time.perf_counter()
+        try:
+            return parse(command)
+        finally:
+            action = command.split(" ")[0]
+            metrics.observe('delphi_command_seconds', time.perf_counter() - start,
+                            (('command', action if action in commands else 'other'),))
+    delphi.parse = timed_parse
+
+    record_observation = delphi.record_observation
+
+    @functools.wraps(record_observation)
+    def counted_observation(region, observed_time, mode=None):
+        accepted = record_observation(region, observed_time, mode)
+        metrics.observation(mode or delphi.mode, accepted)
+        return accepted
+    delphi.record_observation = counted_observation
+
+    query = delphi.tracker.query
+
+    @functools.wraps(query)
+    async def timed_query(**params):
+        labels = (('query', params.get('q', '').split(';')[0]),)
+        start = time.perf_counter()
+        try:
+            return await query(**params)
+        except Exception as e:
+            status = getattr(e, 'status', None)
+            metrics.count('delphi_api_errors_total',
+                          (('error', type(e).__name__ if status is None else "HTTP {}".format(status)),))
+            raise
+        finally:
+            metrics.observe('delphi_api_request_seconds', time.perf_counter() - start, labels)
+    delphi.tracker.query = timed_query
+
+
+def uninstrument(delphi):
+    """
+    Stops measuring a Delphi, putting back the original methods.
+    """
+    for owner, method in INSTRUMENTED:
+        vars(getattr(delphi, owner) if owner else delphi).pop(method, None)
+
+
+def summary(metrics):
+    """
+    Summarises metrics for people.
+
+    :return: List of lines
+    """
+    histograms, counters, gauges = metrics.snapshot()
+    lines = []
+    if ('oracle_dump_regions', ()) in gauges:
+        parse_time = gauges.get(('oracle_dump_parse_seconds', ()), 0)
+        lines.append("Dump: {} regions, {}, indexes built in {}".format(
+            gauges[('oracle_dump_regions', ())], "parsed in {}".format(duration(parse_time)) if parse_time else
+            "loaded from snapshot", duration(gauges.get(('oracle_index_build_seconds', ()), 0))))
+
+    def latency(title, histogram):
+        return "{}: {} calls, p50 {}, p99 {}, max {}".format(title, histogram.count, duration(histogram.quantile(0.5)),
+                                                            duration(histogram.quantile(0.99)),
+                                                            duration(histogram.max))
+
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name == 'oracle_get_time_seconds':
+            lines.append(latency("get_time", histogram))
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name == 'delphi_command_seconds':
+            lines.append(latency("Command '{}'".format(dict(labels)['command']), histogram))
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name == 'delphi_api_request_seconds':
+            lines.append(latency("API {}".format(dict(labels)['query'] or "query"), histogram))
+    errors = sorted((dict(labels)['error'], count) for (name, labels), count in counters.items()
+                    if name == 'delphi_api_errors_total')
+    if errors:
+        lines.append("API errors: " + ", ".join("{} x{}".format(error, count) for error, count in errors))
+
+    for mode in ('major', 'minor'):
+        accepted = counters.get(('delphi_observations_total', (('mode', mode), ('result', 'accepted'))), 0)
+        rejected = counters.get(('delphi_observations_total', (('mode', mode), ('result', 'rejected'))), 0)
+        if not accepted and not rejected:
+            continue
+        age = gauges.get(('delphi_observation_age_seconds', (('mode', mode),)))
+        lines.append("Observations ({}): {} accepted, {} rejected, last {}, {:.1f}/min over the last {} min".format(
+            mode, accepted, rejected, "{:.0f} s ago".format(age) if age is not None else "over {} min ago".format(
+                metrics.rate_window // 60),
+            gauges[('delphi_observation_rate_per_minute', (('mode', mode),))], metrics.rate_window // 60))
+    return lines
@@ -0,0 +1,181 @@
+import bisect
+import threading
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def normalize(name):
+    """
+    Converts a region name as typed or pasted from a URL to the form used by the dump: lowercase, with spaces in
+    place of underscores and no repeated or surrounding whitespace.
+    """
+    return " ".join(name.replace("_", " ").lower().split())
+
+
+def distance(a, b, limit):
+    """
+    Optimal string alignment distance (edits, including swapping two adjacent characters) between two strings.
+
+    :param limit: Stop early and return limit + 1 once the distance is known to exceed limit
+    :return: Distance
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # typos are usually surrounded by matching text, which cannot change the distance
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start:len(a) - end]
+    b = b[start:len(b) - end]
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class NameIndex:
+    def __init__(self, names, max_distance=1):
+        """
+        Index of region names for forgiving lookups: URL-style names, prefix completion and typo correction.
+
+        Typo correction uses precomputed deletions: every name is stored under each string that can be made by
+        deleting up to max_distance characters from it. A query is matched by generating its own deletions and looking
+        them up, so only a handful of candidates ever have their edit distance computed. The deletion index is many
+        times the size of the names, so it is built when first needed, or ahead of time on a background thread with
+        build_in_background(); exact and prefix lookups use the sorted names alone.
+
+        :param names: List of lowercase region names, as in RegionTable.names
+        :param max_distance: Maximum number of typos to correct. 0 disables typo correction.
+        """
+        self.names = names
+        self.max_distance = max_distance
+        # names from the dump are already normalized; share those strings rather than copying them
+        self.keys = []
+        for name in names:
+            key = normalize(name)
+            self.keys.append(name if key == name else key)
+        self.exact = {key: i for i, key in enumerate(self.keys)}
+        self.sorted = sorted(self.exact)
+
+        # deletion -> index of name, or list of indices if several names share it. Built by _deletion_index().
+        self.deletions = None
+        self.lock = threading.Lock()
+
+    def build_in_background(self):
+        """
+        Starts building the deletion index on a background thread, so that the first typo correction does not have to
+        wait for it. A lookup made while it is being built waits for it to finish.
+        """
+        threading.Thread(target=self._deletion_index, name="name index", daemon=True).start()
+
+    def _deletion_index(self):
+        with self.lock:
+            if self.deletions is not None:
+                return self.deletions
+            # most deletions belong to a single name, so storing a bare index saves a list per entry
+            deletions = {}
+            for key, i in self.exact.items():
+                for deletion in self._deletions(key):
+                    existing = deletions.get(deletion)
+                    if existing is None:
+                        deletions[deletion] = i
+                    elif isinstance(existing, list):
+                        existing.append(i)
+                    else:
+                        deletions[deletion] = [existing, i]
+            self.deletions = deletions
+            return deletions
+
+    def _deletions(self, key):
+        found = {key}
+        frontier = {key}
+        for _ in range(self.max_distance):
+            frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+            found |= frontier
+        return found
+
+    def complete(self, prefix, limit=10):
+        """
+        Finds region names starting with a prefix.
+
+        :param prefix: Start of region name
+        :param limit: Maximum number of names to return
+        :return: List of region names in alphabetical order
+        """
+        prefix = normalize(prefix)
+        matches = []
+        i = bisect.bisect_left(self.sorted, prefix)
+        while i < len(self.sorted) and len(matches) < limit and self.sorted[i].startswith(prefix):
+            matches.append(self.names[self.exact[self.sorted[i]]])
+            i += 1
+        return matches
+
+    def fuzzy(self, query, limit=10):
+        """
+        Finds region names within max_distance typos of a query.
+
+        :param query: Region name
+        :param limit: Maximum number of names to return
+        :return: List of (region name, distance) tuples, closest first
+        """
+        query = normalize(query)
+        deletions = self.deletions if self.deletions is not None else self._deletion_index()
+        candidates = set()
+        for deletion in self._deletions(query):
+            found = deletions.get(deletion)
+            if found is None:
+                continue
+            candidates.update(found if isinstance(found, list) else (found,))
+        matches = []
+        for i in candidates:
+            edits = distance(query, self.keys[i], self.max_distance)
+            if edits <= self.max_distance:
+                matches.append((edits, i))
+        matches.sort()
+        return [(self.names[i], edits) for edits, i in matches[:limit]]
+
+    def match(self, query, limit=10):
+        """
+        Finds the regions a user most likely meant: an exact match, else names starting with the query, else names
+        within max_distance typos of it.
+
+        :param query: Region name as typed
+        :param limit: Maximum number of names to return
+        :return: List of region names, best first. A single name means the match is unambiguous.
+        """
+        key = normalize(query)
+        if key in self.exact:
+            return [self.names[self.exact[key]]]
+        matches = self.complete(key, limit)
+        if matches:
+            return matches
+        matches = self.fuzzy(key, limit)
+        if matches and (len(matches) == 1 or matches[0][1] < matches[1][1]):
+            return [matches[0][0]]
+        return [name for name, edits in matches]
@@ -0,0 +1,200 @@
+import array
+import collections
+import gzip
+import mmap
+import os
+import struct
+import sys
+import xml.etree.ElementTree as ElementTree
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def normalize(nation):
+    """
+    Converts a nation name to the lowercase, underscored form used in API URLs and happenings.
+    """
+    return nation.strip().lower().replace(" ", "_")
+
+
+class NationIndex:
+    # index files are written next to the nations dump with this suffix
+    suffix = '.index'
+
+    magic = b'ORNI'
+    version = 1
+    # magic, version, byte order marker, source size, source mtime, nation count, region count, nation blob length,
+    # region blob length
+    header = struct.Struct('=4sIIQdQQQQ')
+    byte_order_marker = 0x01020304
+
+    def __init__(self, path):
+        """
+        Memory-mapped nation -> region index compiled from a nations.xml.gz dump by NationIndex.build(). Nation names
+        are stored sorted so that a lookup is a binary search over the mapping; only region names are decoded up front.
+
+        :param path: Path to compiled index
+        :raises ValueError: if the file is not a nation index
+        """
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._data
+        if len(data) < self.header.size:
+            raise ValueError("{} is not a nation index".format(path))
+        (magic, version, bom, self.source_size, self.source_mtime, self.count, region_count, nation_length,
+         region_length) = self.header.unpack_from(data)
+        if (magic, version, bom) != (self.magic, self.version, self.byte_order_marker):
+            raise ValueError("{} is not a nation index".format(path))
+
+        view = memoryview(data)
+        position = self.header.size
+        self.offsets = view[position:position + (self.count + 1) * 8].cast('Q')
+        position += (self.count + 1) * 8
+        self.region_ids = view[position:position + self.count * 4].cast('I')
+        position += self.count * 4
+        self._nations_start = position
+        position += nation_length
+        self.regions = bytes(view[position:position + region_length]).decode('utf-8').split("\n")
+
+    def __len__(self):
+        return self.count
+
+    def _nation(self, i):
+        start = self._nations_start
+        return self._data[start + self.offsets[i]:start + self.offsets[i + 1]]
+
+    def get(self, nation, default=None):
+        """
+        Looks up a nation's region as of the dump the index was built from.
+
+        :param nation: Nation name
+        :param default: Value to return if the nation is not in the index
+        :return: Region name
+        """
+        key = normalize(nation).encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._nation(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._nation(low) == key:
+            return self.regions[self.region_ids[low]]
+        return default
+
+    def is_current(self, nations):
+        """
+        Checks whether the index was built from the given nations dump.
+        """
+        stat = os.stat(nations)
+        return (stat.st_size, stat.st_mtime) == (self.source_size, self.source_mtime)
+
+    @classmethod
+    def build(cls, nations, path=None):
+        """
+        Streams a nations.xml.gz dump and writes a compact nation -> region index.
+
+        :param nations: Path to NationStates nations.xml.gz dump
+        :param path: Path to write index to. Defaults to the dump's path with NationIndex.suffix appended.
+        :return: Path of index
+        """
+        path = path or nations + cls.suffix
+        entries = []
+        region_ids = {}
+        with gzip.open(nations) as f:
+            root = None
+            for event, element in ElementTree.iterparse(f, events=('start', 'end')):
+                if root is None:
+                    root = element
+                elif event == 'end' and element.tag == 'NATION':
+                    region = element.findtext("REGION")
+                    region_id = region_ids.setdefault(region, len(region_ids))
+                    entries.append((normalize(element.findtext("NAME")).encode('utf-8'), region_id))
+                    root.clear()
+        entries.sort()
+
+        offsets = array.array('Q', [0])
+        ids = array.array('I')
+        for name, region_id in entries:
+            offsets.append(offsets[-1] + len(name))
+            ids.append(region_id)
+        nation_blob = b"".join(name for name, region_id in entries)
+        region_blob = "\n".join(sorted(region_ids, key=region_ids.get)).encode('utf-8')
+
+        stat = os.stat(nations)
+        temp = path + '.tmp'
+        with open(temp, 'wb') as out:
+            out.write(cls.header.pack(cls.magic, cls.version, cls.byte_order_marker, stat.st_size, stat.st_mtime,
+                                      len(entries), len(region_ids), len(nation_blob), len(region_blob)))
+            out.write(offsets.tobytes())
+            out.write(ids.tobytes())
+            out.write(nation_blob)
+            out.write(region_blob)
+        os.replace(temp, path)
+        return path
+
+    @classmethod
+    def open(cls, nations):
+        """
+        Opens the index for a nations dump, building it first if it is missing or out of date.
+
+        :param nations: Path to NationStates nations.xml.gz dump
+        :return: NationIndex
+        """
+        path = nations + cls.suffix
+        try:
+            index = cls(path)
+            if index.is_current(nations):
+                return index
+        except (OSError, ValueError):
+            pass
+        return cls(cls.build(nations, path))
+
+
+class LRUCache:
+    def __init__(self, size=4096):
+        """
+        Small least-recently-used cache, for nations the index does not cover.
+
+        :param size: Maximum number of entries
+        """
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        except KeyError:
+            return default
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python3 nationindex.py <nations.xml.gz>")
+        sys.exit(1)
+    print("Wrote {}".format(NationIndex.build(sys.argv[1])))
@@ -1,8 +1,20 @@
 import xml.etree.ElementTree as ET
-import urllib.request
-import urllib
 import gzip
+import time
+import tracemalloc
+import array
+import bisect
+import collections
 import datetime
+import hashlib
+import threading
+import types
+
+import export
+from calibration import Calibration
+from download import DumpStream
+from nameindex import NameIndex
+from regiontable import RegionTable
 
 # Oracle 2 NationStates Update Prediction Framework
 # Copyright (c) 2017 Khronion <khronion@gmail.com>
@@ -20,17 +32,36 @@ import datetime
 # You should have received a copy of the GNU General Public License
 # along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
 
+# prediction parameters: update speed and offset per mode (read-only mappings) and nudge. Oracle publishes a new
+# Parameters whenever any of them changes rather than changing them in place, so a reader that takes Oracle.params once
+# always sees a consistent set, even while another thread is recalibrating.
+Parameters = collections.namedtuple('Parameters', ('speed', 'offset', 'nudge'))
+
 
 class Oracle:
-    def __init__(self, regions, ua):
+    # compiled dump snapshots are written next to the dump with this suffix
+    snapshot_suffix = '.snapshot'
+
+    def __init__(self, regions, ua, profile=False, snapshot=True, passworded=None, history=None):
         """
         Initializes an Oracle object to process a NationStates regions.xml.gz dump.
 
-        :param regions: Path to NationStates regions.xml.gz dump
+        :param regions: Path to NationStates regions.xml.gz dump, or a download.DumpStream to parse the dump from as it
+                        downloads
         :param ua: User Agent string that identifies the operator as required by NS TOS; Should be an email or nation
+        :param profile: Record peak memory use while parsing the dump in self.load_stats, along with parse and index
+                        build times
+        :param snapshot: Load from and save to a compiled snapshot of the dump (only when regions is a path or a
+                         DumpStream)
+        :param passworded: Optional iterable of passworded region names, which the dump does not record
+        :param history: Optional updatehistory.History of past updates to start calibration from. See apply_history.
         """
 
-        self.speed = {'minor': 60 * 45, 'major': 60 * 60}
+        # serialises changes to calibration and to the table; readers never need it
+        self.lock = threading.RLock()
+        # default offset and nudge are zero. Each update is calibrated separately, so each has its own offset.
+        self.params = Parameters(types.MappingProxyType({'minor': 60 * 45, 'major': 60 * 60}),
+                                 types.MappingProxyType({'minor': 0, 'major': 0}), 0)
 
         self.version = 1
         # set UA
@@ -38,50 +69,249 @@ class Oracle:
 
         # set major/minor mode. Assume major unless user passes minor in because seriously, who's around for minor?
 
-        # load founderless regions into a list
-        apiCall = 'https://www.nationstates.net/cgi-bin/api.cgi?q=regionsbytag;tags=founderless,-password'
-        ns_request_url = urllib.request.Request(url=apiCall, headers={'User-Agent': self.ua})
-        founderlessXML = ET.fromstring((urllib.request.urlopen(ns_request_url).read().decode()))
-        founderlessList = founderlessXML.find("REGIONS").text.lower().split(",")
-        # load regions.xml.gz
-        with gzip.open(regions) as f:
-            regionsXML = ET.parse(f).getroot()
-
-        # populate regionList with tuples that links region name to update time and other useful info
-        # this is made accessible in the future in case the user decides to regenerate times with a new update speed
-        # regionList format: name, population, cumulative population, endorsements, founderless status
-        self.regionList = []
-        for region in regionsXML:
-            name = region.find("NAME").text.lower()
-            population = int(region.find("NUMNATIONS").text)
-            endos = int(region.find("DELEGATEVOTES").text)
-            if name.lower() in founderlessList:
-                founderless = True
-            else:
-                founderless = False
-            self.regionList.append([name, population, 0, endos, founderless])
-
-        # calculate cumulative population, or cPop.
-        # Why? cPop * per nation update time = region update time
-        for i in range(len(self.regionList)):
-            # we are on the first updating region, cPop is zero
-            if i == 0:
-                self.regionList[i][2] = 0
-            # cPop is previous region's cPop plus region's population
+        # reuse the compiled snapshot of this dump if we have seen it before. Snapshots are keyed by the dump's
+        # content hash, so a new day's dump is always parsed from scratch.
+        self.table = None
+        digest = None
+        # seconds spent building the table and its indexes, as opposed to parsing the dump
+        index_time = 0.0
+        if snapshot and isinstance(regions, str):
+            digest = self.dump_digest(regions)
+            started = time.perf_counter()
+            self.table = RegionTable.load(regions + self.snapshot_suffix, digest)
+            index_time += time.perf_counter() - started
+            if self.table is not None:
+                self.load_stats = {'regions': len(self.table), 'parse_time': 0, 'peak_memory': None,
+                                   'snapshot': regions + self.snapshot_suffix}
+
+        if self.table is None:
+            # stream regions.xml.gz into a columnar table of region name, population, endorsements and flags, in
+            # update order. founderless status and other flags come from the dump itself, so no API call is needed.
+            # cumulative population is calculated by the table.
+            names = []
+            population = array.array('q')
+            endos = array.array('q')
+            flags = array.array('B')
+            for name, pop, endo, flag in self.load_regions(regions, profile):
+                names.append(name)
+                population.append(pop)
+                endos.append(endo)
+                flags.append(flag)
+            started = time.perf_counter()
+            self.table = RegionTable(names, population, endos, flags)
+            index_time += time.perf_counter() - started
+
+            if isinstance(regions, DumpStream):
+                # finishes saving the download. The stream hashed the dump on its way through, so the snapshot costs
+                # no second read of the file.
+                digest = regions.digest()
+                regions = regions.path
+            if digest is not None and snapshot:
+                self.table.save(regions + self.snapshot_suffix, digest)
+
+        # the dump does not record which regions have passwords
+        if passworded is not None:
+            self.table.mark(passworded, RegionTable.PASSWORDED)
+
+        # forgiving name lookups (URL-style names, prefixes and typos) for interactive use
+        started = time.perf_counter()
+        self.names = NameIndex(self.table.names)
+        self.load_stats['index_time'] = index_time + time.perf_counter() - started
+
+        # observed update times are fitted per update; see set_offset
+        self.calibration = {mode: Calibration(speed) for mode, speed in self.speed.items()}
+        if history is not None:
+            self.apply_history(history)
+
+    @property
+    def speed(self):
+        """
+        Update length in seconds for each mode.
+        """
+        return self.params.speed
+
+    @property
+    def offset(self):
+        """
+        Offset in seconds for each mode. Assigning a number sets the offset of every mode.
+        """
+        return self.params.offset
+
+    @offset.setter
+    def offset(self, offset):
+        self._publish(offset=offset if isinstance(offset, dict) else dict.fromkeys(self.params.offset, offset))
+
+    @property
+    def nudge(self):
+        return self.params.nudge
+
+    @nudge.setter
+    def nudge(self, nudge):
+        self._publish(nudge=nudge)
+
+    def _publish(self, speed=None, offset=None, **changes):
+        """
+        Replaces the prediction parameters in one step.
+
+        :param speed: Dictionary of update speeds to change, by mode
+        :param offset: Dictionary of offsets to change, by mode
+        :param changes: Other Parameters fields to change
+        """
+        with self.lock:
+            if speed:
+                changes['speed'] = types.MappingProxyType(dict(self.params.speed, **speed))
+            if offset:
+                changes['offset'] = types.MappingProxyType(dict(self.params.offset, **offset))
+            self.params = self.params._replace(**changes)
+
+    def load_regions(self, regions, profile=False):
+        """
+        Streams a regions.xml.gz dump and yields only the fields Oracle needs. Each <REGION> element is discarded as
+        soon as it has been read, so the full document is never held in memory. Parse time and, when profiling, peak
+        memory are stored in self.load_stats once the dump has been consumed.
+
+        :param regions: Path to NationStates regions.xml.gz dump, or a file object containing it
+        :param profile: Trace peak memory use during the parse. This slows parsing down considerably.
+        :return: Generator of (name, population, endorsements, flags) tuples in update order
+        """
+        tracing = profile and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        start = time.perf_counter()
+        count = 0
+
+        try:
+            with gzip.open(regions) as f:
+                root = None
+                for event, element in ET.iterparse(f, events=('start', 'end')):
+                    if root is None:
+                        root = element
+                    elif event == 'end' and element.tag == 'REGION':
+                        count += 1
+                        # regions without a founder, governor or delegate have "0" in place of a nation name.
+                        # older dumps have no GOVERNOR field; the founder was the governor then.
+                        founder = element.findtext("FOUNDER")
+                        governor = element.findtext("GOVERNOR", founder)
+                        flags = 0
+                        if founder in ("0", ""):
+                            flags |= RegionTable.FOUNDERLESS
+                        if governor in ("0", ""):
+                            flags |= RegionTable.GOVERNORLESS
+                        if element.findtext("DELEGATE") in ("0", ""):
+                            flags |= RegionTable.DELEGATELESS
+                        yield (element.findtext("NAME").lower(),
+                               int(element.findtext("NUMNATIONS")),
+                               int(element.findtext("DELEGATEVOTES")),
+                               flags)
+                        # drop the region (and its factbook, embassies, etc.) now that we are done with it
+                        root.clear()
+        finally:
+            self.load_stats = {'regions': count,
+                               'parse_time': time.perf_counter() - start,
+                               'peak_memory': tracemalloc.get_traced_memory()[1]
+                               if tracemalloc.is_tracing() else None}
+            if tracing:
+                tracemalloc.stop()
+
+    def ingest(self, regions, snapshot=True):
+        """
+        Brings Oracle up to date with a newer dump without reloading. If the new dump has the same regions in the same
+        order, only the regions whose population, endorsements or flags changed are applied to the table, and the
+        index, name index and calibration are kept. Otherwise the table is rebuilt from the new dump. Either way,
+        passworded regions stay marked.
+
+        :param regions: Path to the newer NationStates regions.xml.gz dump, a file object containing it or a
+                        download.DumpStream
+        :param snapshot: Save a compiled snapshot of the result for the new dump (only when regions is a path or a
+                         DumpStream)
+        :return: Tuple (number of regions changed, True if the table had to be rebuilt)
+        """
+        table = self.table
+        names = []
+        population = array.array('q')
+        endos = array.array('q')
+        flags = array.array('B')
+        changes = []
+        matching = True
+        for i, (name, pop, endo, flag) in enumerate(self.load_regions(regions)):
+            names.append(name)
+            population.append(pop)
+            endos.append(endo)
+            flags.append(flag)
+            if matching and (i >= len(table) or table.names[i] != name):
+                matching = False
+            if matching and (table.population[i] != pop or table.endos[i] != endo
+                             or table.flags[i] & ~RegionTable.PASSWORDED != flag):
+                changes.append((i, pop, endo, flag))
+
+        with self.lock:
+            if matching and len(names) == len(table):
+                table.update(changes)
+                changed, rebuilt = len(changes), False
             else:
-                self.regionList[i][2] = self.regionList[i - 1][2] + self.regionList[i][1]
+                # build the replacement completely before swapping it in, so readers see either table but never a mix
+                passworded = [table.names[i] for i in RegionTable.indices(table.flag_masks[RegionTable.PASSWORDED])]
+                replacement = RegionTable(names, population, endos, flags)
+                replacement.mark(passworded, RegionTable.PASSWORDED)
+                self.names = NameIndex(replacement.names)
+                self.table = replacement
+                changed, rebuilt = len(names), True
+
+        if isinstance(regions, DumpStream):
+            digest = regions.digest()
+            if snapshot:
+                self.table.save(regions.path + self.snapshot_suffix, digest)
+        elif snapshot and isinstance(regions, str):
+            self.table.save(regions + self.snapshot_suffix, self.dump_digest(regions))
+        return changed, rebuilt
+
+    def mark_passworded(self, regions):
+        """
+        Records which regions have passwords, which the dump does not. Regions marked before stay marked.
+
+        :param regions: Iterable of region names. Unknown names are ignored.
+        :return: Number of regions now marked as passworded
+        """
+        with self.lock:
+            self.table.mark(regions, RegionTable.PASSWORDED)
+            return self.table.flag_masks[RegionTable.PASSWORDED].bit_count()
 
-        # create dictionary of all regions for easy lookup
-        self.lookupTable = {}
-        self.sortedTable = []
-        for region in self.regionList:
-            self.lookupTable[region[0]] = region[1:]
+    def adjust_population(self, region, delta):
+        """
+        Adds to a region's population, e.g. when nations move in or out during an update. Predictions for every later
+        region follow immediately.
 
-        # set default offset to zero.
-        self.offset = 0
+        :param region: Name of region
+        :param delta: Change in population. Negative values are acceptable.
+        :raises KeyError: if the region is not in the dump
+        """
+        with self.lock:
+            i = self.table.lookup(region)
+            self.table.set_population(i, max(0, self.table.population[i] + delta))
 
-        # set default nudge to zero
-        self.nudge = 0
+    @staticmethod
+    def dump_digest(regions):
+        """
+        Calculates the content hash used to key compiled snapshots of a dump.
+
+        :param regions: Path to NationStates regions.xml.gz dump
+        :return: SHA-256 digest of the dump as bytes
+        """
+        sha = hashlib.sha256()
+        with open(regions, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        return sha.digest()
+
+    def find_regions(self, name, limit=10):
+        """
+        Finds the regions a user most likely meant by a name that may be URL-style, partial or mistyped.
+
+        :param name: Region name as typed
+        :param limit: Maximum number of regions to return
+        :return: List of region names, best first. A single name means the match is unambiguous.
+        """
+        return self.names.match(name, limit)
 
     # predicts a region's update time
     def get_time(self, region, mode):
@@ -93,9 +323,10 @@ class Oracle:
         :return: Time of update in seconds
         """
         # update time is given by region's cumulative population * per nation update speed
-        cPop = self.lookupTable[region.lower()][1]
+        cPop = self.table.cumulative[self.table.lookup(region)]
+        params = self.params
 
-        return cPop * self.speed[mode] / self.regionList[-1][2] - self.offset + self.nudge
+        return cPop * params.speed[mode] / self.table.total + (params.nudge - params.offset[mode])
 
     def get_time_hms(self, region, mode):
         """
@@ -112,6 +343,178 @@ class Oracle:
 
         return h, m, s
 
+    def window(self, start, end, mode):
+        """
+        Finds the regions predicted to update between two times.
+
+        :param start: Start of window in seconds after the beginning of the update, or None for the first region
+        :param end: End of window in seconds after the beginning of the update (inclusive), or None for the last region
+        :param mode: Update to use (must be major or minor)
+        :return: Tuple (first, stop) of the table index range [first, stop)
+        """
+        # invert get_time: cPop = (time - nudge + offset) * total / speed, then binary search the cPop column.
+        # the inversion can be off by a rounding error, so the bounds are then checked against get_time's own formula.
+        params = self.params
+        speed = params.speed[mode]
+        total = self.table.total
+        shift = params.nudge - params.offset[mode]
+        cumulative = self.table.cumulative
+        count = len(cumulative)
+
+        def time_of(i):
+            return cumulative[i] * speed / total + shift
+
+        def bound(t):
+            # number of regions predicted to have updated by time t
+            i = bisect.bisect_right(cumulative, (t - shift) * total / speed)
+            while i < count and time_of(i) <= t:
+                i += 1
+            while i > 0 and time_of(i - 1) > t:
+                i -= 1
+            return i
+
+        def lower(t):
+            # number of regions predicted to update before time t
+            i = bisect.bisect_left(cumulative, (t - shift) * total / speed)
+            while i < count and time_of(i) < t:
+                i += 1
+            while i > 0 and time_of(i - 1) >= t:
+                i -= 1
+            return i
+
+        first = 0 if start is None else lower(start)
+        stop = count if end is None else bound(end)
+        return first, max(first, stop)
+
+    def position(self, time, mode):
+        """
+        Finds the last region predicted to have updated by a given time. This is the reverse of get_time and uses the
+        current speed, offset and nudge, so nothing needs to be rebuilt when calibration changes.
+
+        :param time: Time in seconds after the beginning of the update
+        :param mode: Update to use (must be major or minor)
+        :return: Table index of region, or -1 if no region is predicted to have updated yet
+        """
+        return self.window(None, time, mode)[1] - 1
+
+    def region_at(self, time, mode):
+        """
+        Gets the region predicted to be updating at a given time.
+
+        :param time: Time in seconds after the beginning of the update
+        :param mode: Update to use (must be major or minor)
+        :return: Name of region, or None if the update is not predicted to have reached any region yet
+        """
+        i = self.position(time, mode)
+        return self.table.names[i] if i >= 0 else None
+
+    def regions_between(self, start, end, mode):
+        """
+        Gets the regions predicted to update in a window of time.
+
+        :param start: Start of window in seconds after the beginning of the update
+        :param end: End of window in seconds after the beginning of the update (inclusive)
+        :param mode: Update to use (must be major or minor)
+        :return: List of region names in update order
+        """
+        first, stop = self.window(start, end, mode)
+        return self.table.names[first:stop]
+
+    def next_regions(self, time, count, mode):
+        """
+        Gets the next regions predicted to update after a given time.
+
+        :param time: Time in seconds after the beginning of the update
+        :param count: Number of regions to return
+        :param mode: Update to use (must be major or minor)
+        :return: List of (name, update time in seconds) tuples in update order
+        """
+        first = self.position(time, mode) + 1
+        indices = range(first, min(first + count, len(self.table)))
+        return list(zip((self.table.names[i] for i in indices), self.get_times(mode, indices)))
+
+    def query(self, flags=0, min_endos=0, max_endos=None, start=None, end=None, mode='major', exclude=0):
+        """
+        Finds regions matching every given criterion by intersecting the table's bitmap indexes.
+
+        :param flags: Flag bits (see RegionTable.FLAGS) a region must have
+        :param min_endos: Minimum delegate endorsements (inclusive)
+        :param max_endos: Maximum delegate endorsements (exclusive), or None for no maximum
+        :param start: Earliest predicted update time in seconds, or None
+        :param end: Latest predicted update time in seconds, or None
+        :param mode: Update to use for start and end (must be major or minor)
+        :param exclude: Flag bits a region must not have, e.g. RegionTable.PASSWORDED
+        :return: Bitmap as an int; see RegionTable.indices()
+        """
+        mask = self.table.mask_of(flags)
+        for flag in RegionTable.FLAGS:
+            if exclude & flag:
+                mask &= ~self.table.flag_masks[flag]
+        if min_endos or max_endos is not None:
+            mask &= self.table.endo_mask(min_endos, max_endos)
+        if start is not None or end is not None:
+            mask &= self.table.range_mask(*self.window(start, end, mode))
+        return mask
+
+    def select(self, regions=None, flags=0, min_endos=0, max_endos=None, start=None, end=None, mode='major',
+               exclude=0):
+        """
+        Selects regions by name, flag bits, delegate endorsements and predicted update time. For example, founderless
+        regions with fewer than 10 endorsements updating in the first ten minutes of major are given by
+        select(flags=RegionTable.FOUNDERLESS, max_endos=10, end=600, mode='major').
+
+        :param regions: Iterable of region names or table indices. If None, every region is considered.
+        :param flags: Flag bits (see RegionTable.FLAGS) a region must have to be selected
+        :param min_endos: Minimum delegate endorsements (inclusive)
+        :param max_endos: Maximum delegate endorsements (exclusive), or None for no maximum
+        :param start: Earliest predicted update time in seconds, or None
+        :param end: Latest predicted update time in seconds, or None
+        :param mode: Update to use for start and end (must be major or minor)
+        :param exclude: Flag bits a region must not have, e.g. RegionTable.PASSWORDED
+        :return: List of table indices. Indices are in update order unless regions were given explicitly.
+        """
+        filtered = (flags or min_endos or max_endos is not None or start is not None or end is not None
+                    or exclude)
+        if regions is None:
+            if not filtered:
+                return list(range(len(self.table)))
+            return RegionTable.indices(self.query(flags, min_endos, max_endos, start, end, mode, exclude))
+
+        indices = [region if isinstance(region, int) else self.table.lookup(region) for region in regions]
+        if filtered:
+            selected = set(RegionTable.indices(self.query(flags, min_endos, max_endos, start, end, mode, exclude)))
+            return [i for i in indices if i in selected]
+        return indices
+
+    def get_times(self, mode, regions=None, flags=0):
+        """
+        Gets update times in seconds after the beginning of the update for many regions in one pass.
+
+        :param mode: Update to get update times for (must be major or minor)
+        :param regions: Iterable of region names or table indices. If None, the whole update is returned.
+        :param flags: Flag bits (see RegionTable) a region must have to be included
+        :return: List of update times in seconds, in the same order as Oracle.select(regions, flags)
+        """
+        params = self.params
+        speed = params.speed[mode]
+        total = self.table.total
+        shift = params.nudge - params.offset[mode]
+        cumulative = self.table.cumulative
+        if regions is None and not flags:
+            return [cPop * speed / total + shift for cPop in cumulative]
+        return [cumulative[i] * speed / total + shift for i in self.select(regions, flags)]
+
+    def get_times_hms(self, mode, regions=None, flags=0):
+        """
+        Gets update times as (hours, minutes, seconds) tuples for many regions in one pass.
+
+        :param mode: Update to get update times for (must be major or minor)
+        :param regions: Iterable of region names or table indices. If None, the whole update is returned.
+        :param flags: Flag bits (see RegionTable) a region must have to be included
+        :return: List of (hours, minutes, seconds) tuples, in the same order as Oracle.select(regions, flags)
+        """
+        return [(int(t / 3600), int(t / 60) % 60, int(t % 60)) for t in self.get_times(mode, regions, flags)]
+
     def get_info(self, region):
         """
         Get information about a region.
@@ -119,26 +522,65 @@ class Oracle:
         :param region: Region to get information about
         :return: Dictionary with the following keys: major, minor, population, cumulative, endos, founder
         """
-        data = self.lookupTable[region.lower()]
-        return {'major': self.get_time(region.lower(), 'major'),
-                'minor': self.get_time(region.lower(), 'minor'),
-                'population': data[0],
-                'cumulative': data[1],
-                'endos': data[2],
-                'founder': data[3]}
+        i = self.table.lookup(region)
+        return {'major': self.get_times('major', [i])[0],
+                'minor': self.get_times('minor', [i])[0],
+                'population': self.table.population[i],
+                'cumulative': self.table.cumulative[i],
+                'endos': self.table.endos[i],
+                'founder': bool(self.table.flags[i] & RegionTable.FOUNDERLESS)}
 
     # adjusts prediction offset needed based off a region and its true update time and returns it
     def set_offset(self, region, time, mode):
         """
-        Calculates a time offset to apply to all future predictions based off of difference between true and estimated
-        time.
+        Adds an observed update time to the calibration model for an update and applies the refitted offset (and,
+        once there are enough well spread observations, update speed) to all future predictions. Observations far
+        from the current fit are rejected as outliers. See calibration.Calibration.
 
         :param region: Region with known update time
         :param time: True update time of region in seconds
         :param mode: Update during which time was observed (must be "major or "minor")
+        :return: True if the observation was used, False if it was rejected
+        """
+        with self.lock:
+            accepted = self.calibration[mode].add(self.table.cumulative[self.table.lookup(region)] / self.table.total,
+                                                  time)
+            self._apply_calibration(mode)
+        return accepted
+
+    def reset_calibration(self, mode):
         """
-        estimate = self.get_time(region, mode)
-        self.offset += estimate - time
+        Discards every observation for an update and returns to its prior update speed and offset.
+
+        :param mode: Update to reset (must be "major" or "minor")
+        """
+        with self.lock:
+            self.calibration[mode].reset()
+            self._apply_calibration(mode)
+
+    def apply_history(self, history, day=None):
+        """
+        Starts calibration from past updates. For each update, the update speed and offset fitted across earlier days
+        become the priors, and observations already stored for the day itself, e.g. before a restart, are restored.
+
+        :param history: updatehistory.History of past updates
+        :param day: datetime.date of the current updates (UTC). Defaults to today.
+        :return: List of updates whose calibration was changed
+        """
+        day = day or datetime.datetime.utcnow().date()
+        changed = []
+        with self.lock:
+            for mode, model in self.calibration.items():
+                fit = history.fit(mode, model.prior_speed, day, before=day)
+                if fit is not None:
+                    model.set_prior(*fit)
+                if history.restore(day, mode, model) or fit is not None:
+                    self._apply_calibration(mode)
+                    changed.append(mode)
+        return changed
+
+    def _apply_calibration(self, mode):
+        self._publish(speed={mode: self.calibration[mode].speed}, offset={mode: self.calibration[mode].offset})
 
     def set_nudge(self, nudge):
         """
@@ -153,15 +595,32 @@ class Oracle:
         """
         Calculates the per nation update speed to apply to all future predictions based off the true update time of a
         late updating region. Incorrect values (or any value for an early updating region) will negatively impact
-        prediction accuracy. For best results, use an average value observed over several days.
+        prediction accuracy. For best results, use an average value observed over several days; apply_history() fits
+        one from stored past updates.
 
         :param time: True length of update
         :param mode: Update during which time was observed (must be "major" or "minor")
         """
         # per nation update speed is given by cumulative population / region update time in seconds
-        # store this update speed. It will be lost if Oracle is restarted.
+        # store this update speed as the calibration model's prior. It will be lost if Oracle is restarted.
         if mode in self.speed.keys():
-            self.speed[mode] = time
+            with self.lock:
+                self.calibration[mode].set_prior(time)
+                # the refit moves the offset as well as the speed
+                self._apply_calibration(mode)
+
+    def export(self, path, fmt=None, modes=('major',), regions=None, flags=0):
+        """
+        Exports a sorted table of update information in any supported format. See export.export() for details.
+
+        :param path: Path to export to. '{mode}' is replaced by the mode name when exporting several modes.
+        :param fmt: Export format (csv, html, jsonl or bin). Guessed from the path if not given.
+        :param modes: Updates to export information for (major and/or minor)
+        :param regions: Region names to export. If None, every region is considered.
+        :param flags: Flag bits (see RegionTable) a region must have to be exported
+        :return: List of paths written
+        """
+        return export.export(self, path, fmt, modes, regions, flags)
 
     # creates a sorted CSV.
     def csv_export(self, mode, path):
@@ -171,19 +630,7 @@ class Oracle:
         :param mode: Update to export information for (must be major or minor)
         :param path: Path to export CSV to.
         """
-        file = open(path, 'w')
-        with file as out:
-            out.write("region,population,endorsements,founderless,h,m,s,,{},{}\n".
-                      format(mode, datetime.date.today().strftime("%B %d-%Y")))
-            for i in self.regionList:
-                out.write("=HYPERLINK(\"{url}\"),{pop},{endo},{founderless},{h},{m},{s}\n".format(
-                    url="http://www.nationstates.net/region=" + i[0].replace(" ", "_"),
-                    pop=i[1],
-                    endo=i[3],
-                    founderless=i[4],
-                    h=self.get_time_hms(i[0], mode)[0],
-                    m=self.get_time_hms(i[0], mode)[1],
-                    s=self.get_time_hms(i[0], mode)[2]))
+        self.export(path, 'csv', (mode,))
 
     # creates a sorted HTML page.
     def html_export(self, mode, path):
@@ -193,31 +640,7 @@ class Oracle:
         :param mode: Update to export information for (must be major or minor)
         :param path: Path to export HTML file to.
         """
-        file = open(path, 'w')
-        with file as out:
-            out.write("""
-            <html><head><title>{} update, {}</title></head><body>
-            <table><tr><td>URL</td><td>Population</td><td>Endorsements</td>
-            <td>Founderless?</td><td>H</td><td>M</td><td>S</td></tr>
-            """.format(mode, datetime.date.today().strftime("%B %d-%Y")))
-
-            for i in self.regionList:
-                out.write(
-                    "<tr><td>{url}</td><td>{pop}</td><td>{endo}</td>"
-                    "<td>{founderless}</td><td>{h}</td><td>{m}</td><td>{s}</td></tr>\n".format(
-                        url="http://www.nationstates.net/region=" + i[0].replace(" ", "_"),
-                        pop=i[1],
-                        endo=i[3],
-                        founderless=i[4],
-                        h=self.get_time_hms(i[0], mode)[0],
-                        m=self.get_time_hms(i[0], mode)[1],
-                        s=self.get_time_hms(i[0], mode)[2]))
-
-            out.write("""
-            </table>
-            </body>
-            </html>
-            """)
+        self.export(path, 'html', (mode,))
 
     def founderless_export(self, mode, path):
         """
@@ -226,17 +649,4 @@ class Oracle:
         :param mode: Update to export information for (must be major or minor)
         :param path: Path to export CSV to.
         """
-        file = open(path, 'w')
-        with file as out:
-            out.write("region,population,endorsements,founderless,h,m,s,,{},{}\n".
-                      format(mode, datetime.date.today().strftime("%B %d-%Y")))
-            for i in self.regionList:
-                if i[4] is True:
-                    out.write("=HYPERLINK(\"{url}\"),{pop},{endo},{founderless},{h},{m},{s}\n".format(
-                        url="http://www.nationstates.net/region=" + i[0].replace(" ", "_"),
-                        pop=i[1],
-                        endo=i[3],
-                        founderless=i[4],
-                        h=self.get_time_hms(i[0], mode)[0],
-                        m=self.get_time_hms(i[0], mode)[1],
-                        s=self.get_time_hms(i[0], mode)[2]))
\ No newline at end of file
+        self.export(path, 'csv', (mode,), flags=RegionTable.FOUNDERLESS)
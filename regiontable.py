@@ -0,0 +1,308 @@
+import array
+import bisect
+import mmap
+import os
+import struct
+
+from fenwick import CumulativePopulation
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class RegionTable:
+    # region flag bits. All but PASSWORDED are derived from the dump; the dump does not record passwords, so that bit
+    # is only set when a list of passworded regions is supplied with mark().
+    FOUNDERLESS = 1
+    GOVERNORLESS = 2
+    DELEGATELESS = 4
+    PASSWORDED = 8
+    FLAGS = (FOUNDERLESS, GOVERNORLESS, DELEGATELESS, PASSWORDED)
+
+    # lower bounds of the delegate endorsement bands that are indexed. The last band is open ended.
+    ENDO_BANDS = (0, 1, 5, 10, 20, 50, 100, 200)
+
+    # compiled snapshot format
+    snapshot_magic = b'ORC2'
+    snapshot_version = 3
+    # magic, version, byte order marker, sha256 of dump, region count, length of name blob
+    snapshot_header = struct.Struct('=4sII32sQQ')
+    byte_order_marker = 0x01020304
+
+    def __init__(self, names, population, endos, flags, cumulative=None, buffer=None):
+        """
+        Columnar store of per-region dump data, in update order. Each attribute is held in a single packed array
+        rather than as one Python object per region.
+
+        :param names: List of lowercase region names in update order
+        :param population: Array of region populations
+        :param endos: Array of delegate endorsement counts
+        :param flags: Array of region flag bits (see RegionTable.FLAGS)
+        :param cumulative: Array of cumulative populations. Calculated from population if not supplied.
+        :param buffer: Memory map backing the columns, if they were loaded from a snapshot
+        """
+        self.names = names
+        self.population = population
+        self.endos = endos
+        self.flags = flags
+
+        # cumulative population, or cPop, kept current as populations change. See fenwick.CumulativePopulation.
+        self.cumulative = CumulativePopulation(population, cumulative)
+
+        # name -> position in update order
+        self.index = {name: i for i, name in enumerate(names)}
+
+        self._buffer = buffer
+
+        # bitmap indexes. Each is an int in which bit i is set if region i (in update order) is in the set, so
+        # combining criteria is a matter of intersecting ints.
+        self.all = (1 << len(names)) - 1
+        self.flag_masks = {flag: self._build_mask(flags, bytes(1 if value & flag else 0 for value in range(256)))
+                           for flag in self.FLAGS}
+        cap = self.ENDO_BANDS[-1]
+        band_of = [self.band(value) for value in range(cap + 1)]
+        bands = bytes(band_of[endo] if endo < cap else len(self.ENDO_BANDS) - 1 for endo in endos)
+        self.endo_masks = [self._build_mask(bands, bytes(1 if value == band else 0 for value in range(256)))
+                           for band in range(len(self.ENDO_BANDS))]
+
+    @classmethod
+    def band(cls, endos):
+        """
+        Gets the index of the endorsement band an endorsement count falls in.
+        """
+        return bisect.bisect_right(cls.ENDO_BANDS, endos) - 1
+
+    @staticmethod
+    def _build_mask(values, selected):
+        """
+        Builds a bitmap from a byte column.
+
+        :param values: Bytes-like column with one byte per region
+        :param selected: 256 byte table that is nonzero for the byte values that should be set in the bitmap
+        :return: Bitmap as an int
+        """
+        digits = bytes(values).translate(bytes(b'1'[0] if flag else b'0'[0] for flag in selected))
+        return int(digits[::-1], 2) if digits else 0
+
+    def mask_from_indices(self, indices):
+        """
+        Builds a bitmap from table indices.
+
+        :param indices: Iterable of table indices
+        :return: Bitmap as an int
+        """
+        count = len(self.names)
+        digits = bytearray(b'0' * count)
+        for i in indices:
+            digits[count - 1 - i] = b'1'[0]
+        return int(digits, 2) if count else 0
+
+    @staticmethod
+    def indices(mask):
+        """
+        Converts a bitmap to a list of table indices.
+
+        :param mask: Bitmap as an int
+        :return: Sorted list of indices of set bits
+        """
+        bits = bin(mask)[:1:-1]
+        found = []
+        i = bits.find('1')
+        while i >= 0:
+            found.append(i)
+            i = bits.find('1', i + 1)
+        return found
+
+    def mask_of(self, flags):
+        """
+        Gets the bitmap of regions that have every one of the given flag bits set.
+
+        :param flags: Flag bits (see RegionTable.FLAGS)
+        :return: Bitmap as an int
+        """
+        mask = self.all
+        for flag in self.FLAGS:
+            if flags & flag:
+                mask &= self.flag_masks[flag]
+        return mask
+
+    def endo_mask(self, low=0, high=None):
+        """
+        Gets the bitmap of regions whose delegate has at least low and fewer than high endorsements. Whole bands are
+        taken from the index; only regions in a band split by low or high are checked individually.
+
+        :param low: Minimum endorsements (inclusive)
+        :param high: Maximum endorsements (exclusive), or None for no maximum
+        :return: Bitmap as an int
+        """
+        mask = 0
+        partial = 0
+        for band, start in enumerate(self.ENDO_BANDS):
+            stop = self.ENDO_BANDS[band + 1] if band + 1 < len(self.ENDO_BANDS) else None
+            if (stop is not None and stop <= low) or (high is not None and start >= high):
+                continue
+            if start >= low and (high is None or (stop is not None and stop <= high)):
+                mask |= self.endo_masks[band]
+            else:
+                partial |= self.endo_masks[band]
+        endos = self.endos
+        return mask | self.mask_from_indices(i for i in self.indices(partial)
+                                             if low <= endos[i] and (high is None or endos[i] < high))
+
+    def range_mask(self, start, stop):
+        """
+        Gets the bitmap of regions with table indices in [start, stop).
+        """
+        return ((1 << max(stop, start)) - 1) ^ ((1 << start) - 1)
+
+    def mark(self, regions, flag):
+        """
+        Sets a flag bit on regions, e.g. to record passworded regions from an outside source. Unknown region names
+        are ignored.
+
+        :param regions: Iterable of region names
+        :param flag: Flag bit to set
+        """
+        marked = [self.index[region.lower()] for region in regions if region.lower() in self.index]
+        for i in marked:
+            self.flags[i] |= flag
+        self.flag_masks[flag] |= self.mask_from_indices(marked)
+
+    def _writable(self):
+        # columns loaded from a snapshot are read-only views of the memory map; copy them before the first change
+        if not isinstance(self.population, array.array):
+            self.population = array.array('q', self.population)
+            self.cumulative.population = self.population
+        if not isinstance(self.endos, array.array):
+            self.endos = array.array('q', self.endos)
+
+    def set_population(self, i, population):
+        """
+        Changes a region's population, e.g. when nations move during an update. Cumulative populations of every later
+        region follow in O(log n).
+
+        :param i: Table index of region
+        :param population: New population
+        """
+        self._writable()
+        delta = population - self.population[i]
+        self.population[i] = population
+        self.cumulative.add(i, delta)
+
+    def update(self, changes):
+        """
+        Applies a batch of changed rows, e.g. the regions that differ between two dumps. Only the changed regions are
+        touched; bitmap indexes are patched rather than rebuilt. The PASSWORDED flag is kept, as dumps do not record it.
+
+        :param changes: Iterable of (table index, population, endorsements, flags) tuples
+        """
+        changes = list(changes)
+        if not changes:
+            return
+        self._writable()
+        for i, population, endos, flags in changes:
+            self.set_population(i, population)
+            self.endos[i] = endos
+            self.flags[i] = flags | (self.flags[i] & self.PASSWORDED)
+
+        keep = self.all ^ self.mask_from_indices(i for i, population, endos, flags in changes)
+        for flag in self.FLAGS:
+            self.flag_masks[flag] = (self.flag_masks[flag] & keep) | self.mask_from_indices(
+                i for i, population, endos, flags in changes if self.flags[i] & flag)
+        for band in range(len(self.ENDO_BANDS)):
+            self.endo_masks[band] = (self.endo_masks[band] & keep) | self.mask_from_indices(
+                i for i, population, endos, flags in changes if self.band(endos) == band)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def total(self):
+        """
+        Cumulative population of the last updating region.
+        """
+        return self.cumulative[-1]
+
+    def lookup(self, region):
+        """
+        Finds a region's position in update order.
+
+        :param region: Name of region (case insensitive)
+        :return: Index of region
+        :raises KeyError: if no such region exists
+        """
+        return self.index[region.lower()]
+
+    def save(self, path, digest):
+        """
+        Writes a compact binary snapshot of the table that can be memory-mapped on later runs.
+
+        :param path: Path to write snapshot to
+        :param digest: Content hash of the dump the table was compiled from
+        """
+        names = "\n".join(self.names).encode('utf-8')
+
+        # write to a temporary file first so that an interrupted write never leaves a corrupt snapshot behind
+        temp = path + '.tmp'
+        try:
+            with open(temp, 'wb') as out:
+                out.write(self.snapshot_header.pack(self.snapshot_magic, self.snapshot_version, self.byte_order_marker,
+                                                    digest, len(self), len(names)))
+                for column in (self.population, self.cumulative, self.endos):
+                    out.write(array.array('q', column).tobytes())
+                # snapshots describe the dump, which does not record passwords
+                out.write(bytes(self.flags).translate(bytes(value & ~self.PASSWORDED for value in range(256))))
+                out.write(names)
+            os.replace(temp, path)
+        except OSError:
+            # a snapshot is only a cache; failing to write one must not stop Oracle from starting
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    @classmethod
+    def load(cls, path, digest):
+        """
+        Memory-maps a compiled snapshot. The numeric columns are read directly from the mapping without copying.
+        Bitmap indexes are rebuilt from the flag and endorsement columns.
+
+        :param path: Path to snapshot
+        :param digest: Content hash of the current dump
+        :return: RegionTable, or None if there is no usable snapshot for this dump
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        size = cls.snapshot_header.size
+        if len(data) < size:
+            data.close()
+            return None
+        magic, version, bom, stored_digest, count, names_length = cls.snapshot_header.unpack_from(data)
+        if (magic, version, bom, stored_digest) != (cls.snapshot_magic, cls.snapshot_version, cls.byte_order_marker,
+                                                    digest) or len(data) != size + count * 25 + names_length:
+            data.close()
+            return None
+
+        view = memoryview(data)
+        population, cumulative, endos = (view[size + i * count * 8:size + (i + 1) * count * 8].cast('q')
+                                         for i in range(3))
+        # flags are copied out of the mapping so that they can be updated with mark()
+        flags = array.array('B', view[size + count * 24:size + count * 25])
+        names = bytes(view[size + count * 25:]).decode('utf-8').split("\n") if count else []
+
+        return cls(names, population, endos, flags, cumulative, buffer=data)
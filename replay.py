@@ -0,0 +1,178 @@
+import argparse
+import json
+import math
+import time
+
+import oracle
+import updatetrace
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def sessions(trace):
+    """
+    Splits a trace into the sessions it was recorded in. Delphi appends to an existing trace and starts every run with
+    a header record, and each run began calibrating afresh.
+
+    :param trace: Path to trace file written by Delphi
+    :return: List of sessions, each a list of records starting with its header if it has one
+    """
+    split = []
+    for record in updatetrace.read(trace):
+        if record.get('k') == updatetrace.HEADER or not split:
+            split.append([])
+        split[-1].append(record)
+    return split
+
+
+def replay(trace, regions, mode=None, buckets=10, load=None):
+    """
+    Feeds the observations in a recorded trace through a fresh Oracle as fast as possible. Before each observation is
+    applied, Oracle's prediction for the observed region is compared with the observed time, so the result shows how
+    accurate predictions would have been at each point of the update with the current calibration code.
+
+    Each session in the trace is replayed into its own Oracle, as it was tracked live, and the population changes
+    Delphi tracked during it are applied in the order they were seen.
+
+    :param trace: Path to trace file written by Delphi
+    :param regions: Path to the regions dump the trace was recorded against
+    :param mode: Only replay observations from this update (major or minor), or None for all
+    :param buckets: Number of update progress buckets to report errors for
+    :param load: Function returning a fresh Oracle to replay a session into, instead of loading one from regions
+    :return: Dictionary of results
+    """
+    load = load or (lambda: oracle.Oracle(regions, "oracle2 replay"))
+    load_time = 0.0
+
+    errors = []
+    recorded_errors = []
+    curve = [[] for _ in range(buckets)]
+    query_latencies = []
+    observe_latencies = []
+    missing = 0
+    rejected = 0
+    population_changes = 0
+    session_results = []
+
+    for session in sessions(trace):
+        start = time.perf_counter()
+        replayed = load()
+        load_time += time.perf_counter() - start
+        session_errors = []
+
+        for record in session:
+            kind = record.get('k')
+            if kind == updatetrace.POPULATION:
+                # populations are shared by both updates, so they are replayed whatever the mode
+                try:
+                    replayed.adjust_population(record['r'], record['d'])
+                    population_changes += 1
+                except KeyError:
+                    pass
+                continue
+            if kind == updatetrace.CALIBRATION and record.get('n') is not None:
+                # the nudge is a manual correction, so replay it as the operator applied it
+                replayed.nudge = record['n']
+            if kind != updatetrace.OBSERVATION or (mode is not None and record.get('m') != mode):
+                continue
+            region, observed, record_mode = record['r'], record['y'], record['m']
+
+            query_start = time.perf_counter()
+            try:
+                predicted = replayed.get_time(region, record_mode)
+            except KeyError:
+                missing += 1
+                continue
+            query_latencies.append(time.perf_counter() - query_start)
+
+            error = predicted - observed
+            errors.append(error)
+            session_errors.append(error)
+            if record.get('p') is not None:
+                recorded_errors.append(record['p'] - observed)
+            progress = replayed.table.cumulative[replayed.table.lookup(region)] / replayed.table.total
+            curve[min(buckets - 1, int(progress * buckets))].append(error)
+
+            observe_start = time.perf_counter()
+            if not replayed.set_offset(region, observed, record_mode):
+                rejected += 1
+            observe_latencies.append(time.perf_counter() - observe_start)
+
+        session_results.append((session[0].get('t'), session_errors))
+
+    def summary(values):
+        return {'count': len(values),
+                'mae': sum(abs(v) for v in values) / len(values) if values else 0.0,
+                'rmse': math.sqrt(sum(v * v for v in values) / len(values)) if values else 0.0,
+                'p90_abs': percentile([abs(v) for v in values], 0.9)}
+
+    return {'load_seconds': load_time,
+            'observations': len(errors),
+            'missing_regions': missing,
+            'rejected': rejected,
+            'population_changes': population_changes,
+            'error': summary(errors),
+            'recorded_error': summary(recorded_errors),
+            'sessions': [dict(summary(values), started=started) for started, values in session_results],
+            'error_by_progress': [dict(summary(values), start=i / buckets) for i, values in enumerate(curve)],
+            'query_latency_us': {'p50': 1e6 * percentile(query_latencies, 0.5),
+                                 'p99': 1e6 * percentile(query_latencies, 0.99)},
+            'observe_latency_us': {'p50': 1e6 * percentile(observe_latencies, 0.5),
+                                   'p99': 1e6 * percentile(observe_latencies, 0.99)}}
+
+
+def report(results):
+    lines = ["{observations} observations replayed ({missing_regions} regions not in dump, {rejected} rejected), "
+             "{population_changes} population changes".format(**results),
+             "{} sessions, dumps loaded in {:.2f} s".format(len(results['sessions']), results['load_seconds']),
+             "Prediction error: MAE {mae:.2f} s, RMSE {rmse:.2f} s, 90% within {p90_abs:.2f} s".format(
+                 **results['error']),
+             "As recorded:      MAE {mae:.2f} s, RMSE {rmse:.2f} s, 90% within {p90_abs:.2f} s".format(
+                 **results['recorded_error']),
+             "Error by session:"]
+    for session in results['sessions']:
+        if session['count']:
+            started = time.strftime("%Y-%m-%d %H:%M", time.gmtime(session['started'])) if session['started'] else "?"
+            lines.append("  {}  {:6d} obs  MAE {:7.2f} s  RMSE {:7.2f} s".format(
+                started, session['count'], session['mae'], session['rmse']))
+    lines.append("Error by update progress:")
+    for bucket in results['error_by_progress']:
+        if bucket['count']:
+            lines.append("  {start:4.0%}  {count:6d} obs  MAE {mae:7.2f} s  RMSE {rmse:7.2f} s".format(**bucket))
+    lines.append("Query latency: p50 {p50:.1f} us, p99 {p99:.1f} us".format(**results['query_latency_us']))
+    lines.append("Observation latency: p50 {p50:.1f} us, p99 {p99:.1f} us".format(**results['observe_latency_us']))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a Delphi trace through Oracle and report prediction error.")
+    parser.add_argument('trace', help="trace file written by Delphi")
+    parser.add_argument('regions', help="regions.xml.gz dump the trace was recorded against")
+    parser.add_argument('--mode', choices=('major', 'minor'), help="only replay one update")
+    parser.add_argument('--buckets', type=int, default=10, help="number of update progress buckets")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    arguments = parser.parse_args()
+
+    results = replay(arguments.trace, arguments.regions, arguments.mode, arguments.buckets)
+    print(json.dumps(results, indent=2) if arguments.json else report(results))
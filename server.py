@@ -0,0 +1,587 @@
+import argparse
+import datetime
+import http.client
+import http.server
+import json
+import threading
+import urllib.parse
+
+import delphi
+import tracker
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+DEFAULT_PORT = 8742
+
+
+class QueryError(Exception):
+    def __init__(self, status, message, **details):
+        """
+        Error returned to a client as a JSON object with an error message.
+
+        :param status: HTTP status code
+        :param message: Human readable error message
+        :param details: Extra fields for the response, e.g. suggestions
+        """
+        super().__init__(message)
+        self.status = status
+        self.body = dict(details, error=message)
+
+
+class DelphiServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    # seconds between keep-alive comments on idle event streams
+    heartbeat = 15
+
+    # GET and POST paths and the methods that answer them
+    queries = {'/time': 'query_time', '/info': 'query_info', '/at': 'query_at', '/window': 'query_window',
+               '/next': 'query_next', '/calibration': 'query_calibration', '/status': 'query_status'}
+    commands = {'/observe': 'command_observe', '/nudge': 'command_nudge', '/tracking': 'command_tracking'}
+
+    def __init__(self, shell, address=('127.0.0.1', DEFAULT_PORT)):
+        """
+        Serves one Delphi, and so one copy of the dump and one API poller, to any number of clients over a local HTTP
+        JSON API. Queries are stateless: each names its own region, times and update, so clients do not interfere with
+        each other. Calibration changes are pushed to clients listening on /events as server-sent events.
+
+        :param shell: Delphi instance to serve
+        :param address: (host, port) tuple to listen on
+        """
+        super().__init__(address, Handler)
+        self.shell = shell
+        # the server runs for longer than one update, so its default update and tracking follow the clock
+        shell.follow_clock = True
+        self.closing = False
+        # version is bumped on every calibration change; event streams wait on the condition for it to move
+        self.version = 0
+        self.changed = threading.Condition()
+        shell.calibration_listeners.append(self.calibration_changed)
+
+    def calibration_changed(self, mode):
+        with self.changed:
+            self.version += 1
+            self.changed.notify_all()
+
+    def close(self):
+        """
+        Stops serving, ends open event streams and closes the Delphi instance.
+        """
+        self.shell.calibration_listeners.remove(self.calibration_changed)
+        with self.changed:
+            self.closing = True
+            self.changed.notify_all()
+        self.shutdown()
+        self.server_close()
+        self.shell.close()
+
+    def mode(self, params):
+        mode = params.get('mode') or self.shell.sync_mode()
+        if mode not in self.shell.oracle.speed:
+            raise QueryError(400, "No such update '{}'.".format(mode))
+        return mode
+
+    @staticmethod
+    def number(params, key, default=None):
+        value = params.get(key)
+        if value is None:
+            if default is None:
+                raise QueryError(400, "Missing parameter '{}'.".format(key))
+            return default
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise QueryError(400, "Invalid number for '{}'.".format(key))
+
+    def region(self, params):
+        name = params.get('region')
+        if not name:
+            raise QueryError(400, "Missing parameter 'region'.")
+        matches = self.shell.oracle.find_regions(name, self.shell.suggestion_limit)
+        if len(matches) != 1:
+            message = "{} is ambiguous.".format(name) if matches else "No such region {}.".format(name)
+            raise QueryError(404, message, suggestions=matches)
+        return matches[0]
+
+    def listing(self, mode, first, stop, limit):
+        shown = range(first, min(stop, first + limit))
+        return {'mode': mode,
+                'count': stop - first,
+                'regions': [[name, t] for name, t in zip((self.shell.oracle.table.names[i] for i in shown),
+                                                          self.shell.oracle.get_times(mode, shown))]}
+
+    def calibration(self):
+        oracle = self.shell.oracle
+        with oracle.lock:
+            params = oracle.params
+            state = {'version': self.version, 'mode': self.shell.sync_mode(), 'tracking': self.shell.tracking,
+                     'nudge': params.nudge}
+            for mode, model in oracle.calibration.items():
+                state[mode] = {'speed': params.speed[mode], 'offset': params.offset[mode], 'observations': model.count,
+                               'rejected': model.rejected, 'rms': model.rms}
+        return state
+
+    def query_time(self, params):
+        mode = self.mode(params)
+        region = self.region(params)
+        seconds = self.shell.oracle.get_time(region, mode)
+        # somebody is waiting for this region: poll faster as it approaches
+        self.shell.watch(region)
+        return {'region': region, 'mode': mode, 'time': seconds, 'hms': self.shell.format_seconds(seconds),
+                'url': "http://nationstates.net/region={}".format(region.replace(" ", "_"))}
+
+    def query_info(self, params):
+        region = self.region(params)
+        return dict(self.shell.oracle.get_info(region), region=region)
+
+    def query_at(self, params):
+        mode = self.mode(params)
+        at = self.number(params, 'time', self.shell.elapsed(mode))
+        region = self.shell.oracle.region_at(at, mode)
+        return {'mode': mode, 'time': at, 'region': region,
+                'predicted': self.shell.oracle.get_time(region, mode) if region is not None else None}
+
+    def query_window(self, params):
+        mode = self.mode(params)
+        first, stop = self.shell.oracle.window(self.number(params, 'start'), self.number(params, 'end'), mode)
+        return self.listing(mode, first, stop, int(self.number(params, 'limit', self.shell.list_limit)))
+
+    def query_next(self, params):
+        mode = self.mode(params)
+        first = self.shell.oracle.position(self.number(params, 'time', self.shell.elapsed(mode)), mode) + 1
+        count = int(self.number(params, 'count', 10))
+        return self.listing(mode, first, min(first + count, len(self.shell.oracle.table)), count)
+
+    def query_calibration(self, params):
+        return self.calibration()
+
+    def query_status(self, params):
+        return {'mode': self.shell.sync_mode(), 'tracking': self.shell.tracking, 'elapsed': self.shell.elapsed(),
+                'regions': len(self.shell.oracle.table), 'version': self.version}
+
+    def command_observe(self, params):
+        mode = self.mode(params)
+        region = self.region(params)
+        accepted = self.shell.record_observation(region, self.number(params, 'time'), mode)
+        self.shell.calibration_changed(mode)
+        return dict(self.calibration(), accepted=accepted)
+
+    def command_nudge(self, params):
+        self.shell.oracle.set_nudge(self.number(params, 'nudge'))
+        self.shell.calibration_changed()
+        return self.calibration()
+
+    def command_tracking(self, params):
+        enabled = params.get('enabled')
+        if not isinstance(enabled, bool):
+            raise QueryError(400, "Parameter 'enabled' must be true or false.")
+        self.shell.set_tracking(enabled)
+        return {'tracking': enabled}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # keep-alive, so a client's queries share one connection
+    protocol_version = 'HTTP/1.1'
+    server_version = 'Delphi/1'
+    # headers and body are written separately; without this, delayed ACKs add ~40 ms to every keep-alive query
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.shell.debug:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/events':
+            self.stream_events()
+        elif url.path == '/metrics':
+            self.send_metrics()
+        else:
+            self.dispatch(self.server.queries, url.path, dict(urllib.parse.parse_qsl(url.query)))
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            params = json.loads(body) if body else {}
+        except ValueError:
+            params = None
+        if not isinstance(params, dict):
+            self.send_json(400, {'error': "Request body must be a JSON object."})
+            return
+        self.dispatch(self.server.commands, url.path, params)
+
+    def dispatch(self, routes, path, params):
+        if path not in routes:
+            self.send_json(404, {'error': "No such endpoint {}.".format(path)})
+            return
+        try:
+            self.send_json(200, getattr(self.server, routes[path])(params))
+        except QueryError as e:
+            self.send_json(e.status, e.body)
+        except KeyError as e:
+            self.send_json(404, {'error': "No such region {}.".format(e.args[0] if e.args else "")})
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_metrics(self):
+        measured = self.server.shell.metrics
+        if measured is None:
+            self.send_json(404, {'error': "Instrumentation is off. Start the server with --metrics."})
+            return
+        data = measured.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_events(self):
+        """
+        Streams calibration changes as server-sent events until the client disconnects. The current calibration is
+        sent as soon as the client connects, then again after every change.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        server = self.server
+        sent = None
+        try:
+            while True:
+                with server.changed:
+                    if sent == server.version and not server.closing:
+                        server.changed.wait(server.heartbeat)
+                    if server.closing:
+                        return
+                    version = server.version
+                if version != sent:
+                    sent = version
+                    message = "id: {}\nevent: calibration\ndata: {}\n\n".format(version,
+                                                                               json.dumps(server.calibration()))
+                else:
+                    message = ": keep-alive\n\n"
+                self.wfile.write(message.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+
+class ServerError(Exception):
+    def __init__(self, status, body):
+        super().__init__(body.get('error', status))
+        self.status = status
+        self.body = body
+
+
+class DelphiClient:
+    def __init__(self, url="http://127.0.0.1:{}".format(DEFAULT_PORT), timeout=10):
+        """
+        Client for a Delphi server. Queries share one keep-alive connection.
+
+        :param url: Base URL of the server
+        :param timeout: Socket timeout in seconds for queries
+        """
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or DEFAULT_PORT
+        self.timeout = timeout
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def request(self, method, path, params=None):
+        """
+        Sends one query or command to the server.
+
+        :param method: GET or POST
+        :param path: Endpoint, e.g. /time
+        :param params: Query parameters for GET, or the JSON body for POST
+        :return: Decoded JSON response
+        :raises ServerError: if the server returned an error
+        """
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        body = None
+        headers = {}
+        if method == 'GET' and params:
+            path += "?" + urllib.parse.urlencode(params)
+        elif method == 'POST':
+            body = json.dumps(params).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        with self.lock:
+            # a pooled connection may have been closed by the server while idle; retry once on a fresh one
+            for attempt in range(2):
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                try:
+                    self.connection.request(method, path, body, headers)
+                    response = self.connection.getresponse()
+                    data = response.read()
+                    break
+                except (ConnectionError, http.client.HTTPException):
+                    self.connection.close()
+                    self.connection = None
+                    if attempt:
+                        raise
+        result = json.loads(data)
+        if response.status >= 400:
+            raise ServerError(response.status, result)
+        return result
+
+    def get(self, path, **params):
+        return self.request('GET', path, params)
+
+    def post(self, path, **params):
+        return self.request('POST', path, params)
+
+    def events(self):
+        """
+        Listens for calibration changes pushed by the server.
+
+        :return: Generator of calibration dictionaries, starting with the current calibration
+        """
+        connection = http.client.HTTPConnection(self.host, self.port)
+        try:
+            connection.request('GET', '/events')
+            response = connection.getresponse()
+            data = []
+            for line in response:
+                line = line.decode('utf-8').rstrip("\n")
+                if line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    yield json.loads("\n".join(data))
+                    data = []
+        finally:
+            connection.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class RemoteShell:
+    def __init__(self, client):
+        """
+        Delphi's interactive commands, answered by a Delphi server. The target and update mode are kept locally, so
+        every operator has their own.
+
+        :param client: DelphiClient connected to the server
+        """
+        self.client = client
+        self.mode = client.get('/status')['mode']
+        self.target = ""
+        self.log = delphi.LogBuffer()
+        threading.Thread(target=self.listen, daemon=True).start()
+
+    def listen(self):
+        try:
+            for state in self.client.events():
+                model = state[self.mode]
+                self.log.append("Calibration updated: {} observations, update length {:.1f} s, offset {:.1f} s, "
+                                "nudge {}.".format(model['observations'], model['speed'], -model['offset'],
+                                                   state['nudge']))
+        except (OSError, http.client.HTTPException) as e:
+            self.log.append("ERROR: Lost calibration updates from server ({}).".format(e))
+
+    def predict(self, region):
+        result = self.client.get('/time', region=region, mode=self.mode)
+        self.target = result['region']
+        return "Time predicted for {}: {}.\nURL: {}".format(result['region'], result['hms'], result['url'])
+
+    @staticmethod
+    def format_listing(result):
+        lines = ["{}  {}".format(delphi.Delphi.format_seconds(t), name) for name, t in result['regions']]
+        if result['count'] > len(result['regions']):
+            lines.append("... and {} more".format(result['count'] - len(result['regions'])))
+        return "\n".join(lines)
+
+    def parse(self, command):
+        """
+        Parses a command string and returns a text string with a human readable response.
+
+        :param command: user input string, formatted as "command arguments"
+        :return: user-readable response string
+        """
+        messages = self.log.drain()
+        if messages:
+            print("Queued messages:")
+            for message in messages:
+                print(message)
+
+        action = command.split(" ")[0]
+        args = command.split(" ")[1:]
+        shell = delphi.Delphi
+        try:
+            if action == shell.cmd_mode:
+                if args[0] not in ('major', 'minor'):
+                    return "ERROR: No such update '{}'.".format(args[0])
+                self.mode = args[0]
+                return "Mode set to {}.".format(self.mode)
+            elif action == shell.cmd_time:
+                return self.predict(' '.join(args))
+            elif action == shell.cmd_review:
+                if not self.target:
+                    return "ERROR: No previous region to recall."
+                return self.predict(self.target)
+            elif action == shell.cmd_offset:
+                try:
+                    observed = int(args[0]) * 60 + int(args[1])
+                except ValueError:
+                    return "ERROR: Invalid time provided."
+                result = self.client.post('/observe', region=self.target, time=observed, mode=self.mode)
+                if not result['accepted']:
+                    return "Observation rejected as an outlier. Offset is {} seconds.".format(
+                        -result[self.mode]['offset'])
+                return "Offset adjusted to {} seconds.".format(-result[self.mode]['offset'])
+            elif action == shell.cmd_nudge:
+                nudge = self.client.get('/calibration')['nudge']
+                if args:
+                    nudge = self.client.post('/nudge', nudge=nudge + int(args[0]))['nudge']
+                return "Nudge is {}".format(nudge)
+            elif action == shell.cmd_calibration:
+                state = self.client.get('/calibration')
+                model = state[self.mode]
+                return "{} calibration: {} observations ({} rejected), update length {:.1f} s, offset {:.1f} s, " \
+                       "RMS error {:.1f} s.".format(self.mode, model['observations'], model['rejected'],
+                                                    model['speed'], -model['offset'], model['rms'])
+            elif action == shell.cmd_now or action == shell.cmd_at:
+                at = None
+                if action == shell.cmd_at:
+                    try:
+                        at = int(args[0]) * 60 + int(args[1])
+                    except ValueError:
+                        return "ERROR: Invalid time provided."
+                result = self.client.get('/at', time=at, mode=self.mode)
+                if result['region'] is None:
+                    return "No region predicted to have updated by {}.".format(shell.format_seconds(result['time']))
+                return "Updating at {}: {} (predicted {}).".format(shell.format_seconds(result['time']),
+                                                                   result['region'],
+                                                                   shell.format_seconds(result['predicted']))
+            elif action == shell.cmd_window:
+                try:
+                    start = int(args[0]) * 60 + int(args[1])
+                    end = int(args[2]) * 60 + int(args[3])
+                except ValueError:
+                    return "ERROR: Invalid time provided."
+                result = self.client.get('/window', start=start, end=end, mode=self.mode, limit=shell.list_limit)
+                return "{} regions predicted between {} and {}:\n{}".format(
+                    result['count'], shell.format_seconds(start), shell.format_seconds(end),
+                    self.format_listing(result))
+            elif action == shell.cmd_next:
+                try:
+                    count = int(args[0]) if args else 10
+                except ValueError:
+                    return "ERROR: Invalid count provided."
+                result = self.client.get('/next', count=count, mode=self.mode)
+                if not result['regions']:
+                    return "No regions left to update."
+                return self.format_listing(result)
+            elif action == shell.cmd_start or action == shell.cmd_stop:
+                tracking = self.client.post('/tracking', enabled=action == shell.cmd_start)['tracking']
+                return "Server tracking set to {}.".format(tracking)
+            else:
+                return """
+Delphi Remote Shell Command Reference
+
+t <region>      Get region time
+r               Recall last targeted region
+m <major|minor> Set update mode to major or minor
+o <MM SS>       Indicate true update time in minutes and seconds of last targeted region
+n <seconds>     Add/subtract from the server's nudge value
+now             Get region predicted to be updating now
+at <MM SS>      Get region predicted to be updating at a time
+w <MM SS> <MM SS>
+                List regions predicted to update between two times
+next [count]    List the next regions predicted to update (default 10)
+cal             Show calibration fit for the current update
+start           Start the server's automatic tracking
+stop            Stop the server's automatic tracking
+                """
+        except IndexError:
+            return "ERROR: malformed command."
+        except ServerError as e:
+            if e.body.get('suggestions'):
+                return "ERROR: {} Did you mean: {}?".format(e, ", ".join(e.body['suggestions']))
+            return "ERROR: {}".format(e)
+        except (OSError, http.client.HTTPException) as e:
+            return "ERROR: Could not reach server ({}).".format(e)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Share one Oracle and one API poller between many operators.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve = subparsers.add_parser('serve', help="load the dump and serve queries")
+    serve.add_argument('regions', help="regions.xml.gz dump")
+    serve.add_argument('--ua', required=True, help="primary nation name, sent as the API user agent")
+    serve.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--nations', help="nations.xml.gz dump, to resolve events without API calls")
+    serve.add_argument('--api', default=tracker.API_URL, help="NationStates API URL (see standin.py)")
+    serve.add_argument('--trace', default="./delphi_trace.jsonl", help="trace file to append to")
+    serve.add_argument('--history', default="./delphi_history.bin", help="history of past updates to calibrate from")
+    serve.add_argument('--track', action='store_true', help="start automatic tracking immediately")
+    serve.add_argument('--metrics', nargs='?', const='', metavar='PATH',
+                       help="measure latencies, served at /metrics and optionally written to a Prometheus text file")
+    connect = subparsers.add_parser('connect', help="interactive shell against a running server")
+    connect.add_argument('--url', default="http://127.0.0.1:{}".format(DEFAULT_PORT))
+    arguments = parser.parse_args()
+
+    if arguments.command == 'serve':
+        shell = delphi.Delphi(arguments.regions, arguments.ua, api=arguments.api, nations=arguments.nations,
+                              trace=arguments.trace, history=arguments.history)
+        shell.set_tracking(arguments.track)
+        if arguments.metrics is not None:
+            shell.enable_metrics(arguments.metrics or None)
+        server = DelphiServer(shell, (arguments.host, arguments.port))
+        print("Serving {} regions on http://{}:{}/".format(len(shell.oracle.table), arguments.host, arguments.port))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+    else:
+        remote = RemoteShell(DelphiClient(arguments.url))
+
+        def show_log():
+            # show calibration pushes as they arrive rather than at the next command
+            while True:
+                for message in remote.log.drain(timeout=1):
+                    print("\n" + message)
+
+        threading.Thread(target=show_log, daemon=True).start()
+        while True:
+            time_now = datetime.datetime.utcnow()
+            print("\nLast target: {} (Type 'r' to recall time prediction.)".format(remote.target))
+            cmd = input('[{:02d}:{:02d}:{:02d} UTC] DELPHI> '.format(time_now.hour, time_now.minute,
+                                                                     time_now.second))
+            if cmd == 'quit':
+                remote.client.close()
+                break
+            print(remote.parse(cmd))
@@ -0,0 +1,233 @@
+import asyncio
+import collections
+import time
+import urllib.parse
+import urllib.request
+from xml.sax.saxutils import escape
+
+import tracker
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class StandIn:
+    def __init__(self, regions=None, latency=0.0, handshake=0.0, rate=10.0, host='127.0.0.1', port=0, limit=None,
+                 passworded=()):
+        """
+        Local stand-in for the parts of the NationStates API that Delphi uses, for measuring and exercising the
+        tracker offline. It simulates an update that reaches rate regions per second, in the order given, starting
+        when the server starts. Each region has one nation, named after the region, whose influence changes when the
+        region updates.
+
+        :param regions: List of region names in update order
+        :param latency: Seconds to wait before answering each request, to simulate network distance
+        :param handshake: Seconds to wait before serving a new connection, to simulate TCP and TLS setup
+        :param rate: Regions updated per second
+        :param host: Interface to listen on
+        :param port: Port to listen on. 0 picks a free port.
+        :param limit: Tuple (requests, per seconds) to enforce a rate limit like the real API's, answering with 429
+                      and Retry-After once it is exceeded, or None for no limit
+        :param passworded: Region names to report as passworded to regionsbytag queries
+        """
+        self.regions = regions or ["region {}".format(i) for i in range(1000)]
+        self.nations = {self.nation_of(region): region for region in self.regions}
+        self.passworded = list(passworded)
+        self.latency = latency
+        self.handshake = handshake
+        self.rate = rate
+        self.host = host
+        self.port = port
+        self.server = None
+        self.started = None
+        self.limit = limit
+        self.recent = collections.deque()
+        self.clients = set()
+
+        # counters for measurement
+        self.requests = 0
+        self.connections = 0
+
+    @staticmethod
+    def nation_of(region):
+        return region.lower().replace(" ", "_") + "_resident"
+
+    @property
+    def url(self):
+        return "http://{}:{}/cgi-bin/api.cgi".format(self.host, self.port)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started = time.time()
+
+    async def stop(self):
+        # end idle keep-alive connections so that their handlers finish rather than being cancelled
+        for writer in list(self.clients):
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def updated(self, now=None):
+        """
+        Number of regions the simulated update has reached.
+        """
+        return min(len(self.regions), int(((now or time.time()) - self.started) * self.rate))
+
+    def rate_headers(self, now=None):
+        """
+        Applies the rate limit to a request.
+
+        :return: Tuple of (True if the request is allowed, dictionary of rate limit headers)
+        """
+        if self.limit is None:
+            return True, {}
+        requests, per = self.limit
+        now = now or time.monotonic()
+        while self.recent and self.recent[0] <= now - per:
+            self.recent.popleft()
+        if len(self.recent) >= requests:
+            return False, {'Retry-After': str(int(self.recent[0] + per - now) + 1)}
+        self.recent.append(now)
+        return True, {'RateLimit-Limit': str(requests), 'RateLimit-Remaining': str(requests - len(self.recent)),
+                      'RateLimit-Reset': str(int(self.recent[0] + per - now) + 1)}
+
+    def respond(self, params):
+        """
+        Builds the XML body for an API query.
+
+        :param params: Dictionary of query parameters
+        :return: Tuple of (status, body)
+        """
+        shards = params.get('q', '').split(';')
+        if 'nation' in params:
+            region = self.nations.get(params['nation'].lower().replace(" ", "_"))
+            if region is None:
+                return 404, "<h1>Unknown nation</h1>"
+            return 200, "<NATION id=\"{}\"><REGION>{}</REGION></NATION>".format(escape(params['nation']),
+                                                                           escape(region))
+        if shards[0] == 'happenings':
+            options = dict(shard.split("=", 1) for shard in shards[1:] if "=" in shard)
+            since = int(options.get('sinceid', params.get('sinceid', 0)))
+            updated = self.updated()
+            events = []
+            # newest first, like the real feed, which returns at most 100 events. event ids are region positions + 1
+            for i in range(updated - 1, max(since - 1, updated - 101, -1), -1):
+                region = self.regions[i]
+                events.append("<EVENT id=\"{}\"><TIMESTAMP>{}</TIMESTAMP><TEXT>@@{}@@'s influence in %%{}%% rose "
+                              "from \"Minnow\" to \"Sprat\".</TEXT></EVENT>".format(
+                                  i + 1, int(self.started + i / self.rate), escape(self.nation_of(region)),
+                                  escape(region.lower().replace(" ", "_"))))
+            return 200, "<WORLD><HAPPENINGS>{}</HAPPENINGS></WORLD>".format("".join(events))
+        if shards[0] == 'regionsbytag':
+            options = dict(shard.split("=", 1) for shard in shards[1:] if "=" in shard)
+            tagged = self.passworded if options.get('tags') == 'password' else []
+            return 200, "<WORLD><REGIONS>{}</REGIONS></WORLD>".format(
+                escape(",".join(region.lower().replace(" ", "_") for region in tagged)))
+        return 400, "<h1>Bad request</h1>"
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        self.clients.add(writer)
+        try:
+            if self.handshake:
+                await asyncio.sleep(self.handshake)
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = True
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    if line.lower().startswith(b'connection:') and b'close' in line.lower():
+                        keep_alive = False
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                target = request_line.decode('latin-1').split(" ")[1]
+                params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(target).query))
+                allowed, headers = self.rate_headers()
+                status, body = self.respond(params) if allowed else (429, "<h1>Too Many Requests</h1>")
+                body = body.encode('utf-8')
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: text/xml\r\nContent-Length: {}\r\n"
+                             "{}Connection: {}\r\n\r\n".format(status, "OK" if status == 200 else "Error", len(body),
+                                                               "".join("{}: {}\r\n".format(key, value)
+                                                                       for key, value in headers.items()),
+                                                               "keep-alive" if keep_alive else "close")
+                             .encode('latin-1') + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+
+def benchmark(requests=200, latency=0.005, handshake=0.03):
+    """
+    Compares the pooled tracker client against a fresh urllib connection per request, using a stand-in server.
+
+    :param requests: Number of requests to make with each client
+    :param latency: Simulated server latency in seconds
+    :param handshake: Simulated connection setup time in seconds
+    :return: Dictionary of results
+    """
+    standin = StandIn(latency=latency, handshake=handshake, rate=1000)
+    api = tracker.Tracker("oracle2 benchmark", api="http://127.0.0.1/", rate_limit=None)
+    api.call(standin.start())
+    api.api = standin.url
+    results = {}
+    try:
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            api.call(api.happenings())
+            latencies.append(time.perf_counter() - start)
+        results['pooled'] = summarize(latencies, api.pool.connections)
+
+        latencies = []
+        connections = standin.connections
+        for _ in range(requests):
+            start = time.perf_counter()
+            query = urllib.request.Request(api.url(q="happenings;filter=change"), headers={'User-Agent': "bench"})
+            urllib.request.urlopen(query).read()
+            latencies.append(time.perf_counter() - start)
+        results['fresh'] = summarize(latencies, standin.connections - connections)
+    finally:
+        api.call(standin.stop())
+        api.close()
+    return results
+
+
+def summarize(latencies, connections):
+    latencies = sorted(latencies)
+    return {'requests': len(latencies),
+            'connections': connections,
+            'mean_ms': 1000 * sum(latencies) / len(latencies),
+            'p50_ms': 1000 * latencies[len(latencies) // 2],
+            'p99_ms': 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            'throughput_rps': len(latencies) / sum(latencies)}
+
+
+if __name__ == '__main__':
+    for client, result in benchmark().items():
+        print("{:8} {requests} requests over {connections} connections: mean {mean_ms:.2f} ms, p50 {p50_ms:.2f} ms, "
+              "p99 {p99_ms:.2f} ms, {throughput_rps:.0f} req/s".format(client, **result))
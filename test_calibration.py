@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+import dumpgen
+from calibration import Calibration
+from oracle import Oracle
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def test_ridge_fit():
+    rng = random.Random(6)
+    model = Calibration(3600, prior=0.5, threshold=1e9)
+    points = []
+    for _ in range(40):
+        x = rng.uniform(0.2, 0.3)
+        y = 3500 * x + 20 + rng.gauss(0, 5)
+        weight = rng.uniform(0.5, 2)
+        model.add(x, y, weight)
+        points.append((x, y, weight))
+
+    def objective(a, b):
+        return sum(w * (y - a - b * x) ** 2 for x, y, w in points) + model.prior * (b - model.prior_speed) ** 2
+
+    # the fit is the minimum of the penalised objective: its gradient vanishes there, and any step away costs more
+    a, b = model.intercept, model.slope
+    assert sum(w * (y - a - b * x) for x, y, w in points) == pytest.approx(0, abs=1e-6)
+    assert (sum(w * (y - a - b * x) * x for x, y, w in points) - model.prior * (b - model.prior_speed) ==
+            pytest.approx(0, abs=1e-6))
+    for da, db in ((1e-3, 0), (-1e-3, 0), (0, 1e-2), (0, -1e-2), (1e-3, -1e-2)):
+        assert objective(a + da, b + db) > objective(a, b)
+    sse = objective(a, b) - model.prior * (b - model.prior_speed) ** 2
+    assert model.rms == pytest.approx((sse / sum(w for x, y, w in points)) ** 0.5, rel=1e-4)
+
+
+def test_early_fit_does_not_lock_out_later_observations():
+    # a few observations bunched early in the update, then none until well after, when the prior's update length has
+    # drifted far from the truth
+    rng = random.Random(1)
+    model = Calibration(3600)
+    for _ in range(6):
+        x = 0.05 + rng.uniform(-0.002, 0.002)
+        model.add(x, 4000 * x + rng.gauss(0, 2))
+    accepted = 0
+    for k in range(200):
+        x = 0.3 + 0.6 * k / 199
+        accepted += model.add(x, 4000 * x + rng.gauss(0, 2))
+    # at most the first few are held back, until they form a run
+    assert accepted >= 200 - model.run
+    assert abs(model.speed - 4000) < 5
+    assert abs(model.predict(0.9) - 3600) < 5
+
+
+def test_run_of_misses_is_accepted():
+    # a well established fit, then every later region updates a minute late, e.g. the update slowed down. Each single
+    # observation looks like an outlier; a run of them on one side does not.
+    rng = random.Random(2)
+    model = Calibration(3600)
+    for k in range(100):
+        x = k / 200
+        model.add(x, 3600 * x + rng.gauss(0, 2))
+    accepted = [model.add(x, 3600 * x + 60 + rng.gauss(0, 2)) for x in (0.5 + k / 100 for k in range(40))]
+    assert accepted[:model.run - 1] == [False] * (model.run - 1)
+    assert model.rejected < model.run * 3
+    assert abs(model.predict(0.89) - (3600 * 0.89 + 60)) < 20
+
+
+def test_outliers_are_rejected():
+    rng = random.Random(3)
+    model = Calibration(3600)
+    for k in range(50):
+        x = k / 50
+        assert model.add(x, 3600 * x + rng.gauss(0, 2))
+    assert not model.add(0.5, 1800 + 300)
+    assert not model.add(0.6, 2160 - 300)
+    assert model.rejected == 2 and model.count == 50
+    assert abs(model.speed - 3600) < 5
+
+
+def test_calibrate_publishes_the_refitted_offset(tmp_path):
+    path = str(tmp_path / 'regions.xml.gz')
+    dumpgen.generate(path, 200, factbook=20, embassies=1)
+    oracle = Oracle(path, 'test', snapshot=False)
+    for i in range(10, 200, 20):
+        name = oracle.table.names[i]
+        oracle.set_offset(name, oracle.get_time(name, 'major') * 1.1 + 30, 'major')
+    oracle.calibrate(4000, 'major')
+    model = oracle.calibration['major']
+    assert oracle.params.speed['major'] == model.speed
+    assert oracle.params.offset['major'] == model.offset
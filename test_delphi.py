@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+import delphi
+from regiontable import RegionTable
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+@pytest.fixture
+def shell(dump, api):
+    shell = delphi.Delphi(dump, 'test', api=api.url)
+    shell.poll_interval = shell.min_poll_interval = 0.05
+    yield shell
+    shell.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_tracking_survives_a_failed_step(shell):
+    calls = []
+
+    def observe(observations):
+        calls.append(observations)
+        if len(calls) == 1:
+            raise OSError("history file is read-only")
+        return 0
+
+    shell.observe = observe
+    shell.parse('start')
+    wait_for(lambda: len(calls) >= 3)
+    messages = shell.log.drain(timeout=0)
+    assert any("Tracking step failed (OSError: history file is read-only)" in message for message in messages)
+    assert not shell.runner.done()
+
+
+def test_stop_cancels_a_poll_in_flight(shell):
+    started = []
+    cancelled = []
+
+    async def happenings(since, filters):
+        started.append(since)
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(since)
+            raise
+
+    shell.tracker.happenings = happenings
+    shell.idle_polls = 8
+    assert shell.parse('start') == "Tracking set to True."
+    assert shell.idle_polls == 0
+    wait_for(lambda: started)
+    assert shell.parse('stop') == "Tracking set to False."
+    wait_for(lambda: cancelled and shell.poll is None)
+    assert not shell.runner.done()
+
+
+def test_passwords_are_fetched_off_the_prompt(shell):
+    assert shell.parse('passwords') == "Fetching passworded regions from the API."
+    wait_for(lambda: len(shell.log))
+    assert shell.passworded == "the API"
+    assert shell.log.drain(timeout=0) == ["2 passworded regions will be left out of targets and triggers."]
+    table = shell.oracle.table
+    assert RegionTable.indices(table.flag_masks[RegionTable.PASSWORDED]) == sorted(
+        table.lookup(name) for name in ("Synthetic Region 3", "Synthetic Region 5"))
+
+
+def test_passwords_from_a_failed_query_are_reported(shell):
+    async def tagged_regions(tags):
+        raise OSError("connection refused")
+
+    shell.tracker.tagged_regions = tagged_regions
+    shell.parse('passwords')
+    wait_for(lambda: len(shell.log))
+    assert shell.log.drain(timeout=0) == ["ERROR: Could not get passworded regions from the API (connection refused)."]
+    assert shell.passworded is None
+
+
+def test_passwords_from_a_file(shell, tmp_path):
+    path = tmp_path / 'passworded.txt'
+    path.write_text("# passworded\nsynthetic region 7\n\nsynthetic region 9\n")
+    assert shell.parse('passwords {}'.format(path)) == "2 passworded regions will be left out of targets and triggers."
+    assert shell.passworded == str(path)
+    assert shell.parse('passwords {}'.format(tmp_path / 'missing.txt')).startswith(
+        "ERROR: Could not get passworded regions from ")
+
+
+@pytest.fixture
+def feed(shell):
+    start = shell.update_start()
+    events = [(i, start - 100 + 40 * i, "@@nation_{}@@'s influence rose.".format(i))
+              for i in range(1, 9)]
+    failures = set()
+
+    async def happenings(since, filters):
+        return [event for event in reversed(events) if since is None or event[0] > since]
+
+    async def nation_region(nation):
+        n = int(nation.split("_")[1])
+        if n in failures:
+            failures.discard(n)
+            raise TimeoutError()
+        return "region {}".format(n)
+
+    shell.tracker.happenings = happenings
+    shell.tracker.nation_region = nation_region
+    return events, failures
+
+
+def test_events_before_the_update_are_skipped(shell, feed):
+    observations = shell.tracker.call(shell.find_events_async())
+    # events 1 and 2 happened 60 and 20 seconds before the update started
+    assert observations == [["region {}".format(i), 40 * i - 100] for i in range(3, 9)]
+    assert shell.last_event_id == 8
+
+
+def test_find_event_returns_every_event_in_turn(shell, feed):
+    found = []
+    while True:
+        observation = shell.find_event()
+        if observation is None:
+            break
+        found.append(observation)
+    assert [region for region, _ in found] == ["region {}".format(i) for i in range(3, 9)]
+    assert shell.last_event_id == 8
+
+
+def test_cursor_stops_at_a_failed_lookup(shell, feed):
+    events, failures = feed
+    failures.add(5)
+    first = shell.tracker.call(shell.find_events_async())
+    assert [region for region, _ in first] == ["region 3", "region 4"]
+    assert shell.last_event_id == 4
+    second = shell.tracker.call(shell.find_events_async())
+    assert [region for region, _ in second] == ["region {}".format(i) for i in range(5, 9)]
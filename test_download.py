@@ -0,0 +1,148 @@
+import gzip
+import http.server
+import os
+import threading
+
+import pytest
+
+import download
+from delphi import Delphi
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class DumpHandler(http.server.BaseHTTPRequestHandler):
+    # serves server.body with an ETag, honouring If-None-Match and If-Range; cuts the next server.truncate responses
+    # off half way
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get('Range') and self.headers.get('If-Range') == server.etag:
+            start = int(self.headers['Range'][len("bytes="):-1])
+        body = server.body[start:]
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        if start:
+            self.send_header('Content-Range', "bytes {}-{}/{}".format(start, len(server.body) - 1, len(server.body)))
+        self.end_headers()
+        if server.truncate:
+            server.truncate -= 1
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(dump):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), DumpHandler)
+    with open(dump, 'rb') as f:
+        server.body = f.read()
+    server.etag = '"one"'
+    server.truncate = 0
+    server.requests = []
+    server.url = "http://127.0.0.1:{}/regions.xml.gz".format(server.server_address[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def read_all(stream):
+    with stream:
+        data = b"".join(iter(lambda: stream.read(1 << 14), b""))
+    return data
+
+
+def test_download_then_not_modified(server, tmp_path):
+    path = str(tmp_path / 'regions.xml.gz')
+    assert read_all(download.open_dump(server.url, path, 'test')) == server.body
+    with open(path, 'rb') as f:
+        assert f.read() == server.body
+    assert download.read_meta(path) == {'etag': server.etag}
+    assert download.open_dump(server.url, path, 'test') is None
+    assert server.requests[-1]['If-None-Match'] == server.etag
+
+
+def test_interrupted_download_resumes(server, tmp_path):
+    path = str(tmp_path / 'regions.xml.gz')
+    server.truncate = 1
+    with pytest.raises(OSError):
+        read_all(download.open_dump(server.url, path, 'test'))
+    assert not os.path.exists(path)
+    assert os.path.getsize(path + download.PART_SUFFIX) == len(server.body) // 2
+
+    stream = download.open_dump(server.url, path, 'test')
+    assert server.requests[-1]['Range'] == "bytes={}-".format(len(server.body) // 2)
+    assert server.requests[-1]['If-Range'] == server.etag
+    assert read_all(stream) == server.body
+    with open(path, 'rb') as f:
+        assert f.read() == server.body
+    assert not os.path.exists(path + download.PART_SUFFIX)
+
+
+def test_changed_dump_is_not_resumed(server, tmp_path):
+    path = str(tmp_path / 'regions.xml.gz')
+    server.truncate = 1
+    with pytest.raises(OSError):
+        read_all(download.open_dump(server.url, path, 'test'))
+    # the dump changes before the resume: If-Range no longer matches, so the whole new dump is sent
+    server.etag = '"two"'
+    server.body = gzip.compress(gzip.decompress(server.body).replace(b"Synthetic Region 7<", b"Synthetic Region 7b<"))
+    assert read_all(download.open_dump(server.url, path, 'test')) == server.body
+    with open(path, 'rb') as f:
+        assert f.read() == server.body
+
+
+def test_delphi_resumes_an_interrupted_download(server, tmp_path):
+    path = str(tmp_path / 'regions.xml.gz')
+    server.truncate = 1
+    messages = []
+    shell = Delphi.from_download(server.url, path, 'test', report=messages.append)
+    try:
+        assert len(shell.oracle.table) > 0 and shell.regions == path
+        assert any(message.startswith("Download interrupted") for message in messages)
+        assert messages[-1] == "Download complete."
+    finally:
+        shell.close()
+
+
+def test_delphi_falls_back_to_last_complete_dump(server, dump, tmp_path):
+    path = str(tmp_path / 'regions.xml.gz')
+    with open(dump, 'rb') as source, open(path, 'wb') as f:
+        f.write(source.read())
+    server.etag = '"two"'
+    server.truncate = 2
+    messages = []
+    shell = Delphi.from_download(server.url, path, 'test', report=messages.append)
+    try:
+        assert len(shell.oracle.table) > 0
+        assert messages[-1] == "Using the last complete copy of regions.xml.gz."
+    finally:
+        shell.close()
+
+    os.remove(path)
+    server.truncate = 2
+    with pytest.raises(FileNotFoundError):
+        Delphi.from_download(server.url, path, 'test', report=messages.append)
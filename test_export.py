@@ -0,0 +1,76 @@
+import html
+import json
+import re
+
+import pytest
+
+import export
+from regiontable import RegionTable
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def region_name(url):
+    assert url.startswith(export.REGION_URL)
+    return url[len(export.REGION_URL):].replace("_", " ")
+
+
+def read_back(path, fmt):
+    """Parses an export back into rows matching export.REGION_COLUMNS. CSV and HTML link regions by URL."""
+    if fmt == 'bin':
+        columns, title, rows = export.read_columnar(path)
+        assert columns == [tuple(column) for column in export.REGION_COLUMNS]
+        return list(rows)
+    with open(path) as f:
+        text = f.read()
+    if fmt == 'jsonl':
+        return [tuple(row[key] for key, _, _ in export.REGION_COLUMNS) for row in map(json.loads, text.splitlines())]
+    if fmt == 'csv':
+        lines = text.splitlines()
+        assert lines[0].split(",")[:len(export.REGION_COLUMNS)] == [key for key, _, _ in export.REGION_COLUMNS]
+        cells = [line.split(",") for line in lines[1:]]
+    else:
+        cells = [[html.unescape(cell) for cell in re.findall(r"<td>(.*?)</td>", row)]
+                 for row in re.findall(r"<tr>(.*?)</tr>", text)[1:]]
+    rows = []
+    for region, population, endos, founderless, h, m, s in cells:
+        if fmt == 'csv':
+            region = re.fullmatch(r'=HYPERLINK\("(.*)"\)', region).group(1)
+        rows.append((region_name(region), int(population), int(endos), founderless == 'True', int(h), int(m), int(s)))
+    return rows
+
+
+@pytest.mark.parametrize('fmt', sorted(export.WRITERS))
+def test_export_round_trip(oracle, tmp_path, fmt):
+    indices = oracle.select(flags=RegionTable.FOUNDERLESS)
+    expected = list(export.region_rows(oracle, 'minor', indices))
+    assert expected
+    path = str(tmp_path / ('regions.' + fmt))
+    # a small chunk size makes sure rows survive being split across chunks
+    assert export.export(oracle, path, modes=('minor',), flags=RegionTable.FOUNDERLESS, chunk_size=100) == [path]
+    assert read_back(path, fmt) == expected
+
+
+def test_export_paths(oracle, tmp_path):
+    path = str(tmp_path / 'regions.jsonl')
+    paths = export.export(oracle, path, modes=('major', 'minor'), regions=oracle.table.names[:10])
+    assert paths == [str(tmp_path / 'regions-major.jsonl'), str(tmp_path / 'regions-minor.jsonl')]
+    for mode, written in zip(('major', 'minor'), paths):
+        assert read_back(written, 'jsonl') == list(export.region_rows(oracle, mode, range(10)))
+    assert export.format_for("regions.HTML") == 'html' and export.format_for("regions.txt") == 'csv'
+    with pytest.raises(ValueError):
+        export.export(oracle, path, 'xlsx')
@@ -0,0 +1,97 @@
+import bisect
+import random
+import time
+
+import pytest
+
+import delphi
+import metrics
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def test_histogram_quantiles():
+    rng = random.Random(22)
+    histogram = metrics.Histogram()
+    values = sorted(rng.lognormvariate(-7, 1.5) for _ in range(5000))
+    for value in values:
+        histogram.observe(value)
+    assert histogram.count == sum(histogram.counts) == len(values)
+    assert histogram.sum == pytest.approx(sum(values)) and histogram.max == values[-1]
+    for q in (0.1, 0.5, 0.9, 0.99):
+        # an estimate is never further out than the bucket the true quantile is in
+        true = values[int(q * len(values)) - 1]
+        i = bisect.bisect_left(metrics.BUCKETS, true)
+        lower = metrics.BUCKETS[i - 1] if i else 0.0
+        upper = metrics.BUCKETS[i] if i < len(metrics.BUCKETS) else values[-1]
+        assert lower <= histogram.quantile(q) <= upper
+    assert metrics.Histogram().quantile(0.5) == 0.0
+
+
+def test_render_prometheus_text():
+    registry = metrics.Metrics()
+    for value in (2e-6, 3e-4, 0.2, 20.0):
+        registry.observe('delphi_command_seconds', value, (('command', 't'),))
+    registry.count('delphi_api_errors_total', (('error', 'say "hi"'),), 2)
+    registry.gauge('oracle_dump_regions', lambda: 12)
+    registry.gauge('oracle_dump_parse_seconds', lambda: None)
+    lines = registry.render().splitlines()
+
+    assert "# TYPE delphi_command_seconds histogram" in lines
+    buckets = [line for line in lines if line.startswith('delphi_command_seconds_bucket')]
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert len(buckets) == len(metrics.BUCKETS) + 1 and counts == sorted(counts)
+    assert buckets[-1] == 'delphi_command_seconds_bucket{command="t",le="+Inf"} 4'
+    assert 'delphi_command_seconds_count{command="t"} 4' in lines
+    assert 'delphi_api_errors_total{error="say \\"hi\\""} 2' in lines
+    assert 'oracle_dump_regions 12' in lines
+    # a gauge whose value is None is left out
+    assert not any(line.startswith('oracle_dump_parse_seconds') for line in lines)
+
+
+def test_observation_rate_and_age():
+    registry = metrics.Metrics()
+    now = time.time()
+    for age in (400, 100, 50, 10):
+        registry.observation('major', age != 50, now - age)
+    histograms, counters, gauges = registry.snapshot()
+    assert counters[('delphi_observations_total', (('mode', 'major'), ('result', 'accepted')))] == 3
+    assert counters[('delphi_observations_total', (('mode', 'major'), ('result', 'rejected')))] == 1
+    # the observation from 400 seconds ago is outside the rate window
+    assert gauges[('delphi_observation_rate_per_minute', (('mode', 'major'),))] == 3 * 60 / registry.rate_window
+    assert gauges[('delphi_observation_age_seconds', (('mode', 'major'),))] == pytest.approx(10, abs=1)
+
+
+def test_stats_command(dump, api):
+    shell = delphi.Delphi(dump, 'test', api=api.url)
+    try:
+        assert shell.parse('stats').startswith("Instrumentation is off")
+        assert shell.parse('stats on') == "Instrumentation on."
+        shell.parse('t synthetic region 5')
+        shell.parse('frobnicate')
+        shell.record_observation('synthetic region 5', 100.0)
+        shell.tracker.call(shell.find_events_async())
+        summary = shell.parse('stats')
+        for expected in ("Dump: ", "get_time: ", "Command 't': 1 calls", "Command 'other': 1 calls", "API happenings",
+                         "Observations (major): 1 accepted"):
+            assert expected in summary
+        assert shell.parse('stats off') == "Instrumentation off."
+        # the measured methods are put back, so nothing is measured any more
+        for owner, method in metrics.INSTRUMENTED:
+            assert method not in vars(getattr(shell, owner) if owner else shell)
+    finally:
+        shell.close()
@@ -0,0 +1,76 @@
+import random
+
+from nameindex import NameIndex, distance, normalize
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+NAMES = ["the north pacific", "the south pacific", "the east pacific", "the west pacific", "the pacific", "lazarus",
+         "osiris", "balder", "europeia", "the rejected realms", "10000 islands", "the communist bloc", "spiritus",
+         "the leftist assembly", "forest", "hippiedom", "osiris ii"]
+
+
+def test_exact_and_url_style_names():
+    index = NameIndex(NAMES)
+    assert index.match("Lazarus") == ["lazarus"]
+    assert index.match("the_north_pacific") == ["the north pacific"]
+    assert index.match("  The  Rejected_Realms ") == ["the rejected realms"]
+    # an exact name wins over longer names it is the start of
+    assert index.match("osiris") == ["osiris"]
+
+
+def test_prefix_completion():
+    index = NameIndex(NAMES)
+    assert index.match("the n") == ["the north pacific"]
+    assert index.match("the") == ["the communist bloc", "the east pacific", "the leftist assembly",
+                                  "the north pacific", "the pacific", "the rejected realms", "the south pacific",
+                                  "the west pacific"]
+    assert index.complete("the", limit=2) == ["the communist bloc", "the east pacific"]
+    assert index.match("osiris i") == ["osiris ii"]
+
+
+def test_typo_correction():
+    index = NameIndex(NAMES)
+    assert index.match("lazarsu") == ["lazarus"]
+    assert index.match("baldr") == ["balder"]
+    assert index.match("eurpeia") == ["europeia"]
+    assert index.match("forrest") == ["forest"]
+    assert index.match("the west pacifix") == ["the west pacific"]
+    # equally close to two names: both are offered
+    assert sorted(NameIndex(["abcd", "abce"]).match("abcx")) == ["abcd", "abce"]
+    assert index.match("nowhere at all") == []
+    assert NameIndex(NAMES, max_distance=0).match("lazarsu") == []
+
+
+def test_fuzzy_matches_brute_force():
+    rng = random.Random(1)
+    names = ["".join(rng.choice("abcde ") for _ in range(rng.randint(3, 8))).strip() or "a" for _ in range(300)]
+    names = sorted(set(normalize(name) for name in names))
+    index = NameIndex(names)
+    for _ in range(300):
+        query = rng.choice(names)
+        position = rng.randrange(len(query))
+        query = query[:position] + rng.choice(("", "x", query[position:position + 1] * 2)) + query[position + 1:]
+        key = normalize(query)
+        expected = sorted((distance(key, name, 1), name) for name in names if distance(key, name, 1) <= 1)
+        assert sorted((edits, name) for name, edits in index.fuzzy(query, limit=len(names))) == expected
+
+
+def test_background_build():
+    index = NameIndex(NAMES)
+    index.build_in_background()
+    assert index.match("lazarsu") == ["lazarus"]
+    assert index.deletions is not None
@@ -0,0 +1,82 @@
+import gzip
+import random
+import re
+
+from conftest import REGIONS, brute_flags
+from fenwick import FenwickTree, cumulate
+from oracle import Oracle
+from regiontable import RegionTable
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Checks of the Fenwick tree cumulative population and delta dump ingestion against brute force.
+
+def test_fenwick_prefix_sums():
+    rng = random.Random(2)
+    tree = FenwickTree(200)
+    values = [0] * 200
+    for _ in range(2000):
+        i = rng.randrange(200)
+        delta = rng.randint(-50, 50)
+        tree.add(i, delta)
+        values[i] += delta
+        j = rng.randint(0, 200)
+        assert tree.prefix(j) == sum(values[:j])
+
+
+def test_cumulative_population_follows_changes(oracle):
+    rng = random.Random(3)
+    table = oracle.table
+    population = list(table.population)
+    for _ in range(500):
+        i = rng.randrange(len(table))
+        population[i] = rng.randint(0, 300)
+        table.set_population(i, population[i])
+        j = rng.randrange(len(table))
+        assert table.cumulative[j] == sum(population[1:j + 1])
+    assert list(table.cumulative) == list(cumulate(population))
+    assert table.total == sum(population[1:])
+
+
+def test_ingest_patches_indexes(dump, tmp_path):
+    rng = random.Random(4)
+    with gzip.open(dump, 'rt', encoding='utf-8') as f:
+        lines = f.read().split("\n")
+    for n in rng.sample(range(2, REGIONS + 2), 100):
+        line = lines[n]
+        line = re.sub(r"<NUMNATIONS>\d+", "<NUMNATIONS>{}".format(rng.randint(1, 400)), line)
+        line = re.sub(r"<DELEGATEVOTES>\d+", "<DELEGATEVOTES>{}".format(rng.choice((0, 3, 12, 60, 250))), line)
+        founder = "0" if rng.random() < 0.5 else "someone"
+        line = re.sub(r"<FOUNDER>[^<]*", "<FOUNDER>" + founder, line)
+        lines[n] = re.sub(r"<GOVERNOR>[^<]*", "<GOVERNOR>" + founder, line)
+    newer = str(tmp_path / 'newer.xml.gz')
+    with gzip.open(newer, 'wt', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+
+    patched = Oracle(dump, 'test', snapshot=False, passworded=["Synthetic Region 5"])
+    changed, rebuilt = patched.ingest(newer, snapshot=False)
+    fresh = Oracle(newer, 'test', snapshot=False, passworded=["Synthetic Region 5"])
+    assert changed and not rebuilt
+    table = patched.table
+    assert list(table.population) == list(fresh.table.population)
+    assert list(table.cumulative) == list(fresh.table.cumulative)
+    assert list(table.flags) == list(fresh.table.flags)
+    for flag in RegionTable.FLAGS:
+        assert RegionTable.indices(table.flag_masks[flag]) == brute_flags(table, flag)
+    for band in range(len(RegionTable.ENDO_BANDS)):
+        assert RegionTable.indices(table.endo_masks[band]) == [i for i in range(len(table))
+                                                               if RegionTable.band(table.endos[i]) == band]
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+import replay
+import updatetrace
+from oracle import Oracle
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def track(trace, dump, rng, speed):
+    """Records one session the way Delphi does: population changes as they are seen, then observations."""
+    live = Oracle(dump, 'test', snapshot=False)
+    writer = updatetrace.TraceWriter(trace, dump)
+    names = live.table.names
+    for i in range(1, len(names), 50):
+        for _ in range(3):
+            region, delta = rng.choice(names[1:]), rng.choice((-1, 1))
+            writer.population('major', region, delta)
+            live.adjust_population(region, delta)
+        observed = speed * live.table.cumulative[i] / live.table.total + rng.gauss(0, 2)
+        writer.observation('major', names[i].lower(), observed, live.get_time(names[i], 'major'))
+        live.set_offset(names[i], observed, 'major')
+    writer.close()
+
+
+def test_replay_matches_live_tracking(dump, tmp_path):
+    rng = random.Random(12)
+    trace = str(tmp_path / 'trace.jsonl')
+    # two runs appending to one trace, each calibrating from scratch against a different update length
+    track(trace, dump, rng, 4000)
+    track(trace, dump, rng, 3000)
+
+    assert [session[0]['k'] for session in replay.sessions(trace)] == [updatetrace.HEADER] * 2
+    results = replay.replay(trace, dump, load=lambda: Oracle(dump, 'test', snapshot=False))
+    assert len(results['sessions']) == 2
+    assert results['population_changes'] == 6 * results['observations'] // 2
+    assert results['error'] == pytest.approx(results['recorded_error'])
@@ -0,0 +1,127 @@
+import queue
+import threading
+
+import pytest
+
+import delphi
+import server
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+@pytest.fixture
+def served(dump, api):
+    shell = delphi.Delphi(dump, 'test', api=api.url)
+    instance = server.DelphiServer(shell, ('127.0.0.1', 0))
+    threading.Thread(target=instance.serve_forever, args=(0.05,), daemon=True).start()
+    instance.url = "http://127.0.0.1:{}".format(instance.server_address[1])
+    client = server.DelphiClient(instance.url)
+    yield instance, client
+    client.close()
+    instance.close()
+
+
+def test_queries_match_oracle(served):
+    instance, client = served
+    oracle = instance.shell.oracle
+    status = client.get('/status')
+    assert status['regions'] == len(oracle.table) and status['version'] == 0
+
+    result = client.get('/time', region='Synthetic_Region_12', mode='minor')
+    assert result['region'] == 'synthetic region 12'
+    assert result['time'] == oracle.get_time('synthetic region 12', 'minor')
+    assert 'synthetic region 12' in instance.shell.watched
+
+    times = oracle.get_times('major')
+    start, end = times[100], times[140]
+    window = client.get('/window', start=start, end=end, limit=5, mode='major')
+    assert window['count'] == len(oracle.regions_between(start, end, 'major'))
+    assert window['regions'] == [[name, t] for name, t in zip(oracle.table.names[100:105], times[100:105])]
+    assert client.get('/next', time=start, count=3, mode='major')['regions'] == [
+        list(pair) for pair in oracle.next_regions(start, 3, 'major')]
+    assert client.get('/at', time=start, mode='major')['region'] == oracle.region_at(start, 'major')
+
+
+@pytest.mark.parametrize('method, path, params, status', [
+    ('GET', '/time', {'region': 'synthetic region'}, 404),
+    ('GET', '/time', {'region': 'no such place at all'}, 404),
+    ('GET', '/time', {}, 400),
+    ('GET', '/time', {'region': 'synthetic region 12', 'mode': 'medium'}, 400),
+    ('GET', '/window', {'start': 'soon', 'end': 10}, 400),
+    ('GET', '/nowhere', {}, 404),
+    ('GET', '/metrics', {}, 404),
+    ('POST', '/tracking', {'enabled': 'yes'}, 400),
+    ('POST', '/nudge', {}, 400),
+])
+def test_bad_requests(served, method, path, params, status):
+    instance, client = served
+    with pytest.raises(server.ServerError) as error:
+        client.request(method, path, params)
+    assert error.value.status == status and error.value.body['error']
+
+
+def test_ambiguous_region_suggests_matches(served):
+    instance, client = served
+    with pytest.raises(server.ServerError) as error:
+        client.get('/time', region='synthetic reg')
+    suggestions = error.value.body['suggestions']
+    assert error.value.status == 404 and len(suggestions) > 1
+    assert all(name.startswith('synthetic region') for name in suggestions)
+
+
+def test_calibration_changes_are_pushed(served):
+    instance, client = served
+    events = queue.Queue()
+
+    def listen():
+        for state in server.DelphiClient(instance.url).events():
+            events.put(state)
+    threading.Thread(target=listen, daemon=True).start()
+
+    assert events.get(timeout=5)['version'] == 0
+    result = client.post('/observe', region='synthetic region 700', time=2000, mode='major')
+    assert result['major']['observations'] == 1
+    assert events.get(timeout=5)['version'] == 1
+    assert client.post('/nudge', nudge=3)['nudge'] == 3
+    state = events.get(timeout=5)
+    assert state['version'] == 2 and state['nudge'] == 3
+    assert client.get('/calibration') == state
+
+
+def test_remote_shell(served):
+    instance, client = served
+    remote = server.RemoteShell(client)
+    assert remote.parse('t synthetic region 12').startswith("Time predicted for synthetic region 12:")
+    assert remote.parse('r').startswith("Time predicted for synthetic region 12:")
+    assert remote.parse('n 2').startswith("Nudge is 2")
+    assert remote.parse('m minor') == "Mode set to minor."
+    assert remote.parse('cal').startswith("minor calibration: 0 observations")
+    assert remote.parse('start') == "Server tracking set to True."
+    assert instance.shell.tracking
+    assert remote.parse('stop') == "Server tracking set to False."
+    assert not instance.shell.tracking
+
+
+def test_tracking_command_restarts_polling(served):
+    instance, client = served
+    shell = instance.shell
+    # a long idle spell has backed polling off
+    shell.idle_polls = 8
+    assert client.post('/tracking', enabled=True) == {'tracking': True}
+    assert shell.tracking and shell.idle_polls == 0
+    assert client.post('/tracking', enabled=False) == {'tracking': False}
+    assert not shell.tracking
@@ -0,0 +1,81 @@
+import hashlib
+import shutil
+
+import pytest
+
+from oracle import Oracle
+from regiontable import RegionTable
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+@pytest.fixture
+def copy(dump, tmp_path):
+    # snapshots are written next to the dump, so work on a copy of it
+    path = str(tmp_path / 'regions.xml.gz')
+    shutil.copyfile(dump, path)
+    return path
+
+
+def columns(table):
+    return (list(table.names), list(table.population), list(table.cumulative), list(table.endos), list(table.flags))
+
+
+def test_dump_digest(dump):
+    with open(dump, 'rb') as f:
+        assert Oracle.dump_digest(dump) == hashlib.sha256(f.read()).digest()
+
+
+def test_snapshot_reloads_the_same_table(copy):
+    parsed = Oracle(copy, 'test', passworded=["Synthetic Region 3"])
+    assert 'snapshot' not in parsed.load_stats
+    loaded = Oracle(copy, 'test')
+    assert loaded.load_stats['snapshot'] == copy + Oracle.snapshot_suffix
+    assert columns(loaded.table)[:4] == columns(parsed.table)[:4]
+    assert loaded.get_times('major') == parsed.get_times('major')
+    # the dump does not record passwords, so neither does its snapshot
+    assert list(loaded.table.flags) == [flags & ~RegionTable.PASSWORDED for flags in parsed.table.flags]
+    for flag in (RegionTable.FOUNDERLESS, RegionTable.GOVERNORLESS, RegionTable.DELEGATELESS):
+        assert loaded.table.flag_masks[flag] == parsed.table.flag_masks[flag]
+    assert not loaded.table.flag_masks[RegionTable.PASSWORDED]
+
+
+def test_snapshot_columns_are_copied_on_write(copy):
+    Oracle(copy, 'test')
+    loaded = Oracle(copy, 'test')
+    name = loaded.table.names[10]
+    before = loaded.table.population[10]
+    loaded.adjust_population(name, 5)
+    assert loaded.table.population[10] == before + 5
+    assert Oracle(copy, 'test').table.population[10] == before
+
+
+@pytest.mark.parametrize('damage', ['truncate', 'other dump'])
+def test_unusable_snapshot_is_ignored(copy, damage):
+    expected = columns(Oracle(copy, 'test').table)
+    snapshot = copy + Oracle.snapshot_suffix
+    if damage == 'truncate':
+        with open(snapshot, 'r+b') as f:
+            f.truncate(200)
+    else:
+        # a snapshot is keyed by the content hash of its dump, so one left over from another day's dump is not used
+        with open(copy, 'ab') as f:
+            f.write(b'\0')
+    reloaded = Oracle(copy, 'test')
+    assert 'snapshot' not in reloaded.load_stats
+    assert columns(reloaded.table) == expected
+    assert Oracle(copy, 'test').load_stats.get('snapshot') == snapshot
@@ -0,0 +1,65 @@
+import gzip
+import random
+import re
+
+import pytest
+
+from conftest import brute_flags
+from regiontable import RegionTable
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def test_flags_follow_the_dump(dump, oracle):
+    with gzip.open(dump, 'rt', encoding='utf-8') as f:
+        text = f.read()
+    for region in re.findall(r"<REGION>.*?</REGION>", text):
+        i = oracle.table.lookup(re.search(r"<NAME>([^<]*)", region).group(1))
+        founderless = re.search(r"<FOUNDER>([^<]*)", region).group(1) in ("0", "")
+        delegateless = re.search(r"<DELEGATE>([^<]*)", region).group(1) in ("0", "")
+        assert bool(oracle.table.flags[i] & RegionTable.FOUNDERLESS) == founderless
+        assert bool(oracle.table.flags[i] & RegionTable.DELEGATELESS) == delegateless
+
+
+@pytest.mark.parametrize('low, high', [(0, None), (0, 1), (1, 5), (3, 17), (5, 10), (7, 7), (12, 260), (199, None),
+                                       (0, 1000), (600, None)])
+def test_endo_mask(oracle, low, high):
+    endos = oracle.table.endos
+    assert RegionTable.indices(oracle.table.endo_mask(low, high)) == [
+        i for i in range(len(endos)) if low <= endos[i] and (high is None or endos[i] < high)]
+
+
+def test_select(oracle):
+    rng = random.Random(7)
+    table = oracle.table
+    times = oracle.get_times('major')
+    for _ in range(200):
+        flags = rng.choice((0, RegionTable.FOUNDERLESS, RegionTable.DELEGATELESS,
+                            RegionTable.FOUNDERLESS | RegionTable.GOVERNORLESS))
+        exclude = rng.choice((0, RegionTable.PASSWORDED))
+        min_endos = rng.choice((0, 0, 2, 10))
+        max_endos = rng.choice((None, 5, 40, 300))
+        start = rng.choice((None, rng.uniform(0, times[-1])))
+        end = rng.choice((None, rng.uniform(0, times[-1])))
+        expected = [i for i in brute_flags(table, flags, exclude)
+                    if min_endos <= table.endos[i] and (max_endos is None or table.endos[i] < max_endos)
+                    and (start is None or times[i] >= start) and (end is None or times[i] <= end)]
+        assert oracle.select(flags=flags, min_endos=min_endos, max_endos=max_endos, start=start, end=end,
+                             exclude=exclude) == expected
+        names = rng.sample(table.names, 50)
+        assert oracle.select(names, flags=flags, exclude=exclude) == [
+            table.lookup(name) for name in names if table.lookup(name) in brute_flags(table, flags, exclude)]
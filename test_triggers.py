@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import triggers
+from regiontable import RegionTable
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def test_trigger_sweep(oracle):
+    targets = oracle.select(flags=RegionTable.FOUNDERLESS)
+    candidates = oracle.select(max_endos=5)
+    times = oracle.get_times('major')
+    for min_lead, max_lead, ideal in ((4, 10, None), (1, 30, 2), (6, 6.5, None)):
+        plans = triggers.plan(oracle, 'major', targets, min_lead, max_lead, ideal, fallbacks=2, triggers=candidates)
+        assert [target for target, t, chosen in plans] == targets
+        preferred = (min_lead + max_lead) / 2 if ideal is None else ideal
+        for target, t, chosen in plans:
+            assert t == times[target]
+            leads = sorted(abs(t - times[i] - preferred) for i in candidates
+                           if i != target and min_lead <= t - times[i] <= max_lead)
+            assert [abs(lead - preferred) for i, lead in chosen] == pytest.approx(leads[:3])
+            for i, lead in chosen:
+                assert i in candidates and lead == pytest.approx(t - times[i])
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'html', 'jsonl'])
+def test_missing_triggers_export_blank(oracle, tmp_path, fmt):
+    path = str(tmp_path / ('plan.' + fmt))
+    targets = oracle.select(flags=RegionTable.FOUNDERLESS)
+    # a window narrow enough that some targets have no trigger, and fallbacks that some cannot fill
+    count = triggers.export_plan(oracle, path, targets=targets, min_lead=4, max_lead=4.2)
+    plans = triggers.plan(oracle, 'major', targets, 4, 4.2)
+    missing = [i for i, (target, t, chosen) in enumerate(plans) if not chosen]
+    assert count == len(targets) and missing
+    with open(path) as f:
+        text = f.read()
+    assert "nan" not in text.lower() and "None" not in text
+    if fmt == 'jsonl':
+        row = json.loads(text.splitlines()[missing[0]])
+        assert row['trigger'] is None and row['lead'] is None and row['fallback_1'] is None
+    elif fmt == 'csv':
+        cells = text.splitlines()[1 + missing[0]].split(",")
+        assert cells[0].startswith('=HYPERLINK(') and cells[1]
+        assert cells[2:] == [""] * (len(triggers.columns(2)) - 2)
+    else:
+        assert '<td></td><td></td><td></td>' in text
@@ -0,0 +1,102 @@
+import datetime
+import os
+import random
+
+import pytest
+
+import updatehistory
+from calibration import Calibration
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+START = datetime.date(2026, 1, 1)
+
+
+def observe(rng, length, offset, count=40):
+    model = Calibration(length * 0.8)
+    low = rng.uniform(0, 0.5)
+    for _ in range(count):
+        x = low + rng.uniform(0, 0.4)
+        model.add(x, length * x - offset + rng.gauss(0, 3))
+    return model
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    rng = random.Random(21)
+    path = str(tmp_path / 'history.bin')
+    history = updatehistory.History(path)
+    models = {}
+    for d in range(60):
+        day = START + datetime.timedelta(days=d)
+        for mode, length in (('major', 5400), ('minor', 3600)):
+            offset = rng.gauss(30, 5)
+            model = observe(rng, length, offset)
+            models[(day, mode)] = model, offset
+            history.record(day, mode, model)
+    return path, models
+
+
+def test_round_trip(recorded):
+    path, models = recorded
+    history = updatehistory.History(path)
+    assert len(history) == len(models)
+    assert [day for day, _, _ in history.updates('minor')] == [START + datetime.timedelta(days=d) for d in range(60)]
+    for (day, mode), (model, _) in models.items():
+        restored = Calibration(model.prior_speed)
+        assert history.restore(day, mode, restored)
+        assert restored.count == model.count
+        assert (restored.speed, restored.offset) == pytest.approx((model.speed, model.offset))
+    assert not history.restore(START - datetime.timedelta(days=1), 'major', Calibration(1000))
+
+
+def test_record_replaces_the_same_update(recorded):
+    path, models = recorded
+    day = START + datetime.timedelta(days=10)
+    model = observe(random.Random(1), 4000, 0)
+    updatehistory.History(path).record(day, 'major', model)
+    history = updatehistory.History(path)
+    assert len(history) == len(models)
+    assert dict((d, length) for d, length, _ in history.updates('major'))[day] == pytest.approx(model.speed)
+
+
+def test_fit_recovers_the_update_length(recorded):
+    path, models = recorded
+    history = updatehistory.History(path)
+    today = START + datetime.timedelta(days=60)
+    for mode, length in (('major', 5400), ('minor', 3600)):
+        speed, offset = history.fit(mode, 1000, today)
+        assert speed == pytest.approx(length, rel=0.01)
+        assert offset == pytest.approx(30, abs=5)
+    # an update left out of the fit has no say in it
+    before = START + datetime.timedelta(days=1)
+    _, true_offset = models[(START, 'major')]
+    speed, offset = history.fit('major', 1000, before, before=before)
+    assert speed == pytest.approx(5400, rel=0.01)
+    assert offset == pytest.approx(true_offset, abs=2)
+    assert history.fit('major', 1000, START, before=START) is None
+
+
+def test_old_records_and_torn_writes_are_dropped(recorded):
+    path, models = recorded
+    with open(path, 'ab') as f:
+        f.write(b'torn')
+    history = updatehistory.History(path, keep=9)
+    assert len(history) == 2 * 10
+    assert os.path.getsize(path) == (updatehistory.History.file_header.size +
+                                     len(history) * updatehistory.History.file_record.size)
+    assert updatehistory.History(path).updates('major')[0][0] == START + datetime.timedelta(days=50)
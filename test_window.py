@@ -0,0 +1,50 @@
+import random
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def test_window_inverts_get_time(oracle):
+    rng = random.Random(5)
+    oracle.offset = 37.5
+    oracle.nudge = -4
+    for mode in ('major', 'minor'):
+        times = oracle.get_times(mode)
+        assert times == [oracle.get_time(name, mode) for name in oracle.table.names]
+        # probe exact region times as well as arbitrary ones, as those are where rounding matters
+        probes = [None] + rng.sample(times, 50) + [rng.uniform(-100, times[-1] + 100) for _ in range(50)]
+        for _ in range(200):
+            start, end = rng.choice(probes), rng.choice(probes)
+            inside = [i for i, t in enumerate(times) if (start is None or t >= start) and (end is None or t <= end)]
+            first, stop = oracle.window(start, end, mode)
+            assert list(range(first, stop)) == inside
+
+
+def test_reverse_queries(oracle):
+    rng = random.Random(8)
+    times = oracle.get_times('major')
+    names = oracle.table.names
+    assert oracle.region_at(times[0] - 1, 'major') is None
+    assert oracle.region_at(times[-1] + 1, 'major') == names[-1]
+    for _ in range(100):
+        t = rng.uniform(times[0], times[-1])
+        updated = [i for i, time in enumerate(times) if time <= t]
+        assert oracle.region_at(t, 'major') == names[updated[-1]]
+        assert oracle.next_regions(t, 5, 'major') == [(names[i], times[i]) for i in range(len(times))
+                                                       if times[i] > t][:5]
+        end = t + rng.uniform(0, 60)
+        assert oracle.regions_between(t, end, 'major') == [names[i] for i in range(len(times))
+                                                             if t <= times[i] <= end]
@@ -0,0 +1,390 @@
+import asyncio
+import concurrent.futures
+import ssl
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+API_URL = "https://www.nationstates.net/cgi-bin/api.cgi"
+
+
+class HTTPError(Exception):
+    def __init__(self, status, reason, headers):
+        """
+        Raised when the server answers with a non-2xx status.
+
+        :param status: HTTP status code
+        :param reason: HTTP reason phrase
+        :param headers: Dictionary of response headers with lowercase names
+        """
+        super().__init__("HTTP {} {}".format(status, reason))
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+
+class Response:
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class ConnectionPool:
+    def __init__(self, ua, timeout=10, max_connections=4):
+        """
+        Minimal asyncio HTTP/1.1 client that keeps connections alive and reuses them for later requests, so the TCP
+        and TLS handshakes are paid once rather than on every API call.
+
+        :param ua: User agent string sent with every request
+        :param timeout: Seconds to wait for a complete response before giving up
+        :param max_connections: Maximum number of simultaneous connections per host
+        """
+        self.ua = ua
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.ssl = ssl.create_default_context()
+        self.idle = {}
+        self.limits = {}
+
+        # counters, mostly useful for measuring connection reuse
+        self.requests = 0
+        self.connections = 0
+
+    async def _connect(self, scheme, host, port):
+        self.connections += 1
+        return await asyncio.open_connection(host, port, ssl=self.ssl if scheme == 'https' else None,
+                                             server_hostname=host if scheme == 'https' else None)
+
+    @staticmethod
+    async def _read_body(reader, headers):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # skip trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks), True
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        if 'content-length' in headers:
+            return await reader.readexactly(int(headers['content-length'])), True
+        # no length given: the body runs until the server closes the connection
+        return await reader.read(), False
+
+    async def _exchange(self, connection, host, target, headers):
+        reader, writer = connection
+        request = ["GET {} HTTP/1.1".format(target),
+                   "Host: {}".format(host),
+                   "User-Agent: {}".format(self.ua),
+                   "Accept-Encoding: identity",
+                   "Connection: keep-alive"]
+        request.extend("{}: {}".format(key, value) for key, value in (headers or {}).items())
+        writer.write(("\r\n".join(request) + "\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server")
+        version, status, reason = (status_line.decode('latin-1').rstrip("\r\n").split(" ", 2) + [""])[:3]
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+
+        body, reusable = await self._read_body(reader, response_headers)
+        reusable = reusable and response_headers.get('connection', '').lower() != 'close'
+        return Response(int(status), reason, response_headers, body), reusable
+
+    async def _request(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        limit = self.limits.setdefault(key, asyncio.Semaphore(self.max_connections))
+        async with limit:
+            idle = self.idle.setdefault(key, [])
+            # a pooled connection may have been closed by the server while idle. retry such failures once on a fresh
+            # connection; failures on a fresh connection are real.
+            while True:
+                reused = bool(idle)
+                connection = idle.pop() if reused else await self._connect(*key)
+                done = False
+                try:
+                    response, reusable = await self._exchange(connection, parts.hostname, target, headers)
+                    done = True
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if not reused:
+                        raise
+                    continue
+                finally:
+                    if not done or not reusable:
+                        connection[1].close()
+                    else:
+                        idle.append(connection)
+                self.requests += 1
+                return response
+
+    async def request(self, url, headers=None, timeout=None):
+        """
+        Performs a GET request. Cancelling the calling task or running out of time closes the connection in use.
+
+        :param url: URL to request
+        :param headers: Dictionary of extra request headers
+        :param timeout: Seconds to wait for a complete response. Defaults to the pool's timeout.
+        :return: Response
+        :raises HTTPError: if the server answers with a non-2xx status
+        :raises asyncio.TimeoutError: if no complete response arrives in time
+        """
+        response = await asyncio.wait_for(self._request(url, headers),
+                                          self.timeout if timeout is None else timeout)
+        if not 200 <= response.status < 300:
+            raise HTTPError(response.status, response.reason, response.headers)
+        return response
+
+    async def close(self):
+        for idle in self.idle.values():
+            for reader, writer in idle:
+                writer.close()
+        self.idle = {}
+
+
+class RateLimiter:
+    def __init__(self, requests=40, per=30.0, clock=time.monotonic):
+        """
+        Token bucket that spaces out API calls to stay within a request budget. The bucket holds up to requests
+        tokens and refills at requests / per tokens a second; every call spends one. NationStates allows 50 requests
+        in 30 seconds, so the default leaves headroom for other programs run by the same operator.
+
+        Only use from the tracker's event loop, except for delay(), which only reads.
+
+        :param requests: Requests allowed per period, and the largest burst
+        :param per: Period in seconds
+        :param clock: Monotonic clock, replaceable for testing
+        """
+        self.capacity = requests
+        self.rate = requests / per
+        self.clock = clock
+        self.tokens = float(requests)
+        self.updated = clock()
+        # calls are refused outright until this time, e.g. after a 429 response
+        self.blocked_until = 0.0
+
+        # counters
+        self.granted = 0
+        self.throttled = 0
+
+    def _available(self, now):
+        return min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+
+    def delay(self):
+        """
+        Gets how long the next call would have to wait for the budget.
+
+        :return: Seconds, or 0 if a call could be made now
+        """
+        now = self.clock()
+        tokens = self._available(now)
+        return max(0.0, self.blocked_until - now, (1 - tokens) / self.rate if tokens < 1 else 0.0)
+
+    async def acquire(self):
+        """
+        Waits until the budget allows a call, then spends one token on it.
+        """
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        now = self.clock()
+        self.tokens = self._available(now) - 1
+        self.updated = now
+        self.granted += 1
+
+    def throttle(self, seconds):
+        """
+        Stops all calls for a while, e.g. when the server says to retry later, and empties the bucket.
+        """
+        now = self.clock()
+        self.throttled += 1
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = now
+
+    def observe(self, headers):
+        """
+        Brings the bucket in line with the rate limit headers of a response, so that calls made by other programs
+        against the same limit are accounted for.
+
+        :param headers: Dictionary of response headers with lowercase names
+        """
+        try:
+            remaining = int(headers['ratelimit-remaining'])
+        except (KeyError, ValueError):
+            return
+        now = self.clock()
+        self.tokens = min(self._available(now), remaining)
+        self.updated = now
+        if remaining <= 0:
+            self.throttle(retry_after(headers, 1.0 / self.rate, 'ratelimit-reset'))
+
+
+def retry_after(headers, default=30.0, name='retry-after'):
+    """
+    Reads a delay in seconds from a response header, e.g. Retry-After.
+
+    :param headers: Dictionary of response headers with lowercase names
+    :param default: Delay to use if the header is absent or not a number of seconds
+    :param name: Header name
+    :return: Seconds
+    """
+    for key in (name, 'x-' + name):
+        try:
+            return max(0.0, float(headers[key]))
+        except (KeyError, ValueError):
+            continue
+    return default
+
+
+class Tracker:
+    def __init__(self, ua, api=API_URL, timeout=10, rate_limit=(40, 30.0)):
+        """
+        Runs NationStates API calls on a private asyncio event loop in a background thread. Every call shares one
+        keep-alive connection pool and one request budget.
+
+        :param ua: User agent string that identifies the operator, as required by NS TOS
+        :param api: URL of the NationStates API. Point this at a stand-in server (see standin.py) to work offline.
+        :param timeout: Seconds to wait for each API response
+        :param rate_limit: Tuple (requests, per seconds) of the request budget, or None for no limit
+        """
+        self.api = api
+        self.pool = ConnectionPool(ua, timeout)
+        self.limiter = RateLimiter(*rate_limit) if rate_limit else None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine):
+        """
+        Schedules a coroutine on the tracker's event loop from any thread.
+
+        :param coroutine: Coroutine to run
+        :return: concurrent.futures.Future for its result. Cancelling it cancels the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, coroutine, timeout=None):
+        """
+        Runs a coroutine on the tracker's event loop and waits for its result.
+        """
+        return self.submit(coroutine).result(timeout)
+
+    def url(self, **params):
+        """
+        Builds an API URL, e.g. url(q="happenings;filter=change").
+        """
+        return self.api + "?" + "&".join("{}={}".format(key, urllib.parse.quote(str(value), safe=";,+"))
+                                         for key, value in params.items())
+
+    async def query(self, **params):
+        """
+        Queries the API, waiting for the request budget first. A 429 response pauses every call for as long as the
+        server asks.
+
+        :return: Root element of the XML response
+        """
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        try:
+            response = await self.pool.request(self.url(**params))
+        except HTTPError as e:
+            if self.limiter is not None:
+                if e.status == 429:
+                    self.limiter.throttle(retry_after(e.headers))
+                else:
+                    self.limiter.observe(e.headers)
+            raise
+        if self.limiter is not None:
+            self.limiter.observe(response.headers)
+        return ElementTree.fromstring(response.body)
+
+    async def happenings(self, since=None, filters=("change",)):
+        """
+        Gets happenings.
+
+        :param since: Only return events with an id greater than this, or None for the latest events
+        :param filters: Happening types to return, e.g. change, move, founding, cte
+        :return: List of (id, timestamp, text) tuples, newest first
+        """
+        shards = "happenings;filter={}".format("+".join(filters))
+        if since is not None:
+            shards += ";sinceid={}".format(since)
+        xml = await self.query(q=shards)
+        return [(int(event.get("id", 0)), int(event.findtext("TIMESTAMP")), event.findtext("TEXT"))
+                for event in xml.iter("EVENT")]
+
+    async def nation_region(self, nation):
+        """
+        Looks up which region a nation resides in.
+
+        :param nation: Nation name
+        :return: Region name
+        """
+        xml = await self.query(nation=nation, q="region")
+        return xml.findtext("REGION")
+
+    async def tagged_regions(self, tags):
+        """
+        Gets the regions carrying every given tag, e.g. tagged_regions(("password",)) for passworded regions.
+
+        :param tags: Region tags
+        :return: List of region names
+        """
+        xml = await self.query(q="regionsbytag;tags={}".format(",".join(tags)))
+        return [name.replace("_", " ") for name in (xml.findtext("REGIONS") or "").split(",") if name]
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.pool.close()
+
+    def close(self, timeout=5):
+        """
+        Cancels everything running on the event loop, closes pooled connections and stops the loop.
+
+        :param timeout: Seconds to wait for running tasks to finish cancelling before stopping the loop regardless
+        """
+        if self.loop.is_running():
+            try:
+                self.call(self._shutdown(), timeout)
+            except concurrent.futures.TimeoutError:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
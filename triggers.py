@@ -0,0 +1,133 @@
+import datetime
+
+import export
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+# default lead window in seconds: a trigger should update between MIN_LEAD and MAX_LEAD seconds before its target
+MIN_LEAD = 4
+MAX_LEAD = 10
+
+
+def plan(oracle, mode, targets, min_lead=MIN_LEAD, max_lead=MAX_LEAD, ideal=None, fallbacks=2, triggers=None):
+    """
+    Finds trigger regions for many targets in one sweep. Targets and candidate triggers are both in update order, so
+    as the sweep moves from one target to the next, the start and end of the lead window and the point closest to the
+    ideal lead only ever move forward: the whole plan takes one pass over the timeline plus a few steps per target.
+
+    :param oracle: Oracle to plan with
+    :param mode: Update to plan for (must be major or minor)
+    :param targets: Iterable of target region names or table indices
+    :param min_lead: Minimum seconds a trigger must update before its target
+    :param max_lead: Maximum seconds a trigger may update before its target
+    :param ideal: Preferred lead in seconds. Defaults to the middle of the window.
+    :param fallbacks: Number of alternative triggers to give after the best one
+    :param triggers: Iterable of region names or table indices that may be used as triggers. If None, any region.
+    :return: List of (target index, target time, [(trigger index, lead), ...]) tuples in update order. Triggers are
+             best first; the list is empty if no region updates within the window.
+    """
+    if ideal is None:
+        ideal = (min_lead + max_lead) / 2
+    times = oracle.get_times(mode)
+    targets = sorted(set(oracle.select(targets)))
+    candidates = range(len(times)) if triggers is None else sorted(set(oracle.select(triggers)))
+    count = len(candidates)
+
+    plans = []
+    first = stop = middle = 0
+    for target in targets:
+        t = times[target]
+        # window of candidates is [first, stop); middle is the first candidate at or after the ideal time
+        while first < count and times[candidates[first]] < t - max_lead:
+            first += 1
+        while stop < count and times[candidates[stop]] <= t - min_lead:
+            stop += 1
+        middle = max(middle, first)
+        while middle < stop and times[candidates[middle]] < t - ideal:
+            middle += 1
+
+        # take the candidates closest to the ideal lead, working outwards from middle
+        chosen = []
+        left, right = middle - 1, middle
+        while len(chosen) <= fallbacks and (left >= first or right < stop):
+            if right >= stop or (left >= first and
+                                 (t - ideal) - times[candidates[left]] <= times[candidates[right]] - (t - ideal)):
+                i = candidates[left]
+                left -= 1
+            else:
+                i = candidates[right]
+                right += 1
+            if i != target:
+                chosen.append((i, t - times[i]))
+        plans.append((target, t, chosen))
+    return plans
+
+
+def columns(fallbacks):
+    """
+    Gets the export columns for a trigger plan with a given number of fallbacks.
+    """
+    result = [('target', 'Target', 'region'),
+              ('target_time', 'Target Time', 'str'),
+              ('trigger', 'Trigger', 'region'),
+              ('trigger_time', 'Trigger Time', 'str'),
+              ('lead', 'Lead', 'float')]
+    for n in range(1, fallbacks + 1):
+        result += [('fallback_{}'.format(n), 'Fallback {}'.format(n), 'region'),
+                   ('fallback_{}_lead'.format(n), 'Fallback {} Lead'.format(n), 'float')]
+    return tuple(result)
+
+
+def rows(oracle, plans, fallbacks):
+    """
+    Generates export rows for trigger plans. Missing triggers and their leads are None, which exports leave blank.
+
+    :return: Generator of rows matching columns(fallbacks)
+    """
+    names = oracle.table.names
+
+    def hms(seconds):
+        seconds = int(seconds)
+        return "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    for target, t, chosen in plans:
+        chosen = chosen + [None] * (fallbacks + 1 - len(chosen))
+        best = chosen[0]
+        row = [names[target], hms(t),
+               names[best[0]] if best else None, hms(t - best[1]) if best else None, best[1] if best else None]
+        for trigger in chosen[1:]:
+            row += [names[trigger[0]], trigger[1]] if trigger else [None, None]
+        yield tuple(row)
+
+
+def export_plan(oracle, path, fmt=None, mode='major', targets=None, min_lead=MIN_LEAD, max_lead=MAX_LEAD,
+                ideal=None, fallbacks=2, triggers=None):
+    """
+    Plans triggers and streams the plan to a file in any export format.
+
+    :param path: Path to write to
+    :param fmt: Export format (a key of export.WRITERS). Guessed from the path if not given.
+    :param targets: Iterable of target region names or table indices
+    :return: Number of targets planned
+    """
+    fmt = fmt or export.format_for(path)
+    if fmt not in export.WRITERS:
+        raise ValueError("Unknown export format '{}'".format(fmt))
+    plans = plan(oracle, mode, targets, min_lead, max_lead, ideal, fallbacks, triggers)
+    title = (mode, datetime.date.today().strftime("%B %d-%Y"), "lead {}-{} s".format(min_lead, max_lead))
+    export.write_table(path, fmt, columns(fallbacks), rows(oracle, plans, fallbacks), title)
+    return len(plans)
@@ -0,0 +1,201 @@
+import array
+import datetime
+import math
+import os
+import struct
+import threading
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class History:
+    MODES = ('major', 'minor')
+
+    # file format: header, then one fixed size record per update
+    magic = b'ORCH'
+    version = 1
+    file_header = struct.Struct('=4sI')
+    # day (proleptic ordinal), mode, observation count, fitted update length, then the calibration's weighted sums of
+    # weight, x, y, x * x, x * y and y * y
+    file_record = struct.Struct('=iB3xqd6d')
+    SUMS = ('weight', 'sx', 'sy', 'sxx', 'sxy', 'syy')
+
+    def __init__(self, path, keep=730, half_life=14.0):
+        """
+        Compact on-disk history of past updates. Each update is stored as one fixed size record holding its fitted
+        length and the running sums of its calibration model (see calibration.Calibration), which is all a fit needs:
+        no individual observation is kept. A year of twice daily updates takes about 50 KB.
+
+        Records are held in memory as one packed array per field, so fits across many days are a handful of passes
+        over flat arrays.
+
+        :param path: Path of history file. It is created when the first update is recorded.
+        :param keep: Days of history to keep. Older records are dropped when the file is opened.
+        :param half_life: Age in days at which an update counts half as much as today's in fits
+        """
+        self.path = path
+        self.keep = keep
+        self.half_life = half_life
+        self.lock = threading.Lock()
+
+        self._clear()
+        # True until the file on disk is known to match the records held here; records are then written in place
+        self.stale = True
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return
+        size = self.file_header.size
+        if len(data) < size or self.file_header.unpack_from(data) != (self.magic, self.version):
+            return
+        end = size + (len(data) - size) // self.file_record.size * self.file_record.size
+        records = list(self.file_record.iter_unpack(data[size:end]))
+
+        # drop what has aged out, rewriting the file without it
+        latest = max((values[0] for values in records), default=0)
+        kept = [values for values in records if latest - values[0] <= keep]
+        for values in kept:
+            self._append(values)
+        self.stale = len(kept) < len(records) or end < len(data)
+        if self.stale:
+            self._rewrite()
+
+    def _clear(self):
+        self.days = array.array('i')
+        self.modes = array.array('B')
+        self.counts = array.array('q')
+        self.lengths = array.array('d')
+        self.sums = {name: array.array('d') for name in self.SUMS}
+        # (day, mode) -> row
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.days)
+
+    def _append(self, values):
+        day, mode, count, length = values[:4]
+        self.rows[(day, mode)] = len(self.days)
+        self.days.append(day)
+        self.modes.append(mode)
+        self.counts.append(count)
+        self.lengths.append(length)
+        for name, value in zip(self.SUMS, values[4:]):
+            self.sums[name].append(value)
+
+    def _values(self, row):
+        return ((self.days[row], self.modes[row], self.counts[row], self.lengths[row]) +
+                tuple(self.sums[name][row] for name in self.SUMS))
+
+    def _rewrite(self):
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as out:
+            out.write(self.file_header.pack(self.magic, self.version))
+            for row in range(len(self.days)):
+                out.write(self.file_record.pack(*self._values(row)))
+        os.replace(temp, self.path)
+        self.stale = False
+
+    def record(self, day, mode, calibration):
+        """
+        Stores the state of an update's calibration, replacing anything stored for the same update before. Only the
+        changed record is written.
+
+        :param day: datetime.date of the update (UTC)
+        :param mode: Update (must be major or minor)
+        :param calibration: calibration.Calibration of the update
+        """
+        values = ((day.toordinal(), self.MODES.index(mode), calibration.count, calibration.speed) +
+                  tuple(getattr(calibration, name) for name in self.SUMS))
+        with self.lock:
+            row = self.rows.get(values[:2])
+            if row is None:
+                row = len(self.days)
+                self._append(values)
+            else:
+                self.counts[row], self.lengths[row] = values[2:4]
+                for name, value in zip(self.SUMS, values[4:]):
+                    self.sums[name][row] = value
+
+            if self.stale:
+                self._rewrite()
+                return
+            with open(self.path, 'r+b') as f:
+                f.seek(self.file_header.size + row * self.file_record.size)
+                f.write(self.file_record.pack(*values))
+
+    def restore(self, day, mode, calibration):
+        """
+        Loads an update's stored sums back into its calibration model, e.g. after a restart during the update.
+
+        :param day: datetime.date of the update (UTC)
+        :param mode: Update (must be major or minor)
+        :param calibration: calibration.Calibration to restore into
+        :return: True if anything was stored for the update
+        """
+        row = self.rows.get((day.toordinal(), self.MODES.index(mode)))
+        if row is None or not self.counts[row]:
+            return False
+        calibration.restore(self.counts[row], *(self.sums[name][row] for name in self.SUMS))
+        return True
+
+    def updates(self, mode):
+        """
+        Gets the stored update lengths of an update.
+
+        :param mode: Update (must be major or minor)
+        :return: List of (datetime.date, fitted update length in seconds, observation count) tuples, oldest first
+        """
+        code = self.MODES.index(mode)
+        return sorted((datetime.date.fromordinal(self.days[row]), self.lengths[row], self.counts[row])
+                      for row in range(len(self.days)) if self.modes[row] == code and self.counts[row])
+
+    def fit(self, mode, speed, today=None, before=None):
+        """
+        Fits update length and offset across every stored update of a mode, weighting each update by its age. The
+        start of an update drifts from day to day, so each update keeps its own intercept: the length is the slope of
+        a fit to the observations of all days after removing each day's mean, and the offset is the weighted mean
+        of each day's offset at that length.
+
+        :param mode: Update (must be major or minor)
+        :param speed: Update length in seconds to use if no stored update had observations spread widely enough to
+                      measure it
+        :param today: datetime.date to measure ages from. Defaults to today (UTC).
+        :param before: Only use updates before this datetime.date, e.g. to leave out one being restored
+        :return: Tuple (update length, offset) in seconds, or None if nothing usable is stored
+        """
+        today = (today or datetime.datetime.utcnow().date()).toordinal()
+        before = before.toordinal() if before is not None else today + 1
+        code = self.MODES.index(mode)
+        with self.lock:
+            rows = [row for row in range(len(self.days))
+                    if self.modes[row] == code and self.days[row] < before and self.sums['weight'][row] > 0]
+            if not rows:
+                return None
+            weight, sx, sy, sxx, sxy = ([self.sums[name][row] for row in rows]
+                                        for name in ('weight', 'sx', 'sy', 'sxx', 'sxy'))
+            decay = [0.5 ** ((today - self.days[row]) / self.half_life) for row in rows]
+
+        # within-day sums of squares and cross products
+        spread = math.fsum(map(lambda d, w, x, xx: d * (xx - x * x / w), decay, weight, sx, sxx))
+        cross = math.fsum(map(lambda d, w, x, y, xy: d * (xy - x * y / w), decay, weight, sx, sy, sxy))
+        # a day needs observations covering a fair part of the update before it says anything about the length
+        if spread > 1e-3 * math.fsum(decay) and cross > 0:
+            speed = cross / spread
+
+        offset = -math.fsum(map(lambda d, w, x, y: d * (y - speed * x) / w, decay, weight, sx, sy)) / math.fsum(decay)
+        return speed, offset
@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+
+# Oracle 2 NationStates Update Prediction Framework
+# Copyright (c) 2017 Khronion <khronion@gmail.com>
+#
+# Oracle2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Oracle2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Oracle2.  If not, see <http://www.gnu.org/licenses/>.
+
+# record kinds. every record also carries "k" (kind), "t" (wall clock timestamp) and "m" (update mode).
+HEADER = 'h'  # "d": dump path, "v": trace format version
+OBSERVATION = 'o'  # "r": region, "y": observed update time, "p": time predicted just before the observation
+PREDICTION = 'p'  # "r": region, "p": predicted update time
+CALIBRATION = 'c'  # "s": update length, "o": offset, "n": nudge
+POPULATION = 'n'  # "r": region, "d": change in population
+
+VERSION = 2
+
+
+class TraceWriter:
+    def __init__(self, path, dump=None):
+        """
+        Append-only trace of what happened during an update, one compact JSON record per line. Records are flushed as
+        they are written so a crash loses at most the record being written. See replay.py for reading traces back.
+
+        :param path: Path to trace file. Existing traces are appended to.
+        :param dump: Path of the regions dump in use, recorded in the trace header
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.out = open(path, 'a', encoding='utf-8')
+        self.write(HEADER, None, d=dump, v=VERSION)
+
+    def write(self, kind, mode, **fields):
+        record = {'k': kind, 't': round(time.time(), 3), 'm': mode}
+        record.update(fields)
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        with self.lock:
+            self.out.write(line)
+            self.out.flush()
+
+    def observation(self, mode, region, observed, predicted):
+        self.write(OBSERVATION, mode, r=region, y=observed, p=predicted)
+
+    def prediction(self, mode, region, predicted):
+        self.write(PREDICTION, mode, r=region, p=predicted)
+
+    def calibration(self, mode, speed, offset, nudge):
+        self.write(CALIBRATION, mode, s=speed, o=offset, n=nudge)
+
+    def population(self, mode, region, delta):
+        self.write(POPULATION, mode, r=region, d=delta)
+
+    def close(self):
+        with self.lock:
+            self.out.close()
+
+
+def read(path):
+    """
+    Reads a trace file. Records cut short by a crash are skipped.
+
+    :param path: Path to trace file
+    :return: Generator of record dictionaries
+    """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue